@@ -29,6 +29,61 @@ def create_app(config_name='default'):
     # Set login view based on blueprint
     login_manager.login_view = 'main.login'
     
+    # Configure dispatch services
+    from app.utils.distance_matrix import distance_matrix
+    distance_matrix.init_app(app)
+    
+    from app.utils.graph_updates import graph_editor
+    graph_editor.init_app(app)
+    
+    from app.utils.spatial_index import spatial_index
+    spatial_index.init_app(app)
+    
+    from app.utils.travel_times import travel_times
+    travel_times.init_app(app)
+    
+    from app.utils.route_solver import route_solver
+    route_solver.init_app(app)
+    
+    from app.utils.route_cache import route_cache
+    route_cache.init_app(app)
+    
+    from app.utils.dispatch_trace import dispatch_tracer
+    dispatch_tracer.init_app(app)
+    
+    from app.utils.decision_log import decision_log
+    decision_log.init_app(app)
+    
+    from app.utils.zones import zone_index
+    zone_index.init_app(app)
+    
+    from app.utils.nearest_drivers import nearest_drivers
+    nearest_drivers.init_app(app)
+    
+    from app.utils.sourcing import sourcing_optimizer
+    sourcing_optimizer.init_app(app)
+    
+    from app.utils.parallel_dispatch import parallel_evaluator
+    parallel_evaluator.init_app(app)
+    
+    from app.utils.vrp import vrp_solver
+    vrp_solver.init_app(app)
+    
+    from app.utils.insertion import insertion_dispatcher
+    insertion_dispatcher.init_app(app)
+    
+    from app.utils.rebalancing import demand_rebalancer
+    demand_rebalancer.init_app(app)
+    
+    from app.utils.pending_dispatch import pending_dispatcher
+    pending_dispatcher.init_app(app)
+    
+    from app.utils.batch_dispatch import batch_dispatcher
+    batch_dispatcher.init_app(app)
+    
+    from app.utils.dispatch_worker import dispatch_worker
+    dispatch_worker.init_app(app)
+    
     # Register blueprints
     from app.main import main as main_blueprint
     app.register_blueprint(main_blueprint)
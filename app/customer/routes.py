@@ -1,11 +1,25 @@
-from flask import render_template, flash, redirect, url_for, request, session
+from flask import render_template, flash, redirect, url_for, request, session, current_app
 from flask_login import login_required, current_user
 from app.customer import customer
-from app.models.stores import stores, orders, generate_order_id
+from app.models.stores import stores, orders, generate_order_id, index_active_order, queue_pending_order, AWAITING_ASSIGNMENT
 from app.models.users import users, FAKE_BANK_ACCOUNTS
-from app.utils.algo import assign_driver
+from app.utils.algo import assign_driver, customer_destination, order_eta
+from app.utils.batch_dispatch import batch_dispatcher
+from app.utils.dispatch_worker import dispatch_worker
+from app.utils.insertion import insertion_dispatcher
+from app.utils.rebalancing import demand_rebalancer
+from app.utils.sourcing import sourcing_optimizer
+from app.utils.vrp import vrp_solver
 from datetime import datetime
 
+def customer_location_of(username):
+    return next((user.get('location') for user in users if user['username'] == username), None)
+
+def source_cart(cart):
+    """Move cart lines to the stores that minimise item prices plus delivery distance."""
+    customer_node = customer_destination(current_user.id, customer_location_of(current_user.id))
+    return sourcing_optimizer.source_cart(cart, customer_node)
+
 @customer.route('/dashboard')
 @login_required
 def customer_dashboard():
@@ -106,7 +120,8 @@ def view_cart():
     if 'cart' not in session:
         session['cart'] = {}
     
-    cart_items = session.get('cart', {})
+    cart_items = source_cart(session.get('cart', {}))
+    session['cart'] = cart_items
     subtotal = sum(item['final_price'] * item['quantity'] for item in cart_items.values())
     return render_template('customer/cart.html', subtotal=subtotal)
 
@@ -177,6 +192,8 @@ def process_purchase():
         flash('Your cart is empty.', 'warning')
         return redirect(url_for('customer.customer_dashboard'))
 
+    # Stock or the road network may have changed since the cart was viewed
+    cart = source_cart(cart)
     subtotal = sum(item['final_price'] * item['quantity'] for item in cart.values())
 
     # Payment Processing with Balance Check
@@ -243,11 +260,7 @@ def process_purchase():
     
     # Create order structure
     order_id = generate_order_id()
-    customer_location = None
-    for user in users:
-        if user['username'] == current_user.id:
-            customer_location = user.get('location')
-            break
+    customer_location = customer_location_of(current_user.id)
     
     # Group cart items by store
     items_by_store = {}
@@ -258,20 +271,36 @@ def process_purchase():
         items_by_store[store_id][item_name] = item['quantity']
 
     # Create order object for driver assignment
+    placed_at = datetime.now()
     order = {
         "order_id": order_id,
         "customer_id": current_user.id,
         "customer_location": customer_location,
         "items_by_store": items_by_store,
+        "promised_by": vrp_solver.promised_by(placed_at),
     }
+    demand_rebalancer.record_order(order, placed_at)
     
-    # Assign driver using Dijkstra's algorithm and get optimized store order
-    assigned_driver, optimized_store_order = assign_driver(order)
+    # In 'batch' and 'async' mode the driver is assigned in the background
+    # after this request returns; 'immediate' assigns before redirecting
+    dispatch_mode = current_app.config.get('DISPATCH_MODE')
+    deferred = dispatch_mode in ('batch', 'async')
     
-    if assigned_driver:
-        flash(f"Order placed successfully! Assigned to {assigned_driver}.", 'success')
+    if deferred:
+        assigned_driver, optimized_store_order = None, []
+        flash("Order placed successfully! A driver will be assigned shortly.", 'success')
     else:
-        flash("Order placed successfully! No drivers available at this moment.", 'warning')
+        # Assign driver using Dijkstra's algorithm and get optimized store order
+        if insertion_dispatcher.enabled:
+            assigned_driver, optimized_store_order = insertion_dispatcher.assign(order)
+        else:
+            assigned_driver, optimized_store_order = assign_driver(order)
+        
+        if assigned_driver:
+            flash(f"Order placed successfully! Assigned to {assigned_driver}.", 'success')
+        else:
+            flash("Order placed successfully! No drivers available at this moment, "
+                  "it will be assigned as soon as one is free.", 'warning')
     
     # Create new order in the orders dictionary with optimized store order
     orders[order_id] = {
@@ -281,12 +310,21 @@ def process_purchase():
         "items_by_store": items_by_store,
         "optimized_store_order": optimized_store_order,  # Add the optimized store order
         "delivery_agent": assigned_driver,
-        "status": "processing",
+        "status": AWAITING_ASSIGNMENT if deferred else "processing",
         "delivered": False,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": placed_at.isoformat(),
+        "promised_by": order["promised_by"],
         "payment_method": payment_method,
         "total_amount": subtotal
     }
+    index_active_order(order_id, orders[order_id])
+    if not deferred and not assigned_driver:
+        queue_pending_order(order_id, orders[order_id])
+    
+    if dispatch_mode == 'batch':
+        batch_dispatcher.submit(order)
+    elif dispatch_mode == 'async':
+        dispatch_worker.submit(order)
 
     # Reduce Stock and prepare order details for email
     order_details = ""
@@ -341,6 +379,7 @@ def track_order(order_id):
     return render_template('customer/track_order.html', 
                          order=order,
                          delivery_agent=delivery_agent,
+                         eta_minutes=order_eta(order),
                          stores=stores)
 
 @customer.route('/orders')
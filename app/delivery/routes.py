@@ -2,7 +2,9 @@ from flask import render_template, flash, redirect, url_for, request
 from flask_login import login_required, current_user
 from app.delivery import delivery
 from app.models.stores import stores, orders
-from app.models.users import users
+from app.models.users import graph_positions
+from app.utils.pending_dispatch import complete_delivery
+from app.utils.rebalancing import demand_rebalancer
 
 @delivery.route('/dashboard')
 @login_required
@@ -16,9 +18,13 @@ def delivery_agent_dashboard():
                       and not o['delivered']]
     
     print("Assigned orders:", assigned_orders)
+    # Idle drivers are pointed to where the next orders are expected
+    waiting_spot = None if assigned_orders else demand_rebalancer.target_of(current_user.id)
     return render_template('delivery/dashboard.html',
                          orders=assigned_orders,
-                         stores=stores)
+                         stores=stores,
+                         waiting_spot=waiting_spot,
+                         waiting_spot_location=graph_positions.get(waiting_spot))
 
 @delivery.route('/mark_delivered/<order_id>', methods=['POST'])
 @login_required
@@ -36,13 +42,8 @@ def mark_delivered(order_id):
         flash('This order is not assigned to you.', 'danger')
         return redirect(url_for('delivery.delivery_agent_dashboard'))
 
-    order["delivered"] = True
-    customer_location = order["customer_location"]
-
-    for user in users:
-        if user["username"] == current_user.id:
-            user["location"] = customer_location
-            break
+    # Frees the driver and hands them the oldest pending order they can take
+    complete_delivery(order_id, order)
 
     flash('Order marked as delivered!', 'success')
     return redirect(url_for('delivery.delivery_agent_dashboard'))
@@ -61,11 +62,7 @@ def update_order_status(order_id):
         order['status'] = 'collected'
     elif new_status == 'delivered':
         order['status'] = 'delivered'
-        order['delivered'] = True
-        for user in users:
-            if user['username'] == current_user.id:
-                user['location'] = order['customer_location']
-                break
+        complete_delivery(order_id, order)
     
     flash(f'Order status updated to {new_status}', 'success')
     return redirect(url_for('delivery.delivery_agent_dashboard'))
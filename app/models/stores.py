@@ -1,4 +1,5 @@
 # Stores data with inventory and location coordinates
+from collections import OrderedDict
 from uuid import uuid4
 
 stores = {
@@ -58,6 +59,93 @@ stores = {
 
 orders = {}
 
+# Status of an order that has been paid for but not handed to a driver yet
+# (asynchronous or batch dispatch); becomes "processing" once assigned
+AWAITING_ASSIGNMENT = "awaiting assignment"
+
+# Orders no driver could be found for, oldest first: {order_id: order}.
+# They stay AWAITING_ASSIGNMENT and are offered to delivery agents as they
+# finish deliveries (app/utils/pending_dispatch.py).
+pending_orders = OrderedDict()
+
+# Orders that are assigned but not delivered yet, per delivery agent:
+# {driver_username: {order_id: order}} in the order they were assigned.
+# Kept up to date by index_active_order() / release_active_order() so dispatch
+# never has to scan the whole order history.
+active_orders_by_driver = {}
+
+# Stops each delivery agent still has to make, in visiting order, when orders are
+# dispatched by cheapest insertion: {driver_username: [stop, ...]} where a stop is
+# {"order_id": ..., "node": graph node, "store_id": store to pick up from, or None
+# for the drop-off at the customer}. Stops leave the plan when their order is delivered.
+planned_stops_by_driver = {}
+
+# Callbacks run with a delivery agent's username whenever their active orders
+# change, e.g. so the zone index can move them to the zone they now start from
+driver_listeners = []
+
 # Generate unique order IDs
 def generate_order_id():
     return "ORD-" + str(uuid4())[:8].upper()
+
+# Active order index helpers
+def index_active_order(order_id, order):
+    """Record an order as in progress for its delivery agent."""
+    driver = order.get('delivery_agent')
+    if driver:
+        active_orders_by_driver.setdefault(driver, {})[order_id] = order
+        for listener in driver_listeners:
+            listener(driver)
+
+def release_active_order(order_id, order):
+    """Remove a delivered (or reassigned) order from its delivery agent's active orders and planned stops."""
+    active = active_orders_by_driver.get(order.get('delivery_agent'))
+    if active is not None:
+        active.pop(order_id, None)
+        if not active:
+            del active_orders_by_driver[order['delivery_agent']]
+    
+    plan = planned_stops_by_driver.get(order.get('delivery_agent'))
+    if plan is not None:
+        plan[:] = [stop for stop in plan if stop['order_id'] != order_id]
+        if not plan:
+            del planned_stops_by_driver[order['delivery_agent']]
+    
+    if order.get('delivery_agent'):
+        for listener in driver_listeners:
+            listener(order['delivery_agent'])
+
+def queue_pending_order(order_id, order):
+    """Park an order that has no driver until one frees up."""
+    order['status'] = AWAITING_ASSIGNMENT
+    pending_orders[order_id] = order
+
+def record_assignment(order_id, driver, optimized_store_order):
+    """
+    Store the result of a deferred dispatch on an order waiting for a driver.
+    An order nobody could take goes to the pending queue instead.
+    """
+    order = orders.get(order_id)
+    if order is None:
+        return None
+    if driver is None:
+        queue_pending_order(order_id, order)
+        return order
+    pending_orders.pop(order_id, None)
+    order['delivery_agent'] = driver
+    order['optimized_store_order'] = optimized_store_order
+    if order.get('status') == AWAITING_ASSIGNMENT:
+        order['status'] = "processing"
+    index_active_order(order_id, order)
+    return order
+
+def active_orders(driver_username):
+    """A delivery agent's undelivered orders as {order_id: order}, oldest first."""
+    return active_orders_by_driver.get(driver_username, {})
+
+def current_order(driver_username):
+    """The oldest undelivered order of a delivery agent, or None if they are free."""
+    active = active_orders_by_driver.get(driver_username)
+    if not active:
+        return None
+    return next(iter(active.values()))
@@ -1,19 +1,48 @@
-from app.models.stores import orders
-from app.models.users import users, delivery_graph, graph_positions
+from app.models.stores import active_orders, current_order
+from app.models.users import users
+from app.utils.decision_log import decision_log
+from app.utils.dispatch_trace import dispatch_tracer
+from app.utils.distance_matrix import distance_matrix
+from app.utils.nearest_drivers import nearest_drivers
+from app.utils.parallel_dispatch import parallel_evaluator
+from app.utils.route_cache import route_cache
+from app.utils.route_solver import route_solver
+from app.utils.spatial_index import spatial_index
+from app.utils.travel_times import travel_times
+from app.utils.zones import zone_index
 import heapq
-import itertools
-import networkx as nx
+import math
+import threading
+import time
+import numpy as np
 
-def assign_driver(order):
+# Held while a deferred dispatch computes and records an assignment, so that
+# concurrent dispatchers never hand the same idle driver two orders at once
+dispatch_lock = threading.RLock()
+
+def customer_destination(customer_id, customer_location):
+    """Graph node a customer's deliveries end at."""
+    # Snap the customer's coordinates to the nearest graph node
+    customer_node = spatial_index.nearest_node(customer_location)
+    if customer_node is None:
+        customer_node = f"Customer {customer_id[-1]}"  # Assuming customer_id ends with a number
+    return customer_node
+
+def routing_snapshot():
     """
-    Assigns the optimal driver to an order using a modified Traveling Salesman Problem approach.
-    Returns a tuple of (driver_username, optimized_store_order) where optimized_store_order is a list
-    of store IDs in the order they should be visited.
+    Shortest paths dispatch ranks drivers on: travel times in minutes for the
+    current time of day when DISPATCH_OBJECTIVE is 'eta', kilometres otherwise.
     """
-    
-    # Get customer location
-    customer_id = order['customer_id']
-    customer_node = f"Customer {customer_id[-1]}"  # Assuming customer_id ends with a number
+    if travel_times.enabled:
+        return travel_times.snapshot()
+    return distance_matrix.snapshot()
+
+def order_stops(order):
+    """
+    Returns (customer_node, stores_to_visit, store_id_mapping) for an order, where
+    stores_to_visit are graph nodes and store_id_mapping maps them back to store IDs.
+    """
+    customer_node = customer_destination(order['customer_id'], order.get('customer_location'))
     
     # Get stores that need to be visited
     stores_to_visit = []
@@ -24,122 +53,314 @@ def assign_driver(order):
         stores_to_visit.append(store_node)
         store_id_mapping[store_node] = store_id
     
-    # Find all delivery agents
-    all_drivers = [user for user in users if user['user_type'] == 'Delivery Agent']
+    return customer_node, stores_to_visit, store_id_mapping
+
+def driver_start(driver):
+    """
+    Returns (priority, driver_node): where the driver would start a new order from,
+    with priority 1 for available drivers and 2 for drivers still busy with an order.
+    """
+    # Check if driver is already assigned to a previous order (O(1) via the active order index)
+    assigned_order = current_order(driver['username'])
     
-    if not all_drivers:
-        return None, []
+    # Determine driver's current/starting location node
+    if assigned_order:
+        # If driver is already assigned, use customer location of current assignment
+        driver_location = assigned_order['customer_location']
+        priority = 2  # Lower priority for already assigned drivers
+    else:
+        # If driver is available, use their current location
+        driver_location = driver['location']
+        priority = 1  # Higher priority for available drivers
     
-    # Create a priority queue for drivers
-    driver_queue = []
-    best_routes = {}  # Store the best route for each driver
-    
-    for driver in all_drivers:
-        # Check if driver is already assigned to a previous order
-        assigned_order = next((o for o in orders.values() 
-                              if o['delivery_agent'] == driver['username'] 
-                              and o['status'] != 'delivered' 
-                              and not o['delivered']), None)
-        
-        # Determine driver's current/starting location node
-        if assigned_order:
-            # If driver is already assigned, use customer location of current assignment
-            driver_location = assigned_order['customer_location']
-            priority = 2  # Lower priority for already assigned drivers
+    # Find the closest node to driver's coordinates
+    driver_node = spatial_index.nearest_node(driver_location) or "Admin Office"  # Default starting point
+    
+    return priority, driver_node
+
+def best_route(shortest_paths, driver_node, stores_to_visit, customer_node, deadline=None):
+    """
+    Returns (distance, store_nodes) for the shortest route from driver_node through
+    every store to the customer, or (inf, None) if there is no such route.
+    deadline bounds the heuristic for large orders (see RouteSolver.solve).
+    """
+    # Orders of the same shape from the same start reuse the solved route
+    key = (driver_node, frozenset(stores_to_visit), customer_node, shortest_paths.version)
+    cached = route_cache.get(key)
+    trace = dispatch_tracer.current()
+    if cached is not None:
+        if trace is not None:
+            trace.count('cache_hits')
+        distance, route = cached
+        return distance, list(route) if route is not None else None
+    
+    distance, route = solve_route(shortest_paths, driver_node, stores_to_visit, customer_node, deadline)
+    if trace is not None:
+        count_solved(trace, 1, len(stores_to_visit))
+    route_cache.put(key, (distance, tuple(route) if route is not None else None))
+    return distance, route
+
+def solve_route(shortest_paths, driver_node, stores_to_visit, customer_node, deadline=None):
+    """best_route without the cache."""
+    # Check if all paths from driver to stores are impossible
+    if all(shortest_paths.distance(driver_node, store) == float('inf') for store in stores_to_visit):
+        return float('inf'), None
+    
+    # The route solver is exact for small orders (brute force / Held-Karp) and
+    # falls back to a time-bounded nearest neighbour + 2-opt/Or-opt heuristic
+    route_nodes = [driver_node] + stores_to_visit + [customer_node]
+    route_distances = shortest_paths.submatrix(route_nodes)
+    distance, route = route_solver.solve(
+        route_distances, 0, range(1, len(stores_to_visit) + 1), len(route_nodes) - 1, deadline)
+    
+    if route is None:
+        return float('inf'), None
+    return distance, [route_nodes[i] for i in route]
+
+def count_solved(trace, routes, stops):
+    """Count routes solved for a trace, and the permutations scored when they were brute forced."""
+    if not routes:
+        return
+    trace.count('routes_solved', routes)
+    if stops <= route_solver.brute_force_max_stops:
+        trace.count('permutations', routes * math.factorial(stops))
+
+def distance_rows(shortest_paths, sources, targets):
+    """
+    Distances from every source to every target as a len(sources) x len(targets)
+    array. Gathered straight from the matrix of a dense snapshot; snapshots
+    without one (landmark A*) are asked pair by pair.
+    """
+    matrix = getattr(shortest_paths, 'matrix', None)
+    if matrix is None:
+        return np.array([[shortest_paths.distance(source, target) for target in targets] for source in sources],
+                        dtype=float).reshape(len(sources), len(targets))
+    
+    rows = np.array([shortest_paths.index.get(node, -1) for node in sources], dtype=np.int64)
+    columns = np.array([shortest_paths.index.get(node, -1) for node in targets], dtype=np.int64)
+    table = np.full((len(sources), len(targets)), np.inf)
+    known_rows, known_columns = np.flatnonzero(rows >= 0), np.flatnonzero(columns >= 0)
+    if known_rows.size and known_columns.size:
+        table[np.ix_(known_rows, known_columns)] = matrix[np.ix_(rows[known_rows], columns[known_columns])]
+    # Nodes that are not in the graph only reach themselves
+    for i in np.flatnonzero(rows < 0):
+        for j, target in enumerate(targets):
+            if target == sources[i]:
+                table[i, j] = 0.0
+    return table
+
+def best_routes(shortest_paths, driver_nodes, stores_to_visit, customer_node, deadline=None):
+    """
+    best_route for several start nodes at once, as {driver_node: (distance, store_nodes)}.
+    Starts that are not cached are solved together in one route_solver.solve_many call,
+    sharing one heuristic time budget (or deadline) between them.
+    """
+    routes = {}
+    missing = []
+    for driver_node in dict.fromkeys(driver_nodes):
+        key = (driver_node, frozenset(stores_to_visit), customer_node, shortest_paths.version)
+        cached = route_cache.get(key)
+        if cached is None:
+            missing.append(driver_node)
         else:
-            # If driver is available, use their current location
-            driver_location = driver['location']
-            priority = 1  # Higher priority for available drivers
+            distance, route = cached
+            routes[driver_node] = distance, list(route) if route is not None else None
+    trace = dispatch_tracer.current()
+    if trace is not None:
+        trace.count('cache_hits', len(routes))
+        count_solved(trace, len(missing), len(stores_to_visit))
+    if not missing:
+        return routes
+    
+    # Rows 0..len(stores_to_visit) are the stores and the customer, followed by
+    # one row per start; columns are only needed for the stores and the customer
+    stop_nodes = stores_to_visit + [customer_node]
+    route_distances = np.vstack([shortest_paths.submatrix(stop_nodes),
+                                 distance_rows(shortest_paths, missing, stop_nodes)])
+    first_start = len(stop_nodes)
+    solved = route_solver.solve_many(
+        route_distances, range(first_start, first_start + len(missing)), range(len(stores_to_visit)),
+        len(stores_to_visit), deadline)
+    
+    for driver_node, (distance, route) in zip(missing, solved):
+        route = [stop_nodes[i] for i in route] if route is not None else None
+        if route is None:
+            distance = float('inf')
+        key = (driver_node, frozenset(stores_to_visit), customer_node, shortest_paths.version)
+        route_cache.put(key, (distance, tuple(route) if route is not None else None))
+        routes[driver_node] = distance, route
+    return routes
+
+def score_drivers(drivers, shortest_paths, stores_to_visit, customer_node, deadline=None):
+    """
+    Returns (priority, distance, driver_username, store_nodes) for every driver
+    in drivers that has a route to the order. deadline bounds the route
+    heuristic for all of them together.
+    """
+    # Large fleets are scored in chunks on a process pool, giving the same
+    # entries as the serial loop (landmark snapshots have no matrix to share)
+    if parallel_evaluator.should_use(len(drivers)) and getattr(shortest_paths, 'matrix', None) is not None:
+        starts = [(driver['username'],) + driver_start(driver) for driver in drivers]
+        return parallel_evaluator.evaluate(shortest_paths, starts, stores_to_visit, customer_node, route_solver,
+                                           deadline)
+    
+    # Every driver's start is solved in one vectorised pass for small orders
+    starts = [(driver['username'],) + driver_start(driver) for driver in drivers]
+    routes = best_routes(shortest_paths, [driver_node for _, _, driver_node in starts],
+                         stores_to_visit, customer_node, deadline)
+    
+    scored = []
+    for username, priority, driver_node in starts:
+        total_distance, route = routes[driver_node]
         
-        driver_node = "Admin Office"  # Default starting point
+        # If no valid route found for this driver
+        if route is None:
+            continue
         
-        # Find the closest node to driver's coordinates
-        for node, pos in graph_positions.items():
-            if pos == driver_location:
-                driver_node = node
+        scored.append((priority, total_distance, username, route))
+    return scored
+
+def candidate_drivers(stores_to_visit):
+    """
+    Delivery agents worth routing for an order with these stores, for callers
+    that score many orders at once: for large fleets the nearest idle drivers
+    (falling back to the zones around the stores, out to a few rings past the
+    first one with an idle driver), otherwise the whole fleet.
+    """
+    if nearest_drivers.should_use():
+        drivers = nearest_drivers.idle_near(stores_to_visit)
+        if drivers:
+            return drivers
+    if zone_index.should_use():
+        drivers, last_ring = [], None
+        for ring, found in zone_index.candidate_rings(stores_to_visit):
+            if last_ring is not None and ring > last_ring:
                 break
+            drivers.extend(found)
+            if last_ring is None and any(not current_order(driver['username']) for driver in found):
+                last_ring = ring + zone_index.extra_rings
+        return drivers
+    return [user for user in users if user['user_type'] == 'Delivery Agent']
+
+def assign_driver(order, drivers=None):
+    """
+    Assigns the optimal driver to an order using a modified Traveling Salesman Problem approach.
+    Returns a tuple of (driver_username, optimized_store_order) where optimized_store_order is a list
+    of store IDs in the order they should be visited.
+    drivers restricts the search to those delivery agents (default: the whole fleet).
+    """
+    
+    # None unless DISPATCH_TRACE_ENABLED; then every phase below is timed
+    trace = dispatch_tracer.begin(order)
+    started = time.perf_counter() if decision_log.enabled else None
+    requested = drivers
+    # One heuristic time budget for the whole dispatch, however many drivers are routed
+    deadline = route_solver.deadline()
+    
+    customer_node, stores_to_visit, store_id_mapping = order_stops(order)
+    
+    # All shortest path lengths come from the cached all-pairs matrix, which is
+    # only rebuilt when the delivery graph (or, for ETAs, the time bucket) changes
+    shortest_paths = routing_snapshot()
+    if trace is not None:
+        trace.mark('distances')
+    
+    # Create a priority queue for drivers
+    driver_queue = []
+    driver_routes = {}  # Store the best route for each driver
+    
+    def push(drivers):
+        if trace is not None:
+            trace.mark('candidates')
+            trace.count('drivers', len(drivers))
+        scored = score_drivers(drivers, shortest_paths, stores_to_visit, customer_node, deadline)
+        if trace is not None:
+            trace.mark('routes')
+            trace.candidates.extend((priority, distance, username) for priority, distance, username, _ in scored)
         
-        # Pre-compute all pairwise shortest paths using Floyd-Warshall algorithm
-        # This is more efficient than running Dijkstra's multiple times
-        shortest_paths = {}
-        for source in delivery_graph.nodes():
-            shortest_paths[source] = {}
-            for target in delivery_graph.nodes():
-                if source == target:
-                    shortest_paths[source][target] = 0
-                    continue
-                
-                try:
-                    # Calculate shortest path length between source and target
-                    path_length = nx.shortest_path_length(delivery_graph, source, target, weight='weight')
-                    shortest_paths[source][target] = path_length
-                except nx.NetworkXNoPath:
-                    shortest_paths[source][target] = float('inf')
-                except nx.NetworkXError:
-                    # Handle any other NetworkX-related errors
-                    shortest_paths[source][target] = float('inf')
-        
-        # Check if all paths from driver to stores are impossible
-        if all(shortest_paths[driver_node][store] == float('inf') for store in stores_to_visit):
-            continue  # Skip this driver if they can't reach any store
-        
-        # If there are only a few stores (≤ 4), we can try all permutations
-        # Otherwise, use a nearest neighbor heuristic which is faster
-        if len(stores_to_visit) <= 4:
-            # Modified TSP approach - try all permutations of store visits
-            best_route = None
-            best_distance = float('inf')
-            
-            for perm in itertools.permutations(stores_to_visit):
-                current_distance = shortest_paths[driver_node][perm[0]]  # Distance from driver to first store
-                
-                if current_distance == float('inf'):
-                    continue  # Skip this permutation if the first leg is impossible
-                
-                # Add distances between consecutive stores
-                valid_route = True
-                for i in range(len(perm) - 1):
-                    leg_distance = shortest_paths[perm[i]][perm[i+1]]
-                    if leg_distance == float('inf'):
-                        valid_route = False
-                        break  # Skip this permutation if any leg is impossible
-                    current_distance += leg_distance
-                
-                if not valid_route:
-                    continue
-                
-                # Add distance from last store to customer
-                final_leg = shortest_paths[perm[-1]][customer_node]
-                if final_leg == float('inf'):
-                    continue  # Skip if can't reach customer
-                
-                current_distance += final_leg
-                
-                if current_distance < best_distance:
-                    best_distance = current_distance
-                    best_route = perm
-            
-            # If no valid route found for this driver
-            if best_route is None:
-                continue
-            
-            # Convert store nodes back to store IDs
-            optimized_store_order = [store_id_mapping[store] for store in best_route]
-            total_distance = best_distance
-            
-            # Store the optimized route for this driver
-            best_routes[driver['username']] = optimized_store_order
+        for priority, total_distance, username, route in scored:
+            # Convert store nodes back to store IDs and store the optimized route for this driver
+            driver_routes[username] = [store_id_mapping[store] for store in route]
             
             # Push driver into priority queue: (priority, distance, driver_username)
             # This ensures drivers with priority 1 (available) are considered first
-            heapq.heappush(driver_queue, (priority, total_distance, driver['username']))
+            heapq.heappush(driver_queue, (priority, total_distance, username))
+    
+    if drivers is None and nearest_drivers.should_use():
+        # Large fleets: a reverse search from the order's stores finds the few
+        # idle drivers with the shortest drive to them, and only those are routed
+        drivers = nearest_drivers.idle_near(stores_to_visit) or None
+    
+    if drivers is not None:
+        push(drivers)
+    elif zone_index.should_use():
+        # Large fleets: only score drivers in the zones around the order's stores,
+        # widening ring by ring until an available driver turns up, then a few more rings
+        last_ring = None
+        for ring, drivers in zone_index.candidate_rings(stores_to_visit):
+            if last_ring is not None and ring > last_ring:
+                break
+            push(drivers)
+            if last_ring is None and driver_queue and driver_queue[0][0] == 1:
+                last_ring = ring + zone_index.extra_rings
+    else:
+        # Find all delivery agents
+        all_drivers = [user for user in users if user['user_type'] == 'Delivery Agent']
+        push(all_drivers)
     
     # Select the driver with highest priority (lowest number) and shortest distance
+    best_driver, route, cost = None, [], None
     if driver_queue:
-        _, _, best_driver = heapq.heappop(driver_queue)
-        return best_driver, best_routes[best_driver]
+        _, cost, best_driver = heapq.heappop(driver_queue)
+        route = driver_routes[best_driver]
+    
+    if trace is not None:
+        trace.mark('selection')
+        dispatch_tracer.finish(trace, best_driver, route)
+    if started is not None:
+        # Inputs and result for offline replay (benchmarks/replay.py)
+        decision_log.record(order, requested, best_driver, route, cost, time.perf_counter() - started)
+    return best_driver, route
+
+# Last ETA worked out per order: {order_id: (key, minutes)}, where key is the
+# travel times version, traffic bucket and route it was computed for
+_eta_cache = {}
+
+def order_eta(order, when=None):
+    """
+    Minutes until order reaches its customer, following the traffic profiles:
+    the driver finishes their earlier orders first, then visits the order's
+    remaining stores and the customer. None if the order has no driver yet or
+    is already delivered.
+
+    The result is reused while the route, the traffic bucket and the profiles
+    stay the same, so reloading the tracking page does not re-run the search.
+    """
+    driver = next((user for user in users if user['username'] == order.get('delivery_agent')), None)
+    if driver is None or order.get('delivered'):
+        _eta_cache.pop(order.get('order_id'), None)
+        return None
+    
+    route = [spatial_index.nearest_node(driver['location']) or "Admin Office"]
+    for order_id, queued in active_orders(driver['username']).items():
+        if queued.get('status') != 'collected':
+            for store_id in queued.get('optimized_store_order') or queued['items_by_store']:
+                route.append(f"Store {chr(64 + int(store_id))}")
+        route.append(customer_destination(queued['customer_id'], queued.get('customer_location')))
+        if queued is order:
+            break
+    else:
+        _eta_cache.pop(order.get('order_id'), None)
+        return None  # Not one of the driver's active orders
     
-    return None, []
+    key = (travel_times.version, travel_times.bucket_of(when), tuple(route))
+    cached = _eta_cache.get(order.get('order_id'))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    minutes = travel_times.route_minutes(route, when)
+    minutes = minutes if minutes < float('inf') else None
+    _eta_cache[order.get('order_id')] = (key, minutes)
+    return minutes
 
 
 """
@@ -163,6 +384,7 @@ Algorithm Workflow
 
 Step 1: Identify Customer and Stores
     The algorithm first identifies the customer's location and all stores that need to be visited based on the order's items
+    Customer and driver coordinates are snapped to the nearest graph node with a k-d tree over graph_positions (app/utils/spatial_index.py)
 
 Step 2: Find Available Drivers
     The algorithm identifies all delivery agents in the system
@@ -173,10 +395,13 @@ Step 3: For Each Driver, Calculate Optimal Route
     If the driver is already assigned to an order, use the customer location of that order
     If the driver is available, use their current location
     Assign priority 1 to available drivers and priority 2 to busy drivers
-    Pre-computes shortest paths between all locations using the Floyd-Warshall algorithm, which is more efficient than running Dijkstra's algorithm multiple times
+    Reads shortest paths between all locations from the cached distance matrix (app/utils/distance_matrix.py), which runs one Dijkstra per source once per graph version instead of once per driver
     Determines the optimal store visit sequence using one of two approaches:
-    For 4 or fewer stores: Uses a brute-force approach by trying all possible permutations of store visits (exact TSP solution)
-    For more than 4 stores: Uses the Nearest Neighbor heuristic (greedy approach) for better performance
+    For 7 or fewer stores: Uses a brute-force approach by trying all possible permutations of store visits (exact TSP solution),
+    scored for every driver at once with NumPy fancy indexing over a cached permutation table
+    For up to 12 stores: Uses the Held-Karp bitmask dynamic program, still exact but O(2^n * n^2) instead of O(n!)
+    For more stores: Uses the Nearest Neighbor heuristic improved with 2-opt and Or-opt moves within a time budget
+    (see app/utils/route_solver.py; the thresholds and budget are configurable)
     Calculates the total route distance:
     Distance from driver's location to first store
     Distances between consecutive stores
@@ -197,9 +422,15 @@ Key Optimization Techniques
 Priority-Based Driver Selection: Favors available drivers over busy ones
 
 Adaptive Route Optimization:
-    Exact solution (brute force) for small problems
-    Heuristic approach (nearest neighbor) for larger problems
-    Pre-computation of Shortest Paths: Uses Floyd-Warshall algorithm to calculate all pairwise shortest paths once
+    Exact solution (brute force, then Held-Karp) for small problems
+    Heuristic approach (nearest neighbor + 2-opt/Or-opt) for larger problems
+    Route Memoisation: Solved routes are kept in an LRU cache keyed on (driver node, set of stores, customer node, graph version) (app/utils/route_cache.py)
+    Pre-computation of Shortest Paths: The all-pairs distance matrix is computed once and shared by every dispatch until the graph changes
+    (graphs of ALT_MIN_NODES or more nodes use landmark A* searches with a pair cache instead, see app/utils/alt_routing.py)
+    Zone Pruning: Fleets of ZONE_MIN_DRIVERS or more drivers are filed in a grid of zones, and only drivers in rings of zones around the order's stores are scored (app/utils/zones.py)
+    Parallel Evaluation: Fleets of PARALLEL_DISPATCH_MIN_DRIVERS or more drivers are scored in chunks on a process pool that memory-maps the same matrix (app/utils/parallel_dispatch.py)
+    Pending Queue: Orders no driver can take are queued oldest first, and each driver who finishes a delivery is scored against just the oldest few of them (app/utils/pending_dispatch.py)
+    Travel Time Dispatch: With DISPATCH_OBJECTIVE = 'eta' drivers are ranked on travel minutes from per-time-bucket edge profiles, with one cached matrix per bucket (app/utils/travel_times.py)
     Complete Route Consideration: Optimizes the entire route from driver → stores → customer
 
 This hybrid approach balances computational efficiency with solution quality, making it suitable for real-time delivery route optimization.
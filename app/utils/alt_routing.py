@@ -0,0 +1,142 @@
+import heapq
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.utils.csr_graph import CSRGraph
+
+# Defaults, overridden from the app config by distance_matrix.init_app()
+ALT_MIN_NODES = 10000  # graphs this large are routed with ALT instead of an all-pairs matrix
+ALT_LANDMARKS = 16
+ALT_PAIR_CACHE_SIZE = 100000
+
+
+def select_landmarks(graph, count):
+    """
+    Farthest-point landmark selection. Each new landmark is the node farthest
+    from all landmarks chosen so far (nodes no landmark reaches come first, so
+    every connected component gets one). Returns (landmarks, distances) with
+    distances[i] the Dijkstra lengths from landmarks[i].
+    """
+    size = graph.number_of_nodes()
+    if not size:
+        return [], []
+
+    # Start from the node farthest from node 0 rather than node 0 itself
+    first = graph.dijkstra(0)
+    finite = np.where(np.isfinite(first), first, -1.0)
+    candidate = int(finite.argmax())
+
+    landmarks, distances = [], []
+    nearest = np.full(size, np.inf)
+    while len(landmarks) < min(count, size):
+        landmarks.append(candidate)
+        distances.append(graph.dijkstra(candidate))
+        nearest = np.minimum(nearest, distances[-1])
+        candidate = int(nearest.argmax())
+        if nearest[candidate] == 0:
+            break  # Every node is a landmark already
+    return landmarks, distances
+
+
+class LandmarkSnapshot:
+    """
+    Point-to-point shortest paths for one version of a large delivery graph.
+
+    Stands in for DistanceSnapshot (same distance() / submatrix() interface)
+    when an all-pairs matrix would not fit in memory. Distances to and from a
+    few landmarks are precomputed, and each query runs A* with the ALT lower
+    bound
+
+        d(v, t) >= max over landmarks l of d(l, t) - d(l, v) and d(v, l) - d(t, l)
+
+    Results are kept in a bounded LRU cache of queried pairs, so memory grows
+    with landmarks x nodes rather than nodes squared.
+    """
+
+    def __init__(self, version, graph, landmarks=ALT_LANDMARKS, pair_cache_size=ALT_PAIR_CACHE_SIZE):
+        if not isinstance(graph, CSRGraph):
+            graph = CSRGraph.from_networkx(graph)
+        self.version = version
+        self.graph = graph
+        self.nodes = graph.nodes()
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.pair_cache_size = pair_cache_size
+
+        self.landmarks, from_landmarks = select_landmarks(graph, landmarks)
+        reverse = graph.reverse()
+        to_landmarks = [reverse.dijkstra(landmark) for landmark in self.landmarks] if graph.directed else from_landmarks
+        # Row v holds d(l, v) / d(v, l) for every landmark l
+        self.from_landmarks = np.array(from_landmarks).T.copy() if self.landmarks else np.zeros((len(self.nodes), 0))
+        self.to_landmarks = np.array(to_landmarks).T.copy() if self.landmarks else np.zeros((len(self.nodes), 0))
+
+        self._pairs = OrderedDict()
+        self._lock = threading.Lock()
+        self.searches = 0
+
+    def lower_bound(self, v, t):
+        """ALT lower bound on d(v, t) for node ids v and t."""
+        with np.errstate(invalid='ignore'):
+            bounds = np.fmax(self.from_landmarks[t] - self.from_landmarks[v],
+                             self.to_landmarks[v] - self.to_landmarks[t])
+        bounds = bounds[~np.isnan(bounds)]
+        return max(float(bounds.max()), 0.0) if bounds.size else 0.0
+
+    def astar(self, source, target):
+        """Shortest path length between node ids, inf if target is unreachable."""
+        self.searches += 1
+        if source == target:
+            return 0.0
+        if self.lower_bound(source, target) == float('inf'):
+            return float('inf')
+
+        indptr, indices, weights = self.graph.indptr, self.graph.indices, self.graph.weights
+        dist = {source: 0.0}
+        settled = set()
+        heap = [(self.lower_bound(source, target), source)]
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == target:
+                return dist[u]
+            settled.add(u)
+            start, end = indptr[u], indptr[u + 1]
+            for v, weight in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                candidate = dist[u] + weight
+                if candidate < dist.get(v, float('inf')):
+                    dist[v] = candidate
+                    bound = self.lower_bound(v, target)
+                    if bound < float('inf'):
+                        heapq.heappush(heap, (candidate + bound, v))
+        return float('inf')
+
+    def distance(self, source, target):
+        """Shortest path length between two nodes, inf if either node is unknown or unreachable."""
+        i = self.index.get(source)
+        j = self.index.get(target)
+        if i is None or j is None:
+            return 0.0 if source == target else float('inf')
+
+        key = (i, j) if self.graph.directed or i <= j else (j, i)
+        with self._lock:
+            if key in self._pairs:
+                self._pairs.move_to_end(key)
+                return self._pairs[key]
+        length = self.astar(*key)
+        with self._lock:
+            self._pairs[key] = length
+            while len(self._pairs) > self.pair_cache_size:
+                self._pairs.popitem(last=False)
+        return length
+
+    def submatrix(self, nodes):
+        """
+        Dense distance table restricted to the given nodes (in that order).
+        Nodes that are not in the graph only reach themselves.
+        """
+        size = len(nodes)
+        sub = np.empty((size, size))
+        for a, source in enumerate(nodes):
+            for b, target in enumerate(nodes):
+                sub[a, b] = 0.0 if a == b else self.distance(source, target)
+        return sub
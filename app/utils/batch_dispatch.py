@@ -0,0 +1,230 @@
+import threading
+import time
+import numpy as np
+from app.models.stores import record_assignment
+from app.utils.algo import (assign_driver, best_routes, candidate_drivers, dispatch_lock, driver_start, order_stops,
+                            routing_snapshot)
+from app.utils.insertion import insertion_dispatcher
+from app.utils.route_solver import route_solver
+
+# Defaults, overridden from the app config by batch_dispatcher.init_app()
+BATCH_WINDOW_SECONDS = 2.0
+BATCH_MAX_ORDERS = 20
+
+
+def min_cost_assignment(cost):
+    """
+    Solves the rectangular assignment problem with the Hungarian algorithm.
+
+    cost[i, j] is the cost of giving row i to column j, inf if that pair is not
+    allowed. Returns a list of (row, column) pairs with minimum total cost where
+    every row and column is used at most once and as many rows as possible are
+    matched. O(n^2 * m) with the inner loop vectorised over columns.
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+
+    # The algorithm below needs at least as many columns as rows
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n_rows, n_cols = cost.shape
+
+    # Forbidden pairs get a cost larger than any complete finite assignment,
+    # and are dropped again from the result
+    allowed = np.isfinite(cost)
+    big = (np.abs(cost[allowed]).max() + 1) * (n_rows + 1) if allowed.any() else 1.0
+    work = np.where(allowed, cost, big)
+
+    # Potentials and matching use 1-based indices, 0 is the virtual column/row
+    u = np.zeros(n_rows + 1)
+    v = np.zeros(n_cols + 1)
+    match = np.zeros(n_cols + 1, dtype=int)  # match[j] = row assigned to column j
+    way = np.zeros(n_cols + 1, dtype=int)
+
+    for row in range(1, n_rows + 1):
+        match[0] = row
+        column = 0
+        min_slack = np.full(n_cols + 1, np.inf)
+        used = np.zeros(n_cols + 1, dtype=bool)
+
+        # Grow an alternating tree until it reaches a free column
+        while True:
+            used[column] = True
+            current_row = match[column]
+            slack = work[current_row - 1] - u[current_row] - v[1:]
+            free = ~used[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = column
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            next_column = int(candidates.argmin()) + 1
+            delta = candidates[next_column - 1]
+
+            u[match[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+
+            column = next_column
+            if match[column] == 0:
+                break
+
+        # Flip the augmenting path
+        while column:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+
+    pairs = []
+    for column in range(1, n_cols + 1):
+        row = match[column]
+        if row and allowed[row - 1, column - 1]:
+            pairs.append((column - 1, row - 1) if transposed else (row - 1, column - 1))
+    return sorted(pairs)
+
+
+def dispatch_batch(batch):
+    """
+    Jointly assigns a batch of orders to drivers.
+
+    Builds an orders x drivers cost matrix of route distances (busy drivers carry a
+    penalty so that, as in assign_driver, available drivers are always preferred)
+    and solves it as one min-cost assignment. Each driver takes at most one order
+    from the batch; orders left over are returned without a driver so the caller
+    can fall back to assign_driver once the batch has been recorded.
+
+    Each order is only routed for its candidate_drivers() (the nearest idle
+    drivers in large fleets), all of them in one best_routes call, and the
+    route heuristic shares one time budget over the whole batch.
+
+    Returns {order_id: (driver_username, optimized_store_order)}.
+    """
+    results = {order['order_id']: (None, []) for order in batch}
+    if not batch:
+        return results
+
+    stops = [order_stops(order) for order in batch]
+    candidates = [candidate_drivers(stores_to_visit) for _, stores_to_visit, _ in stops]
+    # Columns are the drivers that are a candidate for at least one order
+    all_drivers = list({driver['username']: driver for drivers in candidates for driver in drivers}.values())
+    if not all_drivers:
+        return results
+    column_of = {driver['username']: column for column, driver in enumerate(all_drivers)}
+
+    shortest_paths = routing_snapshot()
+    deadline = route_solver.deadline()
+    starts = [driver_start(driver) for driver in all_drivers]
+
+    distances = np.full((len(batch), len(all_drivers)), np.inf)
+    busy = np.array([priority == 2 for priority, _ in starts])
+    routes = {}
+
+    for row, ((customer_node, stores_to_visit, store_id_mapping), drivers) in enumerate(zip(stops, candidates)):
+        columns = [column_of[driver['username']] for driver in drivers]
+        solved = best_routes(shortest_paths, [starts[column][1] for column in columns], stores_to_visit,
+                             customer_node, deadline)
+        for column in columns:
+            distance, route = solved[starts[column][1]]
+            if route is None:
+                continue
+            distances[row, column] = distance
+            routes[row, column] = [store_id_mapping[store] for store in route]
+
+    # Large enough that a busy driver only wins when no available one can do the order
+    finite = np.isfinite(distances)
+    penalty = distances[finite].sum() + 1 if finite.any() else 0
+    cost = distances + np.where(busy, penalty, 0)[None, :]
+
+    for row, column in min_cost_assignment(cost):
+        results[batch[row]['order_id']] = (all_drivers[column]['username'], routes[row, column])
+    return results
+
+
+class BatchDispatcher:
+    """
+    Buffers orders and assigns them together.
+
+    A batch is dispatched once BATCH_WINDOW_SECONDS have passed since its first
+    order arrived or BATCH_MAX_ORDERS orders are waiting, whichever comes first.
+    The web request only calls submit(); solving happens on a background thread
+    which writes delivery_agent and optimized_store_order into the stored order.
+    """
+
+    def __init__(self, window=BATCH_WINDOW_SECONDS, max_orders=BATCH_MAX_ORDERS):
+        self.window = window
+        self.max_orders = max_orders
+        self._buffer = []
+        self._first_arrival = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def init_app(self, app):
+        self.window = app.config.get('BATCH_WINDOW_SECONDS', self.window)
+        self.max_orders = app.config.get('BATCH_MAX_ORDERS', self.max_orders)
+        if app.config.get('DISPATCH_MODE') == 'batch':
+            self.start()
+
+    def start(self):
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='batch-dispatcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, order):
+        """Queue an order for the next batch."""
+        with self._condition:
+            if not self._buffer:
+                self._first_arrival = time.monotonic()
+            self._buffer.append(order)
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._buffer)
+
+    def flush(self):
+        """Dispatch everything that is buffered right now and record the results."""
+        with self._condition:
+            batch, self._buffer = self._buffer, []
+            self._first_arrival = None
+
+        with dispatch_lock:
+            if insertion_dispatcher.strategy == 'vrp':
+                # The routing engine places the whole batch, several orders per driver if need be
+                results = insertion_dispatcher.assign_many(batch)
+                for order in batch:
+                    record_assignment(order['order_id'], *results[order['order_id']])
+                return results
+
+            results = dispatch_batch(batch)
+            for order in batch:
+                record_assignment(order['order_id'], *results[order['order_id']])
+
+            # More orders than drivers: now that the batch is recorded, the leftovers
+            # go through single-order dispatch so busy drivers can stack them as usual
+            for order in batch:
+                if results[order['order_id']][0] is None:
+                    if insertion_dispatcher.enabled:
+                        results[order['order_id']] = insertion_dispatcher.assign(order)
+                    else:
+                        results[order['order_id']] = assign_driver(order)
+                    record_assignment(order['order_id'], *results[order['order_id']])
+            return results
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._buffer:
+                    self._condition.wait()
+                deadline = self._first_arrival + self.window
+                while len(self._buffer) < self.max_orders:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            self.flush()
+
+
+batch_dispatcher = BatchDispatcher()
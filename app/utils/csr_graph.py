@@ -0,0 +1,216 @@
+import csv
+import heapq
+from array import array
+import numpy as np
+import networkx as nx
+
+
+class CSRGraph:
+    """
+    Weighted graph in compressed sparse row form.
+
+    The out-edges of node u are indices[indptr[u]:indptr[u + 1]] with matching
+    weights. Node ids are int32 positions into names, weights are float32.
+    Undirected graphs store every edge in both directions.
+    """
+
+    def __init__(self, names, indptr, indices, weights, directed=False):
+        self.names = list(names)
+        self.name_to_id = {name: i for i, name in enumerate(self.names)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.directed = directed
+
+    @classmethod
+    def from_edges(cls, names, sources, targets, weights, directed=False):
+        """
+        Build the CSR arrays from parallel arrays of edge endpoints (node ids) and weights.
+        Parallel edges are collapsed to the lightest one, so every row lists each
+        neighbour once (dijkstra relaxes a whole row in one vectorised assignment).
+        """
+        sources = np.asarray(sources, dtype=np.int32)
+        targets = np.asarray(targets, dtype=np.int32)
+        weights = np.asarray(weights, dtype=np.float32)
+        if not directed:
+            sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+            weights = np.concatenate([weights, weights])
+
+        # Sort by source, then target, then weight and keep the first edge of every (source, target) pair
+        order = np.lexsort((weights, targets, sources))
+        sources, targets, weights = sources[order], targets[order], weights[order]
+        first = np.ones(len(sources), dtype=bool)
+        first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        sources, targets, weights = sources[first], targets[first], weights[first]
+
+        counts = np.bincount(sources, minlength=len(names))
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(names, indptr, targets, weights, directed=directed)
+
+    @classmethod
+    def from_networkx(cls, graph):
+        names = list(graph.nodes())
+        ids = {name: i for i, name in enumerate(names)}
+        sources, targets, weights = [], [], []
+        for u, v, data in graph.edges(data=True):
+            sources.append(ids[u])
+            targets.append(ids[v])
+            weights.append(data.get('weight', 1))
+        return cls.from_edges(names, sources, targets, weights, directed=graph.is_directed())
+
+    def to_networkx(self):
+        """networkx copy of the graph, for code that still expects one."""
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        graph.add_nodes_from(self.names)
+        sources = np.repeat(np.arange(len(self.names)), np.diff(self.indptr))
+        graph.add_weighted_edges_from(
+            (self.names[u], self.names[v], float(w)) for u, v, w in zip(sources, self.indices, self.weights))
+        return graph
+
+    def number_of_nodes(self):
+        return len(self.names)
+
+    def number_of_edges(self):
+        edges = len(self.indices)
+        return edges if self.directed else edges // 2
+
+    def nodes(self):
+        return list(self.names)
+
+    def reverse(self):
+        """Graph with every edge flipped (the graph itself when undirected)."""
+        if not self.directed:
+            return self
+        sources = np.repeat(np.arange(len(self.names), dtype=np.int32), np.diff(self.indptr))
+        return CSRGraph.from_edges(self.names, self.indices, sources, self.weights, directed=True)
+
+    def dijkstra(self, source):
+        """Shortest path lengths from node id source to every node, inf when unreachable."""
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        dist = np.full(len(self.names), np.inf)
+        dist[source] = 0.0
+        settled = np.zeros(len(self.names), dtype=bool)
+        heap = [(0.0, source)]
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if settled[u]:
+                continue
+            settled[u] = True
+            start, end = indptr[u], indptr[u + 1]
+            if start == end:
+                continue
+            neighbours = indices[start:end]
+            candidates = d + weights[start:end]
+            better = candidates < dist[neighbours]
+            if better.any():
+                neighbours = neighbours[better]
+                candidates = candidates[better]
+                dist[neighbours] = candidates
+                for v, dv in zip(neighbours.tolist(), candidates.tolist()):
+                    heapq.heappush(heap, (dv, v))
+        return dist
+
+    def expand(self, sources, radius=float('inf')):
+        """
+        Yields (node id, distance) for every node within radius of the nearest of
+        the source node ids, in order of increasing distance. The search only
+        goes as far as the caller keeps iterating.
+        """
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        best = {source: 0.0 for source in sources}
+        heap = [(0.0, source) for source in best]
+        heapq.heapify(heap)
+        settled = set()
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if d > radius:
+                return
+            settled.add(u)
+            yield u, d
+            start, end = indptr[u], indptr[u + 1]
+            for v, w in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                candidate = d + w
+                if candidate < best.get(v, float('inf')):
+                    best[v] = candidate
+                    heapq.heappush(heap, (candidate, v))
+
+    def all_pairs(self):
+        """Dense distance matrix from one Dijkstra per source."""
+        matrix = np.empty((len(self.names), len(self.names)))
+        for source in range(len(self.names)):
+            matrix[source] = self.dijkstra(source)
+        return matrix
+
+
+def _open_rows(path, delimiter):
+    """Yield split rows from a CSV (comma delimited) or whitespace separated edge list."""
+    with open(path, newline='') as handle:
+        if delimiter is None and path.endswith('.csv'):
+            delimiter = ','
+        if delimiter is None:
+            for line in handle:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line.split()
+        else:
+            for row in csv.reader(handle, delimiter=delimiter):
+                if row and not row[0].startswith('#'):
+                    yield [field.strip() for field in row]
+
+
+def load_edge_list(path, delimiter=None, directed=False, default_weight=1.0):
+    """
+    Stream an edge list file into a CSRGraph.
+
+    Each row is "source target [weight]"; rows are comma separated for .csv files
+    and whitespace separated otherwise (or split on delimiter if given). A first
+    row whose weight is not a number is treated as a header, lines starting with
+    # are comments. Edges are collected into typed arrays as they are read, so
+    memory grows with the file rather than with one Python object per edge.
+    """
+    name_to_id = {}
+    sources = array('i')
+    targets = array('i')
+    weights = array('f')
+
+    for line_number, row in enumerate(_open_rows(path, delimiter)):
+        if len(row) < 2:
+            raise ValueError(f"{path}: row {line_number + 1} needs at least a source and a target")
+        try:
+            weight = float(row[2]) if len(row) > 2 else default_weight
+        except ValueError:
+            if line_number == 0:
+                continue  # Header row
+            raise ValueError(f"{path}: row {line_number + 1} has an invalid weight {row[2]!r}")
+
+        for name, ids in ((row[0], sources), (row[1], targets)):
+            node_id = name_to_id.get(name)
+            if node_id is None:
+                node_id = name_to_id[name] = len(name_to_id)
+            ids.append(node_id)
+        weights.append(weight)
+
+    names = [None] * len(name_to_id)
+    for name, node_id in name_to_id.items():
+        names[node_id] = name
+
+    return CSRGraph.from_edges(names, np.frombuffer(sources, dtype=np.int32), np.frombuffer(targets, dtype=np.int32),
+                               np.frombuffer(weights, dtype=np.float32), directed=directed)
+
+
+def load_positions(path, delimiter=None):
+    """Read "node x y" rows into a {node: (x, y)} dict, skipping a header row."""
+    positions = {}
+    for line_number, row in enumerate(_open_rows(path, delimiter)):
+        try:
+            positions[row[0]] = (float(row[1]), float(row[2]))
+        except (IndexError, ValueError):
+            if line_number == 0:
+                continue  # Header row
+            raise ValueError(f"{path}: row {line_number + 1} should be node, x, y")
+    return positions
@@ -0,0 +1,103 @@
+import gzip
+import json
+import threading
+from app.models.stores import current_order
+from app.models.users import users
+from app.utils.distance_matrix import distance_matrix, graph_fingerprint
+from app.utils.travel_times import travel_times
+
+# Default, overridden from the app config by decision_log.init_app()
+DECISION_LOG_FILE = None  # JSON lines file of assign_driver inputs and results (gzipped if it ends in .gz)
+
+
+def open_log(path, mode):
+    """Open a decision log for reading ('r') or appending ('a'), gzipped when path ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_decisions(path):
+    """The decisions recorded in a decision log, oldest first."""
+    with open_log(path, 'r') as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def driver_state(driver):
+    """[username, location, busy location] of a delivery agent, the last None if they are free."""
+    assigned = current_order(driver['username'])
+    return [driver['username'], driver.get('location'), assigned['customer_location'] if assigned else None]
+
+
+class DecisionLog:
+    """
+    Append-only log of every assign_driver call, for replaying dispatch offline.
+
+    Each line holds everything the decision depended on: the order, the
+    location and busy state of every driver it could choose from, the graph
+    (its fingerprint and version), the routing objective and the time of day.
+    It also holds what was decided: the driver, their store route, its cost
+    and how long the call took. benchmarks/replay.py re-runs a log against any
+    configuration and compares the results.
+    """
+
+    def __init__(self, path=DECISION_LOG_FILE):
+        self.path = path
+        self._handle = None
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.close()
+        self.path = app.config.get('DECISION_LOG_FILE', self.path)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def close(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+    def _graph(self):
+        """(version, fingerprint) of the current graph, hashed once per version."""
+        version = distance_matrix.version
+        cached = self._fingerprint
+        if cached is None or cached[0] != version:
+            cached = self._fingerprint = (version, graph_fingerprint(distance_matrix.graph))
+        return cached
+
+    def record(self, order, drivers, driver, route, cost, seconds):
+        """
+        Log one decision. drivers is the list assign_driver was restricted to,
+        or None for the whole fleet.
+        """
+        restricted = drivers is not None
+        if drivers is None:
+            drivers = [user for user in users if user['user_type'] == 'Delivery Agent']
+        version, fingerprint = self._graph()
+        decision = {
+            'order': {key: order.get(key) for key in ('order_id', 'customer_id', 'customer_location')},
+            'items_by_store': {str(store_id): items for store_id, items in order['items_by_store'].items()},
+            'drivers': [driver_state(candidate) for candidate in drivers],
+            'restricted': restricted,
+            'graph': fingerprint,
+            'graph_version': version,
+            'objective': travel_times.objective,
+            'when': travel_times.clock().isoformat(),
+            'driver': driver,
+            'route': list(route),
+            'cost': cost,
+            'seconds': seconds,
+        }
+        line = json.dumps(decision, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            if self._handle is None:
+                self._handle = open_log(self.path, 'a')
+            self._handle.write(line)
+            self._handle.flush()
+
+
+decision_log = DecisionLog()
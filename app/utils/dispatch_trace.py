@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Defaults, overridden from the app config by dispatch_tracer.init_app()
+DISPATCH_TRACE_ENABLED = False
+DISPATCH_TRACE_BUFFER = 1000  # most recent traces kept in memory
+DISPATCH_TRACE_FILE = None  # JSONL file every trace is appended to, None for memory only
+DISPATCH_TRACE_DECISIONS = False  # also record the scored candidates
+DISPATCH_TRACE_MAX_CANDIDATES = 20  # best candidates kept per decision
+
+
+class Trace:
+    """
+    Timings and counters of one assign_driver call.
+
+    mark(phase) adds the time since the previous mark to phase, so a phase
+    entered several times (e.g. once per zone ring) accumulates.
+    """
+
+    __slots__ = ('order_id', 'started', 'phases', 'counters', 'candidates', '_start', '_last')
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.started = datetime.now().isoformat()
+        self.phases = {}
+        self.counters = {}
+        self.candidates = []
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def record(self, driver, route, max_candidates=None):
+        """The trace as a JSON-serialisable dict."""
+        record = {
+            'order_id': self.order_id,
+            'started': self.started,
+            'seconds': time.perf_counter() - self._start,
+            'phases': self.phases,
+            'counters': self.counters,
+            'driver': driver,
+            'route': list(route),
+        }
+        if max_candidates is not None:
+            best = sorted(self.candidates)[:max_candidates]
+            record['candidates'] = [
+                {'driver': username, 'priority': priority, 'cost': cost} for priority, cost, username in best]
+        return record
+
+
+class DispatchTracer:
+    """
+    Optional instrumentation of assign_driver.
+
+    When enabled, begin() starts a Trace for the calling thread, the dispatch
+    code marks its phases and counts drivers, cache hits and permutations on
+    it, and finish() stores the finished record in a ring buffer of the most
+    recent traces and appends it as one JSON line to DISPATCH_TRACE_FILE.
+    When disabled, begin() and current() return None and the dispatch code
+    skips all of it, so the cost is an attribute check per call.
+    """
+
+    def __init__(self, enabled=DISPATCH_TRACE_ENABLED, buffer=DISPATCH_TRACE_BUFFER, path=DISPATCH_TRACE_FILE,
+                 decisions=DISPATCH_TRACE_DECISIONS, max_candidates=DISPATCH_TRACE_MAX_CANDIDATES):
+        self.enabled = enabled
+        self.path = path
+        self.decisions = decisions
+        self.max_candidates = max_candidates
+        self._traces = deque(maxlen=buffer)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('DISPATCH_TRACE_ENABLED', self.enabled)
+        self.path = app.config.get('DISPATCH_TRACE_FILE', self.path)
+        self.decisions = app.config.get('DISPATCH_TRACE_DECISIONS', self.decisions)
+        self.max_candidates = app.config.get('DISPATCH_TRACE_MAX_CANDIDATES', self.max_candidates)
+        with self._lock:
+            self._traces = deque(self._traces, maxlen=app.config.get('DISPATCH_TRACE_BUFFER', self._traces.maxlen))
+
+    def begin(self, order):
+        """Start tracing a dispatch of order on this thread; None when tracing is off."""
+        if not self.enabled:
+            return None
+        trace = self._local.trace = Trace(order.get('order_id'))
+        return trace
+
+    def current(self):
+        """The trace of the dispatch running on this thread, if any."""
+        if not self.enabled:
+            return None
+        return getattr(self._local, 'trace', None)
+
+    def finish(self, trace, driver, route):
+        self._local.trace = None
+        record = trace.record(driver, route, self.max_candidates if self.decisions else None)
+        line = json.dumps(record, default=str) if self.path else None
+        with self._lock:
+            self._traces.append(record)
+            if line is not None:
+                with open(self.path, 'a') as handle:
+                    handle.write(line + '\n')
+        return record
+
+    def recent(self, n=None):
+        """The last n traces (default: all kept), oldest first."""
+        with self._lock:
+            traces = list(self._traces)
+        return traces if n is None else traces[-n:]
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def summary(self):
+        """Number of kept traces and the mean and max seconds of each phase over them."""
+        traces = self.recent()
+        phases = {}
+        for record in traces:
+            for phase, seconds in list(record['phases'].items()) + [('total', record['seconds'])]:
+                phases.setdefault(phase, []).append(seconds)
+        return {
+            'traces': len(traces),
+            'phases': {phase: {'mean': sum(values) / len(values), 'max': max(values)}
+                       for phase, values in phases.items()},
+        }
+
+
+def load_traces(path):
+    """Read the traces appended to a DISPATCH_TRACE_FILE."""
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+dispatch_tracer = DispatchTracer()
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+from app.models.stores import driver_listeners, orders, record_assignment
+from app.utils.algo import assign_driver, dispatch_lock
+from app.utils.insertion import insertion_dispatcher
+
+# Default, overridden from the app config by dispatch_worker.init_app()
+DISPATCH_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+
+class DriverChanges:
+    """Sequence numbers of changes to drivers' active orders, to spot drivers taken during a dispatch."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sequence = 0
+        self._changed_at = {}
+
+    def driver_changed(self, username):
+        with self._lock:
+            self.sequence += 1
+            self._changed_at[username] = self.sequence
+
+    def changed_since(self, username, sequence):
+        with self._lock:
+            return self._changed_at.get(username, 0) > sequence
+
+
+class DispatchWorker:
+    """
+    Background pool that assigns drivers after checkout has already returned.
+
+    process_purchase stores the order as "awaiting assignment" and calls
+    submit(); a pool thread then runs assign_driver and fills in
+    delivery_agent and optimized_store_order on the stored order.
+
+    Routing runs outside dispatch_lock so the pool threads work in parallel;
+    only checking and recording the result takes the lock. If the chosen
+    driver's orders changed while the route was being computed (another
+    dispatch got to them first), the order is dispatched again under the lock.
+    Orders whose dispatch fails go to the pending queue.
+    """
+
+    def __init__(self, max_workers=DISPATCH_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('DISPATCH_WORKERS', self.max_workers)
+        if app.config.get('DISPATCH_MODE') == 'async':
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dispatch')
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def submit(self, order):
+        """Queue an order for assignment; returns a Future resolving to (driver, route)."""
+        if self._executor is None:
+            self.start()
+        return self._executor.submit(self.dispatch, order)
+
+    @staticmethod
+    def _waiting(order):
+        # The order may have been cancelled or assigned some other way meanwhile
+        stored = orders.get(order['order_id'])
+        return stored is not None and not stored.get('delivery_agent')
+
+    def dispatch(self, order):
+        try:
+            if insertion_dispatcher.enabled:
+                # Insertion updates the drivers' plans as it goes, so it runs under the lock throughout
+                with dispatch_lock:
+                    if not self._waiting(order):
+                        return None, []
+                    driver, route = insertion_dispatcher.assign(order)
+                    record_assignment(order['order_id'], driver, route)
+                return driver, route
+
+            if not self._waiting(order):
+                return None, []
+            started = driver_changes.sequence
+            driver, route = assign_driver(order)
+
+            with dispatch_lock:
+                if not self._waiting(order):
+                    return None, []
+                if driver is not None and driver_changes.changed_since(driver, started):
+                    driver, route = assign_driver(order)
+                record_assignment(order['order_id'], driver, route)
+            return driver, route
+        except Exception:
+            logger.exception("Dispatching %s failed", order.get('order_id'))
+            with dispatch_lock:
+                if self._waiting(order):
+                    record_assignment(order['order_id'], None, [])  # Pending until a driver frees up
+            return None, []
+
+
+driver_changes = DriverChanges()
+driver_listeners.append(driver_changes.driver_changed)
+dispatch_worker = DispatchWorker()
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import networkx as nx
+from app.models.users import delivery_graph
+from app.utils.alt_routing import ALT_LANDMARKS, ALT_MIN_NODES, ALT_PAIR_CACHE_SIZE, LandmarkSnapshot
+from app.utils.csr_graph import CSRGraph, load_edge_list
+
+
+class DistanceSnapshot:
+    """
+    Read-only all-pairs shortest path table for one version of the delivery graph.
+    nodes[i] is the graph node stored in row/column i of matrix, and index maps
+    a node name back to its row. Unreachable pairs hold inf.
+    """
+
+    def __init__(self, version, nodes, matrix):
+        self.version = version
+        self.nodes = list(nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.matrix = matrix
+        self.matrix.setflags(write=False)
+
+    def distance(self, source, target):
+        """Shortest path length between two nodes, inf if either node is unknown or unreachable."""
+        i = self.index.get(source)
+        j = self.index.get(target)
+        if i is None or j is None:
+            return 0.0 if source == target else float('inf')
+        return float(self.matrix[i, j])
+
+    def submatrix(self, nodes):
+        """
+        Dense distance table restricted to the given nodes (in that order).
+        Nodes that are not in the graph only reach themselves.
+        """
+        size = len(nodes)
+        sub = np.full((size, size), np.inf)
+        rows = np.array([self.index.get(node, -1) for node in nodes], dtype=np.int64)
+        known = np.flatnonzero(rows >= 0)
+        if known.size:
+            sub[np.ix_(known, known)] = self.matrix[np.ix_(rows[known], rows[known])]
+        np.fill_diagonal(sub, 0.0)
+        return sub
+
+
+def compute_distance_matrix(graph):
+    """
+    Runs one Dijkstra per source node and returns (nodes, matrix) where matrix is
+    a dense float64 array indexed by the position of each node in nodes.
+    graph is either a networkx graph or a CSRGraph loaded from an edge list.
+    """
+    if isinstance(graph, CSRGraph):
+        return graph.nodes(), graph.all_pairs()
+    
+    nodes = list(graph.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    matrix = np.full((len(nodes), len(nodes)), np.inf)
+    np.fill_diagonal(matrix, 0.0)
+
+    for i, source in enumerate(nodes):
+        try:
+            lengths = nx.shortest_path_length(graph, source=source, weight='weight')
+        except (nx.NetworkXNoPath, nx.NetworkXError):
+            # Leave the row unreachable, same as a missing path in assign_driver
+            continue
+        targets = np.fromiter((index[target] for target in lengths), dtype=np.int64, count=len(lengths))
+        matrix[i, targets] = np.fromiter(lengths.values(), dtype=np.float64, count=len(lengths))
+
+    return nodes, matrix
+
+
+def graph_fingerprint(graph):
+    """
+    SHA-256 of the graph's nodes (in matrix order) and weighted edges.
+    Two graphs with the same fingerprint have the same distance matrix.
+    """
+    digest = hashlib.sha256()
+    if isinstance(graph, CSRGraph):
+        digest.update(b'csr')
+        digest.update(json.dumps(graph.names).encode('utf-8'))
+        for array in (graph.indptr, graph.indices, graph.weights):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    digest.update(b'directed' if graph.is_directed() else b'undirected')
+    digest.update(json.dumps([str(node) for node in graph.nodes()]).encode('utf-8'))
+    for u, v, data in graph.edges(data=True):
+        digest.update(f"{u}\x00{v}\x00{data.get('weight', 1)!r}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_cached_matrix(cache_dir, fingerprint):
+    """
+    Open a previously saved matrix read-only and memory mapped, so every worker
+    process shares one copy through the page cache. Returns (nodes, matrix) or
+    None if there is nothing cached for this fingerprint.
+    """
+    matrix_path = os.path.join(cache_dir, f"distances-{fingerprint}.npy")
+    nodes_path = os.path.join(cache_dir, f"distances-{fingerprint}.nodes.json")
+    if not (os.path.exists(matrix_path) and os.path.exists(nodes_path)):
+        return None
+    with open(nodes_path) as handle:
+        nodes = json.load(handle)
+    return nodes, np.load(matrix_path, mmap_mode='r')
+
+
+def save_cached_matrix(cache_dir, fingerprint, nodes, matrix):
+    """Write the matrix and its node list next to each other, atomically."""
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    matrix_path = os.path.join(cache_dir, f"distances-{fingerprint}.npy")
+    nodes_path = os.path.join(cache_dir, f"distances-{fingerprint}.nodes.json")
+
+    # Write to temporary files first so other workers never see a partial file
+    with open(matrix_path + suffix, 'wb') as handle:
+        np.save(handle, np.ascontiguousarray(matrix))
+    with open(nodes_path + suffix, 'w') as handle:
+        json.dump(list(nodes), handle)
+    os.replace(nodes_path + suffix, nodes_path)
+    os.replace(matrix_path + suffix, matrix_path)
+
+
+class DistanceMatrix:
+    """
+    Lazily computed, cached distance matrix for a delivery graph.
+
+    The matrix is built on first use and reused by every dispatch until
+    invalidate() is called, which must happen whenever the graph is changed.
+    Readers take a snapshot() and keep using it even if the graph is
+    invalidated while they are working. Other caches derived from the graph
+    can register a listener to be told about invalidations.
+
+    With a cache_dir, computed matrices are saved as .npy files named after
+    the graph fingerprint and later opened with mmap_mode='r', so restarts and
+    other worker processes skip the computation entirely.
+
+    Graphs with alt_min_nodes nodes or more get a LandmarkSnapshot instead,
+    which answers the same queries with landmark A* searches rather than
+    holding a nodes x nodes matrix.
+    """
+
+    def __init__(self, graph, cache_dir=None, alt_min_nodes=ALT_MIN_NODES, alt_landmarks=ALT_LANDMARKS,
+                 alt_pair_cache_size=ALT_PAIR_CACHE_SIZE):
+        self.graph = graph
+        self.cache_dir = cache_dir
+        self.alt_min_nodes = alt_min_nodes
+        self.alt_landmarks = alt_landmarks
+        self.alt_pair_cache_size = alt_pair_cache_size
+        self.version = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def init_app(self, app):
+        # Large road networks are loaded from an edge list instead of the built-in graph
+        path = app.config.get('DELIVERY_GRAPH_FILE')
+        if path:
+            self.set_graph(load_edge_list(path))
+
+        self.alt_min_nodes = app.config.get('ALT_MIN_NODES', self.alt_min_nodes)
+        self.alt_landmarks = app.config.get('ALT_LANDMARKS', self.alt_landmarks)
+        self.alt_pair_cache_size = app.config.get('ALT_PAIR_CACHE_SIZE', self.alt_pair_cache_size)
+        
+        # Warm start from the on-disk cache (or fill it) while the app boots
+        self.cache_dir = app.config.get('DISTANCE_MATRIX_CACHE_DIR', self.cache_dir)
+        if self.cache_dir:
+            self.snapshot()
+
+    def set_graph(self, graph):
+        """Switch to a different graph (networkx or CSRGraph) and drop the cached matrix."""
+        self.graph = graph
+        self.invalidate()
+
+    def add_listener(self, callback):
+        """Call callback() every time the graph is invalidated."""
+        self._listeners.append(callback)
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != self.version:
+                if self.alt_min_nodes and self.graph.number_of_nodes() >= self.alt_min_nodes:
+                    snapshot = LandmarkSnapshot(self.version, self.graph, self.alt_landmarks,
+                                                self.alt_pair_cache_size)
+                else:
+                    nodes, matrix = self._load_or_compute()
+                    snapshot = DistanceSnapshot(self.version, nodes, matrix)
+                self._snapshot = snapshot
+        return snapshot
+
+    def _load_or_compute(self):
+        if not self.cache_dir:
+            return compute_distance_matrix(self.graph)
+
+        fingerprint = graph_fingerprint(self.graph)
+        cached = load_cached_matrix(self.cache_dir, fingerprint)
+        if cached is None:
+            nodes, matrix = compute_distance_matrix(self.graph)
+            save_cached_matrix(self.cache_dir, fingerprint, nodes, matrix)
+            cached = load_cached_matrix(self.cache_dir, fingerprint)
+        return cached
+
+    def invalidate(self):
+        """Drop the cached matrix; the next snapshot() rebuilds it from the graph."""
+        with self._lock:
+            self.version += 1
+            self._snapshot = None
+        for callback in list(self._listeners):
+            callback()
+
+    def publish(self, graph, nodes=None, matrix=None, base_version=None, on_publish=None):
+        """
+        Switch to graph in one step, together with its distance matrix when the
+        caller already has it (otherwise the next snapshot() builds it). Readers
+        holding an older snapshot keep using it. If base_version is given and the
+        graph has changed since, nothing is published and False is returned.
+        on_publish() runs in the same step, before the listeners, for state that
+        has to change together with the graph.
+        """
+        with self._lock:
+            if base_version is not None and base_version != self.version:
+                return False
+            self.graph = graph
+            self.version += 1
+            self._snapshot = DistanceSnapshot(self.version, nodes, matrix) if matrix is not None else None
+            if on_publish is not None:
+                on_publish()
+        for callback in list(self._listeners):
+            callback()
+        return True
+
+    def distance(self, source, target):
+        return self.snapshot().distance(source, target)
+
+
+# Shared cache for the module level delivery network
+distance_matrix = DistanceMatrix(delivery_graph)
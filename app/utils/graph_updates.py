@@ -0,0 +1,187 @@
+import threading
+import numpy as np
+import networkx as nx
+from app.models.users import graph_positions
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import DistanceSnapshot, compute_distance_matrix, distance_matrix
+from app.utils.sourcing import store_node
+
+# Defaults, overridden from the app config by graph_editor.init_app()
+GRAPH_UPDATE_FULL_RECOMPUTE_FRACTION = 0.5  # recompute everything once this share of rows is affected
+
+
+def relax_edge(matrix, i, j, weight, directed):
+    """
+    Update matrix in place for a new edge i -> j (and j -> i when undirected), or
+    an existing one getting shorter: every pair can now go through it.
+    """
+    np.minimum(matrix, matrix[:, i:i + 1] + weight + matrix[j:j + 1, :], out=matrix)
+    if not directed:
+        np.minimum(matrix, matrix[:, j:j + 1] + weight + matrix[i:i + 1, :], out=matrix)
+
+
+def affected_sources(matrix, i, j, weight, directed):
+    """
+    Rows of matrix whose shortest paths may use edge i -> j (or j -> i when
+    undirected) of the given weight, i.e. the rows to recompute when that edge
+    gets longer or is removed. Ties count as affected.
+    """
+    to_i, to_j = matrix[:, i], matrix[:, j]
+    with np.errstate(invalid='ignore'):
+        rows = np.isfinite(to_i) & (to_i + weight <= to_j + 1e-7 * np.maximum(1.0, to_j))
+        if not directed:
+            rows |= np.isfinite(to_j) & (to_j + weight <= to_i + 1e-7 * np.maximum(1.0, to_i))
+    return np.flatnonzero(rows)
+
+
+class GraphEditor:
+    """
+    Changes the delivery network at runtime: open or close roads, change their
+    length and add nodes such as new stores.
+
+    Each change updates a copy of the current distance matrix instead of
+    recomputing it. A new or shorter edge u-v is a single vectorised pass,
+
+        d'(a, b) = min(d(a, b), d(a, u) + w + d(v, b))
+
+    and a longer or closed edge only reruns Dijkstra from the sources that had
+    a shortest path through it (d(a, u) + w == d(a, v)). When more than
+    full_recompute_fraction of the rows are affected the whole matrix is
+    recomputed instead. Large graphs routed with landmarks have no matrix and
+    are rebuilt on the next snapshot.
+
+    The edited graph, its matrix and the positions of new nodes are published
+    together with DistanceMatrix.publish(): dispatches already running keep the snapshot they
+    started with, and every later snapshot() sees the new network.
+    """
+
+    def __init__(self, distances, positions, full_recompute_fraction=GRAPH_UPDATE_FULL_RECOMPUTE_FRACTION):
+        self.distances = distances
+        self.positions = positions
+        self.full_recompute_fraction = full_recompute_fraction
+        self.rows_recomputed = 0
+        self.full_recomputes = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.full_recompute_fraction = app.config.get('GRAPH_UPDATE_FULL_RECOMPUTE_FRACTION',
+                                                      self.full_recompute_fraction)
+
+    def set_road(self, u, v, km):
+        """Open the road u-v, or change its length if it already exists."""
+        self.apply([('road', u, v, km)])
+
+    def close_road(self, u, v):
+        self.apply([('close', u, v)])
+
+    def add_node(self, node, position=None, roads=()):
+        """Add node at position (x, y), connected by roads given as (neighbour, km) pairs."""
+        self.apply([('node', node, position)] + [('road', node, neighbour, km) for neighbour, km in roads])
+
+    def add_store_node(self, store_id, position, roads):
+        """Add the graph node for store_id (Store D for 4, ...) and return its name."""
+        node = store_node(store_id)
+        self.add_node(node, position, roads)
+        return node
+
+    def apply(self, changes):
+        """
+        Apply several changes as one update, so readers never see half of them:
+        ('road', u, v, km), ('close', u, v) or ('node', name, position).
+        """
+        # New positions go in together with the graph, so spatial lookups
+        # never snap to a node the published snapshot doesn't have yet
+        positions = {change[1]: tuple(change[2]) for change in changes
+                     if change[0] == 'node' and change[2] is not None}
+        with self._lock:
+            while True:
+                base = self.distances.snapshot()
+                graph = self.distances.graph
+                edited = graph.to_networkx() if isinstance(graph, CSRGraph) else graph.copy()
+                nodes, matrix = self._update(base, edited, changes)
+                if isinstance(graph, CSRGraph):
+                    edited = CSRGraph.from_networkx(edited)
+                if matrix is None and isinstance(base, DistanceSnapshot):
+                    nodes, matrix = compute_distance_matrix(edited)
+
+                if self.distances.publish(edited, nodes, matrix, base_version=base.version,
+                                          on_publish=lambda: self.positions.update(positions)):
+                    return
+                # The graph was swapped while we worked on it; start over from the new one
+
+    def _update(self, base, graph, changes):
+        """
+        Apply changes to graph (a networkx copy) and return (nodes, matrix) for the
+        result, or (None, None) when it has to be computed from scratch.
+        """
+        incremental = isinstance(base, DistanceSnapshot)
+        if incremental:
+            nodes = list(base.nodes)
+            index = dict(base.index)
+            matrix = np.array(base.matrix, dtype=np.float64)
+        directed = graph.is_directed()
+        recomputed = set()
+
+        for change in changes:
+            kind = change[0]
+            if kind == 'node':
+                _, node, _ = change
+                if node in graph:
+                    raise ValueError(f"{node} is already on the delivery graph")
+                graph.add_node(node)
+                if incremental:
+                    index[node] = len(nodes)
+                    nodes.append(node)
+                    size = len(nodes)
+                    grown = np.full((size, size), np.inf)
+                    grown[:-1, :-1] = matrix
+                    grown[-1, -1] = 0.0
+                    matrix = grown
+                continue
+
+            u, v = change[1], change[2]
+            for node in (u, v):
+                if node not in graph:
+                    raise ValueError(f"{node} is not on the delivery graph")
+            old = graph[u][v].get('weight', 1) if graph.has_edge(u, v) else None
+            if kind == 'road':
+                weight = change[3]
+                if weight < 0:
+                    raise ValueError(f"Road {u}-{v} can't have a negative length")
+                graph.add_edge(u, v, weight=weight)
+            elif kind == 'close':
+                if old is None:
+                    raise ValueError(f"There is no road {u}-{v} to close")
+                graph.remove_edge(u, v)
+            else:
+                raise ValueError(f"Unknown graph change {kind!r}")
+
+            if not incremental:
+                continue
+            i, j = index[u], index[v]
+            if kind == 'road' and (old is None or weight <= old):
+                relax_edge(matrix, i, j, weight, directed)
+                continue
+
+            rows = affected_sources(matrix, i, j, old, directed)
+            recomputed.update(rows.tolist())
+            if len(recomputed) > self.full_recompute_fraction * len(nodes):
+                incremental = False
+                continue
+            for row in rows:
+                lengths = nx.single_source_dijkstra_path_length(graph, nodes[row], weight='weight')
+                matrix[row] = np.inf
+                matrix[row, [index[target] for target in lengths]] = list(lengths.values())
+                if not directed:
+                    matrix[:, row] = matrix[row]
+
+        if incremental:
+            self.rows_recomputed += len(recomputed)
+            return nodes, matrix
+        if isinstance(base, DistanceSnapshot):
+            self.full_recomputes += 1
+        return None, None
+
+
+# Shared editor for the module level delivery network
+graph_editor = GraphEditor(distance_matrix, graph_positions)
@@ -0,0 +1,179 @@
+import numpy as np
+from app.models.stores import active_orders_by_driver, planned_stops_by_driver
+from app.models.users import users
+from app.utils.algo import customer_destination, dispatch_lock, order_stops, routing_snapshot
+from app.utils.spatial_index import spatial_index
+from app.utils.vrp import vrp_solver
+
+# Defaults, overridden from the app config by insertion_dispatcher.init_app()
+DISPATCH_STRATEGY = 'priority'  # 'insertion' or 'vrp' to use the InsertionDispatcher
+INSERTION_MAX_ORDERS = 3  # orders a driver may carry at once
+
+
+def route_length(dist, route):
+    """Length of a route given as indices into dist, from route[0] onwards."""
+    route = np.asarray(route)
+    return float(dist[route[:-1], route[1:]].sum())
+
+
+def cheapest_insertion(dist, route, stop, first=1):
+    """
+    Returns (increase, position) for the cheapest place to insert stop into route,
+    i.e. before route[position] or at the end when position == len(route).
+    Only positions >= first are considered; route[0] is the fixed start.
+    """
+    route = np.asarray(route)
+    before = route[first - 1:]
+    after = route[first:]
+    increase = np.empty(len(before))
+    increase[:-1] = dist[before[:-1], stop] + dist[stop, after] - dist[before[:-1], after]
+    increase[-1] = dist[before[-1], stop]  # Append after the last stop
+    # inf - inf is nan for unreachable neighbours
+    increase[np.isnan(increase)] = np.inf
+    best = int(increase.argmin())
+    return float(increase[best]), first + best
+
+
+def insert_order(dist, route, pickups, dropoff):
+    """
+    Inserts an order's pickups and drop-off into route by cheapest insertion.
+
+    Pickups go in one at a time, cheapest first, anywhere after the start; the
+    drop-off then goes at the cheapest position after the order's last pickup.
+    Returns (increase, new_route), with an inf increase if the order can't be served.
+    """
+    route = list(route)
+    remaining = list(pickups)
+    last_pickup = 0
+    increase = 0.0
+
+    while remaining:
+        options = [cheapest_insertion(dist, route, stop) + (stop,) for stop in remaining]
+        cost, position, stop = min(options, key=lambda option: option[:2])
+        if cost == float('inf'):
+            return float('inf'), None
+        route.insert(position, stop)
+        remaining.remove(stop)
+        increase += cost
+        last_pickup = position if position > last_pickup else last_pickup + 1
+
+    cost, position = cheapest_insertion(dist, route, dropoff, first=last_pickup + 1)
+    if cost == float('inf'):
+        return float('inf'), None
+    route.insert(position, dropoff)
+    return increase + cost, route
+
+
+class InsertionDispatcher:
+    """
+    Dispatches orders by inserting them into drivers' planned stop sequences.
+
+    Every delivery agent has an explicit list of stops (planned_stops_by_driver).
+    A new order's store pickups and customer drop-off are inserted into each
+    driver's list at the cheapest positions, with all pickups before the
+    drop-off, and the order goes to the driver whose route grows the least.
+    A driver can therefore carry up to max_orders orders at once, picking up a
+    new order on the way instead of only after finishing the current one.
+
+    With the 'vrp' strategy the plans are made by vrp_solver instead, which
+    limits drivers by capacity, shift end and promised delivery windows rather
+    than by max_orders, and may reorder a driver's existing stops.
+    """
+
+    def __init__(self, strategy=DISPATCH_STRATEGY, max_orders=INSERTION_MAX_ORDERS):
+        self.strategy = strategy
+        self.max_orders = max_orders
+
+    def init_app(self, app):
+        self.strategy = app.config.get('DISPATCH_STRATEGY', self.strategy)
+        self.max_orders = app.config.get('INSERTION_MAX_ORDERS', self.max_orders)
+
+    @property
+    def enabled(self):
+        return self.strategy in ('insertion', 'vrp')
+
+    def driver_stops(self, username):
+        """
+        Planned stops of a driver. Orders assigned without a plan (e.g. by
+        assign_driver) are appended as their store visits followed by the drop-off.
+        Orders the driver has already collected keep only their drop-off.
+        """
+        active = active_orders_by_driver.get(username, {})
+        collected = {order_id for order_id, order in active.items() if order.get('status') == 'collected'}
+        stops = [stop for stop in planned_stops_by_driver.get(username, [])
+                 if stop['store_id'] is None or stop['order_id'] not in collected]
+        planned = {stop['order_id'] for stop in stops}
+        for order_id, order in active.items():
+            if order_id in planned:
+                continue
+            if order_id not in collected:
+                for store_id in order.get('optimized_store_order') or order['items_by_store']:
+                    stops.append({"order_id": order_id, "node": f"Store {chr(64 + int(store_id))}",
+                                  "store_id": store_id})
+            stops.append({"order_id": order_id, "store_id": None,
+                          "node": customer_destination(order['customer_id'], order.get('customer_location'))})
+        return stops
+
+    def evaluate(self, order, drivers=None):
+        """
+        Cost of adding order to every driver (or every one of drivers) with spare capacity.
+        Returns (increase, username, new_stops) tuples, cheapest first.
+        """
+        customer_node, stores_to_visit, store_id_mapping = order_stops(order)
+        shortest_paths = routing_snapshot()
+        new_stops = [{"order_id": order['order_id'], "node": node, "store_id": store_id_mapping[node]}
+                     for node in stores_to_visit]
+        new_stops.append({"order_id": order['order_id'], "node": customer_node, "store_id": None})
+
+        options = []
+        for driver in users if drivers is None else drivers:
+            if driver['user_type'] != 'Delivery Agent':
+                continue
+            if len(active_orders_by_driver.get(driver['username'], {})) >= self.max_orders:
+                continue
+
+            start = spatial_index.nearest_node(driver['location']) or "Admin Office"
+            stops = self.driver_stops(driver['username'])
+            # Index 0 is the start, then the current stops, then the new order's stops
+            all_stops = stops + new_stops
+            dist = shortest_paths.submatrix([start] + [stop['node'] for stop in all_stops])
+
+            current = list(range(len(stops) + 1))
+            pickups = list(range(len(stops) + 1, len(all_stops)))
+            increase, route = insert_order(dist, current, pickups, len(all_stops))
+            if route is None:
+                continue
+            options.append((increase, len(stops), driver['username'], [all_stops[i - 1] for i in route[1:]]))
+
+        # Cheapest first; on ties prefer the driver with fewer stops
+        options.sort(key=lambda option: option[:3])
+        return [(increase, username, stops) for increase, _, username, stops in options]
+
+    def assign(self, order, drivers=None):
+        """
+        Inserts order into the cheapest driver's plan.
+        Returns (driver_username, optimized_store_order) like assign_driver.
+        """
+        with dispatch_lock:
+            if self.strategy == 'vrp':
+                return self.assign_many([order], drivers)[order['order_id']]
+            options = self.evaluate(order, drivers)
+            if not options:
+                return None, []
+            _, username, stops = options[0]
+            planned_stops_by_driver[username] = stops
+            return username, [stop['store_id'] for stop in stops
+                              if stop['order_id'] == order['order_id'] and stop['store_id'] is not None]
+
+    def assign_many(self, batch, drivers=None):
+        """
+        Plans a batch of orders jointly with vrp_solver.
+        Returns {order_id: (driver_username, optimized_store_order)}.
+        """
+        with dispatch_lock:
+            results, plans = vrp_solver.plan(batch, users if drivers is None else drivers, self.driver_stops)
+            planned_stops_by_driver.update(plans)
+            return results
+
+
+insertion_dispatcher = InsertionDispatcher()
@@ -0,0 +1,146 @@
+import threading
+from app.models.stores import current_order, driver_listeners
+from app.models.users import users
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import distance_matrix
+from app.utils.spatial_index import spatial_index
+from app.utils.travel_times import travel_times
+
+# Defaults, overridden from the app config by nearest_drivers.init_app()
+NEAREST_DRIVERS_MIN_DRIVERS = 200  # smaller fleets are scored in full
+NEAREST_DRIVERS_K = 8  # idle drivers scored with the route solver
+NEAREST_DRIVERS_RADIUS = None  # km (or minutes with ETAs) searched at most; None for no limit
+
+
+class NearestDrivers:
+    """
+    Finds the idle delivery agents closest to an order by road.
+
+    Idle drivers are filed under the graph node they stand at. For an order,
+    a Dijkstra search runs backwards over the road graph from the order's
+    stores, so nodes are settled in order of their driving distance *to* the
+    nearest store, and stops as soon as k idle drivers have been settled or
+    the radius is reached. Only those drivers then get a full route from the
+    route solver, so the cost of a dispatch depends on how far the search has
+    to go to find k drivers rather than on the fleet size.
+
+    Like the zone index, drivers are re-filed lazily: driver_changed() is
+    called whenever a driver's active orders change (which is also when they
+    become idle or busy), and the index is rebuilt when the graph changes.
+    """
+
+    def __init__(self, min_drivers=NEAREST_DRIVERS_MIN_DRIVERS, k=NEAREST_DRIVERS_K,
+                 radius=NEAREST_DRIVERS_RADIUS):
+        self.min_drivers = min_drivers
+        self.k = k
+        self.radius = radius
+        self.searches = 0
+        self.settled = 0  # nodes settled over all searches
+        self._lock = threading.Lock()
+        self._built = False
+        self._dirty = set()
+        self._graph = None
+
+    def init_app(self, app):
+        self.min_drivers = app.config.get('NEAREST_DRIVERS_MIN_DRIVERS', self.min_drivers)
+        self.k = app.config.get('NEAREST_DRIVERS_K', self.k)
+        self.radius = app.config.get('NEAREST_DRIVERS_RADIUS', self.radius)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._graph = None
+
+    def driver_changed(self, username):
+        with self._lock:
+            self._dirty.add(username)
+
+    def _build(self):
+        self._drivers = {user['username']: user for user in users if user['user_type'] == 'Delivery Agent'}
+        self._node_of_driver = {}
+        self._idle_at = {}
+        for username in self._drivers:
+            self._file(username)
+        self._dirty.clear()
+        self._built = True
+
+    def _file(self, username):
+        """File a driver under their current node if they are idle, otherwise take them out."""
+        old = self._node_of_driver.pop(username, None)
+        if old is not None:
+            self._idle_at[old].discard(username)
+            if not self._idle_at[old]:
+                del self._idle_at[old]
+
+        driver = self._drivers.get(username)
+        if driver is None or current_order(username):
+            return
+        node = spatial_index.nearest_node(driver.get('location')) or "Admin Office"
+        self._node_of_driver[username] = node
+        self._idle_at.setdefault(node, set()).add(username)
+
+    def _current(self):
+        with self._lock:
+            if not self._built:
+                self._build()
+            for username in self._dirty:
+                self._file(username)
+            self._dirty.clear()
+
+    def _reverse_graph(self):
+        """
+        The road graph with every edge flipped, weighted like dispatch: in minutes
+        for the current time bucket with ETAs, in km otherwise.
+        """
+        key = (distance_matrix.version, travel_times.bucket_of() if travel_times.enabled else None)
+        with self._lock:
+            if self._graph is not None and self._graph[0] == key:
+                return self._graph[1]
+        if travel_times.enabled:
+            graph = travel_times.bucket_graph(key[1])
+        else:
+            graph = distance_matrix.graph
+            if not isinstance(graph, CSRGraph):
+                graph = CSRGraph.from_networkx(graph)
+        reverse = graph.reverse()
+        with self._lock:
+            self._graph = (key, reverse)
+        return reverse
+
+    def fleet_size(self):
+        self._current()
+        return len(self._drivers)
+
+    def should_use(self):
+        return bool(self.min_drivers) and self.fleet_size() >= self.min_drivers
+
+    def idle_near(self, nodes, k=None, radius=None):
+        """
+        Up to k idle delivery agents with the shortest drive to any of nodes
+        (closest first), searching no further than radius.
+        """
+        k = self.k if k is None else k
+        radius = self.radius if radius is None else radius
+        self._current()
+        graph = self._reverse_graph()
+        sources = [graph.name_to_id[node] for node in nodes if node in graph.name_to_id]
+
+        found = []
+        settled = 0
+        with self._lock:
+            idle_at = self._idle_at
+            for node_id, _ in graph.expand(sources, float('inf') if radius is None else radius):
+                settled += 1
+                for username in sorted(idle_at.get(graph.names[node_id], ())):
+                    found.append(self._drivers[username])
+                if len(found) >= k:
+                    break
+            self.searches += 1
+            self.settled += settled
+        return found[:k]
+
+
+nearest_drivers = NearestDrivers()
+distance_matrix.add_listener(nearest_drivers.invalidate)
+driver_listeners.append(nearest_drivers.driver_changed)
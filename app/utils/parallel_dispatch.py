@@ -0,0 +1,158 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from app.utils.route_solver import RouteSolver
+
+# Defaults, overridden from the app config by parallel_evaluator.init_app()
+PARALLEL_DISPATCH_MIN_DRIVERS = 0  # 0 disables the process pool
+PARALLEL_DISPATCH_WORKERS = None  # None uses every CPU
+
+# Matrices opened by this worker process, keyed by file path
+_worker_matrices = {}
+
+
+def _worker_matrix(path):
+    matrix = _worker_matrices.get(path)
+    if matrix is None:
+        # Only keep the current graph version open
+        _worker_matrices.clear()
+        matrix = _worker_matrices[path] = np.load(path, mmap_mode='r')
+    return matrix
+
+
+def score_chunk(matrix_path, chunk, stop_rows, customer_row, solver_settings, wall_deadline=None):
+    """
+    Runs in a worker process: best route for every driver in chunk.
+
+    chunk holds (username, priority, driver_row) tuples, rows index the shared
+    distance matrix and -1 marks a node that is not in the graph. Returns
+    (priority, distance, username, route) tuples for the drivers that have a
+    route, where route lists positions in stop_rows in visiting order.
+    wall_deadline is the dispatch's time.time() deadline for the heuristic.
+    """
+    matrix = _worker_matrix(matrix_path)
+    solver = RouteSolver(**solver_settings)
+
+    # One route table for the whole chunk: the drivers' rows, then the stores and the customer
+    rows = np.array([driver_row for _, _, driver_row in chunk] + list(stop_rows) + [customer_row], dtype=np.int64)
+    size = len(rows)
+    local = np.full((size, size), np.inf)
+    known = np.flatnonzero(rows >= 0)
+    if known.size:
+        local[np.ix_(known, known)] = matrix[np.ix_(rows[known], rows[known])]
+    np.fill_diagonal(local, 0.0)
+
+    first_store = len(chunk)
+    # perf_counter() is per process, so the deadline travels as wall-clock time
+    deadline = time.perf_counter() + (wall_deadline - time.time()) if wall_deadline is not None else None
+    solved = solver.solve_many(local, range(first_store), range(first_store, size - 1), size - 1, deadline)
+
+    results = []
+    for (username, priority, _), (distance, route) in zip(chunk, solved):
+        if route is not None:
+            results.append((priority, distance, username, [i - first_store for i in route]))
+    return results
+
+
+class ParallelEvaluator:
+    """
+    Scores drivers for assign_driver on a process pool.
+
+    Drivers are split into chunks and each chunk is solved in a worker process
+    against the distance matrix, which workers open read-only with
+    numpy.load(mmap_mode='r') so the whole pool shares one copy through the
+    page cache. Only used once a fleet reaches min_drivers drivers.
+    """
+
+    def __init__(self, min_drivers=PARALLEL_DISPATCH_MIN_DRIVERS, workers=PARALLEL_DISPATCH_WORKERS):
+        self.min_drivers = min_drivers
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._published = None  # (snapshot version, path)
+        self._tempdir = None
+
+    def init_app(self, app):
+        self.min_drivers = app.config.get('PARALLEL_DISPATCH_MIN_DRIVERS', self.min_drivers)
+        self.workers = app.config.get('PARALLEL_DISPATCH_WORKERS', self.workers)
+
+    def should_use(self, driver_count):
+        return bool(self.min_drivers) and driver_count >= self.min_drivers
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if self._tempdir:
+                shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+            self._published = None
+        if executor is not None:
+            executor.shutdown()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            atexit.register(self.shutdown)
+        return self._executor
+
+    def _matrix_path(self, snapshot):
+        """File the workers can memory map for this snapshot, written once per graph version."""
+        if self._published and self._published[0] == snapshot.version:
+            return self._published[1]
+
+        # Matrices from the on-disk cache are already memory mapped files
+        if isinstance(snapshot.matrix, np.memmap) and snapshot.matrix.filename:
+            path = snapshot.matrix.filename
+        else:
+            if self._tempdir is None:
+                self._tempdir = tempfile.mkdtemp(prefix='dispatch-matrix-')
+            path = os.path.join(self._tempdir, f"distances-v{snapshot.version}.npy")
+            np.save(path, np.ascontiguousarray(snapshot.matrix))
+            if self._published and self._published[1].startswith(self._tempdir):
+                os.remove(self._published[1])
+        self._published = (snapshot.version, path)
+        return path
+
+    def evaluate(self, snapshot, starts, stores_to_visit, customer_node, solver, deadline=None):
+        """
+        Score every (username, priority, driver_node) in starts.
+        Returns (priority, distance, username, store_nodes) tuples, like the serial loop.
+        deadline (a perf_counter() time, default time_budget from now) bounds
+        the route heuristic for every chunk together.
+        """
+        with self._lock:
+            matrix_path = self._matrix_path(snapshot)
+            pool = self._pool()
+
+        stop_rows = [snapshot.index.get(store, -1) for store in stores_to_visit]
+        customer_row = snapshot.index.get(customer_node, -1)
+        tasks = [(username, priority, snapshot.index.get(node, -1)) for username, priority, node in starts]
+        settings = {
+            'brute_force_max_stops': solver.brute_force_max_stops,
+            'exact_max_stops': solver.exact_max_stops,
+            'time_budget': solver.time_budget,
+        }
+
+        if deadline is None:
+            deadline = solver.deadline()
+        wall_deadline = time.time() + (deadline - time.perf_counter())
+
+        workers = self.workers or os.cpu_count() or 1
+        chunk_size = max(1, -(-len(tasks) // (workers * 4)))
+        futures = [pool.submit(score_chunk, matrix_path, tasks[i:i + chunk_size], stop_rows, customer_row, settings,
+                               wall_deadline)
+                   for i in range(0, len(tasks), chunk_size)]
+
+        scored = []
+        for future in futures:
+            for priority, distance, username, route in future.result():
+                scored.append((priority, distance, username, [stores_to_visit[i] for i in route]))
+        return scored
+
+
+parallel_evaluator = ParallelEvaluator()
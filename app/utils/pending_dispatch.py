@@ -0,0 +1,76 @@
+import itertools
+from app.models.stores import active_orders, orders, pending_orders, record_assignment, release_active_order
+from app.models.users import users
+from app.utils.algo import assign_driver, dispatch_lock
+from app.utils.insertion import insertion_dispatcher
+from app.utils.rebalancing import demand_rebalancer
+
+# Default, overridden from the app config by pending_dispatcher.init_app()
+PENDING_SCAN_LIMIT = 20  # oldest pending orders offered to a driver who frees up
+
+
+class PendingDispatcher:
+    """
+    Hands queued orders to delivery agents as they finish deliveries.
+
+    Orders that no driver could take at checkout wait in pending_orders,
+    oldest first. When a driver completes a delivery only that driver is
+    scored, against the scan_limit oldest pending orders, and they take the
+    oldest one they can reach. Each delivery therefore costs at most
+    scan_limit route solves instead of a re-dispatch of the whole queue, and
+    orders leave the queue in the order they were placed.
+    """
+
+    def __init__(self, scan_limit=PENDING_SCAN_LIMIT):
+        self.scan_limit = scan_limit
+
+    def init_app(self, app):
+        self.scan_limit = app.config.get('PENDING_SCAN_LIMIT', self.scan_limit)
+
+    def driver_freed(self, username):
+        """
+        Offer the oldest pending orders to one delivery agent.
+        Returns (order_id, optimized_store_order) for the order they took, or None.
+        """
+        driver = next((user for user in users if user['username'] == username), None)
+        if driver is None or not pending_orders:
+            return None
+
+        with dispatch_lock:
+            # Only the keys scanned are copied, since stale entries are dropped from the queue below
+            for order_id in list(itertools.islice(pending_orders, self.scan_limit)):
+                order = orders.get(order_id)
+                if order is None or order.get('delivery_agent'):
+                    # Cancelled or assigned some other way meanwhile
+                    pending_orders.pop(order_id, None)
+                    continue
+
+                if insertion_dispatcher.enabled:
+                    assigned, route = insertion_dispatcher.assign(order, [driver])
+                else:
+                    assigned, route = assign_driver(order, [driver])
+                if assigned is not None:
+                    record_assignment(order_id, assigned, route)
+                    return order_id, route
+        return None
+
+
+def complete_delivery(order_id, order):
+    """
+    Mark an order delivered: the driver is released, moves to the customer
+    and is offered the oldest pending orders. A driver left idle is given a
+    spot to wait at where orders are expected.
+    """
+    order['delivered'] = True
+    release_active_order(order_id, order)
+    for user in users:
+        if user['username'] == order['delivery_agent']:
+            user['location'] = order['customer_location']
+            break
+    taken = pending_dispatcher.driver_freed(order['delivery_agent'])
+    if taken is None and not active_orders(order['delivery_agent']):
+        demand_rebalancer.request_advice(order['delivery_agent'])
+    return taken
+
+
+pending_dispatcher = PendingDispatcher()
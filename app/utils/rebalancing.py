@@ -0,0 +1,251 @@
+import threading
+import time
+import numpy as np
+from app.models.stores import current_order, driver_listeners
+from app.models.users import users
+from app.utils.algo import dispatch_lock, distance_rows, order_stops, routing_snapshot
+from app.utils.spatial_index import spatial_index
+from app.utils.travel_times import travel_times
+
+# Defaults, overridden from the app config by demand_rebalancer.init_app()
+REBALANCE_ENABLED = True
+REBALANCE_HALF_LIFE_MINUTES = 30.0  # an order counts half as much as demand this much later
+REBALANCE_DEMAND_NODES = 50  # busiest nodes the expected first leg is measured over
+REBALANCE_CANDIDATES = 20  # busiest nodes drivers may be sent to
+REBALANCE_MIN_GAIN = 0.1  # km (or minutes with ETAs) of expected first leg a move must save
+REBALANCE_MAX_MOVE = None  # longest repositioning drive; None for no limit
+REBALANCE_INTERVAL_SECONDS = 300  # how often every idle driver is reconsidered; 0 disables it
+
+
+class DemandRebalancer:
+    """
+    Suggests where idle delivery agents should wait for their next order.
+
+    Every order adds to a demand count at its stores, where its first leg
+    ends, split evenly between them. Counts decay exponentially with the
+    given half-life, so they follow the last hour or so rather than the day.
+
+    suggest() treats the busiest nodes as a demand distribution and measures
+    the expected first leg of a new order: the demand-weighted distance from
+    each node to the nearest idle driver. It then moves idle drivers to busy
+    nodes one at a time, always taking the move that shortens the expected
+    first leg the most, until no move saves at least min_gain. Each driver
+    moves at most once per call.
+
+    A driver who finishes a delivery without being handed a pending order is
+    given a target (request_advice()). Every interval seconds a background
+    thread also runs rebalance() over all idle drivers, so drivers who stay
+    idle follow demand as it shifts; while it runs, that thread also works out
+    the targets of newly idle drivers, so completing a delivery never waits
+    for it. The target is shown on their dashboard and dropped once they get
+    an order.
+    """
+
+    def __init__(self, enabled=REBALANCE_ENABLED, half_life=REBALANCE_HALF_LIFE_MINUTES,
+                 demand_nodes=REBALANCE_DEMAND_NODES, candidates=REBALANCE_CANDIDATES,
+                 min_gain=REBALANCE_MIN_GAIN, max_move=REBALANCE_MAX_MOVE, interval=REBALANCE_INTERVAL_SECONDS):
+        self.enabled = enabled
+        self.half_life = half_life
+        self.demand_nodes = demand_nodes
+        self.candidates = candidates
+        self.min_gain = min_gain
+        self.max_move = max_move
+        self.interval = interval
+        self.targets = {}  # username -> node suggested to wait at
+        self._counts = {}  # node -> (count, when it was last updated)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._advice = []  # usernames waiting for the background thread to advise them
+
+    def init_app(self, app):
+        self.enabled = app.config.get('REBALANCE_ENABLED', self.enabled)
+        self.half_life = app.config.get('REBALANCE_HALF_LIFE_MINUTES', self.half_life)
+        self.demand_nodes = app.config.get('REBALANCE_DEMAND_NODES', self.demand_nodes)
+        self.candidates = app.config.get('REBALANCE_CANDIDATES', self.candidates)
+        self.min_gain = app.config.get('REBALANCE_MIN_GAIN', self.min_gain)
+        self.max_move = app.config.get('REBALANCE_MAX_MOVE', self.max_move)
+        self.interval = app.config.get('REBALANCE_INTERVAL_SECONDS', self.interval)
+        self.clear()
+        if self.enabled and self.interval:
+            self.start()
+        else:
+            self.stop()
+
+    def start(self):
+        """Run rebalance() every interval seconds on a background thread."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stopped,), name='rebalancer',
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopped.set()
+            self._wake.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    @property
+    def running(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def _run(self, stopped):
+        next_round = time.monotonic() + self.interval
+        while not stopped.is_set():
+            self._wake.wait(max(0.0, next_round - time.monotonic()))
+            self._wake.clear()
+            if stopped.is_set():
+                break
+            with self._lock:
+                advice, self._advice = self._advice, []
+            for username in advice:
+                self.advise(username)
+            if time.monotonic() >= next_round:
+                self.rebalance()
+                next_round = time.monotonic() + self.interval
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self.targets.clear()
+
+    def _decayed(self, count, since, when):
+        minutes = (when - since).total_seconds() / 60
+        return count * 0.5 ** (max(minutes, 0.0) / self.half_life)
+
+    def record_order(self, order, when=None):
+        """Count a new order at its stores."""
+        if not self.enabled:
+            return
+        when = when or travel_times.clock()
+        _, stores_to_visit, _ = order_stops(order)
+        with self._lock:
+            for node in stores_to_visit:
+                count, since = self._counts.get(node, (0.0, when))
+                self._counts[node] = (self._decayed(count, since, when) + 1 / len(stores_to_visit), when)
+
+    def demand(self, when=None):
+        """{node: decayed order count} for every node with recent orders."""
+        when = when or travel_times.clock()
+        with self._lock:
+            demand = {node: self._decayed(count, since, when) for node, (count, since) in self._counts.items()}
+            # Forget nodes whose orders have all but decayed away
+            for node in [node for node, count in demand.items() if count < 1e-3]:
+                del self._counts[node]
+                del demand[node]
+        return demand
+
+    def driver_changed(self, username):
+        """A driver with an order no longer needs a waiting spot."""
+        if username in self.targets and current_order(username):
+            self.targets.pop(username, None)
+
+    def target_of(self, username):
+        return self.targets.get(username)
+
+    def idle_drivers(self):
+        """{username: node} for every delivery agent without an order."""
+        return {user['username']: spatial_index.nearest_node(user.get('location')) or "Admin Office"
+                for user in users if user['user_type'] == 'Delivery Agent' and not current_order(user['username'])}
+
+    def suggest(self, movable=None, when=None):
+        """
+        Repositioning moves for idle drivers (only those in movable, if given;
+        the other idle drivers still count as covering their nodes), as
+        {'driver', 'from', 'to', 'gain'} dicts in the order they were chosen.
+        gain is how much the move shortens the expected first leg.
+        """
+        demand = sorted(self.demand(when).items(), key=lambda item: -item[1])[:self.demand_nodes]
+        idle = self.idle_drivers()
+        if not demand or not idle:
+            return []
+        drivers = list(idle)
+        movable = set(drivers if movable is None else movable)
+
+        demand_nodes = [node for node, _ in demand]
+        weights = np.array([count for _, count in demand])
+        weights /= weights.sum()
+        candidates = demand_nodes[:self.candidates]
+        # Only the driver -> demand, candidate -> demand and driver -> candidate
+        # distances are used, so only those are gathered
+        driver_nodes = list(dict.fromkeys(idle.values()))
+        row = {node: i for i, node in enumerate(driver_nodes)}
+        shortest_paths = routing_snapshot()
+        from_driver_nodes = distance_rows(shortest_paths, driver_nodes, demand_nodes)
+        from_candidates = distance_rows(shortest_paths, candidates, demand_nodes)
+        to_candidates = (distance_rows(shortest_paths, driver_nodes, candidates) if self.max_move is not None
+                         else None)
+
+        # Unreachable pairs cost more than any real first leg, so covering them comes first
+        finite = np.concatenate([from_driver_nodes[np.isfinite(from_driver_nodes)],
+                                 from_candidates[np.isfinite(from_candidates)]])
+        unreachable = 10 * (finite.max() if finite.size else 1.0) + 1
+        from_driver_nodes[~np.isfinite(from_driver_nodes)] = unreachable
+        from_candidates[~np.isfinite(from_candidates)] = unreachable
+        from_drivers = from_driver_nodes[[row[idle[username]] for username in drivers]]
+        moves_allowed = np.array([[username in movable and idle[username] != target and
+                                   (to_candidates is None or to_candidates[row[idle[username]], c] <= self.max_move)
+                                   for c, target in enumerate(candidates)] for username in drivers])
+
+        moves = []
+        while moves_allowed.any():
+            # Nearest and second nearest driver of every demand node
+            order = np.argsort(from_drivers, axis=0)
+            nearest = from_drivers[order[0], np.arange(len(demand_nodes))]
+            second = (from_drivers[order[1], np.arange(len(demand_nodes))] if len(drivers) > 1
+                      else np.full(len(demand_nodes), np.inf))
+            current = weights @ nearest
+
+            # Expected first leg with driver i moved to candidate c: the others
+            # cover each node as before (without i), and c covers its part
+            without = np.where(order[0][None, :] == np.arange(len(drivers))[:, None], second[None, :], nearest[None, :])
+            expected = np.minimum(without[:, None, :], from_candidates[None, :, :]) @ weights
+            gains = np.where(moves_allowed, current - expected, -np.inf)
+            i, c = np.unravel_index(np.argmax(gains), gains.shape)
+            if gains[i, c] < self.min_gain:
+                break
+
+            moves.append({'driver': drivers[i], 'from': idle[drivers[i]], 'to': candidates[c],
+                          'gain': float(gains[i, c])})
+            from_drivers[i] = from_candidates[c]
+            moves_allowed[i] = False
+        return moves
+
+    def rebalance(self, movable=None, when=None):
+        """suggest() and remember each moved driver's target."""
+        if not self.enabled:
+            return []
+        moves = self.suggest(movable, when)
+        # Worked out without the dispatch lock, so drivers handed an order meanwhile are skipped
+        with dispatch_lock:
+            moves = [move for move in moves if not current_order(move['driver'])]
+            for move in moves:
+                self.targets[move['driver']] = move['to']
+        return moves
+
+    def advise(self, username, when=None):
+        """Suggest a waiting spot for one newly idle driver; returns the node, or None to stay put."""
+        if not self.rebalance([username], when):
+            self.targets.pop(username, None)
+        return self.targets.get(username)
+
+    def request_advice(self, username):
+        """advise() on the background thread if it is running, otherwise straight away."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.running:
+                self._advice.append(username)
+                self._wake.set()
+                return
+        self.advise(username)
+
+
+demand_rebalancer = DemandRebalancer()
+driver_listeners.append(demand_rebalancer.driver_changed)
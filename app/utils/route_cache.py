@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+from app.utils.distance_matrix import distance_matrix
+
+# Default, overridden from the app config by route_cache.init_app()
+ROUTE_CACHE_SIZE = 4096  # 0 disables the cache
+
+
+class RouteCache:
+    """
+    Bounded least-recently-used cache of solved routes.
+
+    best_route stores its result under
+    (driver_node, frozenset(stores_to_visit), customer_node, graph_version),
+    so orders of the same shape from the same start are a dictionary lookup.
+    The cache is cleared whenever the distance matrix is invalidated; the graph
+    version in the key also keeps results from an older snapshot apart.
+    """
+
+    def __init__(self, maxsize=ROUTE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('ROUTE_CACHE_SIZE', self.maxsize)
+        self.clear()
+
+    def get(self, key):
+        """Cached value for key, or None (counted as a miss)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+route_cache = RouteCache()
+distance_matrix.add_listener(route_cache.clear)
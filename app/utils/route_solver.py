@@ -0,0 +1,264 @@
+import functools
+import itertools
+import math
+import time
+import numpy as np
+
+# Defaults, overridden from the app config by route_solver.init_app()
+BRUTE_FORCE_MAX_STOPS = 7  # vectorised brute force beats Held-Karp up to here
+EXACT_MAX_STOPS = 12
+TIME_BUDGET = 0.05  # seconds for the heuristic improver, shared by every route of one dispatch
+BRUTE_FORCE_BLOCK = 1 << 20  # starts x permutations scored per NumPy call
+
+
+def route_length(dist, start, stops, end):
+    """Length of the path start -> stops... -> end, inf if any leg is unreachable."""
+    path = [start] + list(stops) + [end]
+    return float(dist[path[:-1], path[1:]].sum())
+
+
+@functools.lru_cache(maxsize=None)
+def permutation_table(n):
+    """Every permutation of range(n) as an (n!, n) index array, built once per stop count."""
+    table = np.array(list(itertools.permutations(range(n))), dtype=np.intp).reshape(math.factorial(n), n)
+    table.setflags(write=False)
+    return table
+
+
+def brute_force_routes(dist, starts, stops, end):
+    """
+    Exact solver that tries every permutation of the stops, for several starts at once.
+
+    The stops -> stops -> end part of each permutation does not depend on the
+    start, so it is gathered from dist once; the first leg is then added for
+    every (start, permutation) pair and the best permutation per start is a
+    single argmin. Returns a list of (distance, order) per start, with
+    (inf, None) for starts that can't complete a route.
+    """
+    starts = np.asarray(list(starts), dtype=np.intp)
+    stops = np.asarray(list(stops), dtype=np.intp)
+    if not len(stops):
+        return [(float(length), []) if length < float('inf') else (float('inf'), None)
+                for length in dist[starts, end]]
+
+    perms = stops[permutation_table(len(stops))]
+    tails = dist[perms[:, :-1], perms[:, 1:]].sum(axis=1) + dist[perms[:, -1], end]
+
+    results = []
+    block = max(1, BRUTE_FORCE_BLOCK // len(perms))
+    for first in range(0, len(starts), block):
+        totals = dist[np.ix_(starts[first:first + block], perms[:, 0])] + tails[None, :]
+        best = totals.argmin(axis=1)
+        for row, column in enumerate(best):
+            distance = float(totals[row, column])
+            if distance == float('inf'):
+                results.append((distance, None))
+            else:
+                results.append((distance, perms[column].tolist()))
+    return results
+
+
+def brute_force_route(dist, start, stops, end):
+    """
+    Exact solver that tries every permutation of the stops.
+    Only sensible for a handful of stops.
+    """
+    return brute_force_routes(dist, [start], stops, end)[0]
+
+
+def held_karp_route(dist, start, stops, end):
+    """
+    Exact solver using the Held-Karp bitmask dynamic program.
+
+    dp[mask, j] is the shortest path that leaves start, visits exactly the stops
+    in mask and ends at stop j. Masks are processed one popcount layer at a time
+    so that every layer is a single vectorised NumPy update.
+    O(2^n * n^2) time and O(2^n * n) memory, fine up to about 15 stops.
+    """
+    stops = list(stops)
+    n = len(stops)
+    if n == 0:
+        return float(dist[start, end]), []
+
+    legs = dist[np.ix_(stops, stops)]
+    from_start = dist[start, stops]
+    to_end = dist[stops, end]
+
+    full = (1 << n) - 1
+    bits = 1 << np.arange(n)
+    masks = np.arange(full + 1)
+    popcount = ((masks[:, None] & bits[None, :]) > 0).sum(axis=1)
+
+    dp = np.full((full + 1, n), np.inf)
+    parent = np.full((full + 1, n), -1, dtype=np.int16)
+    dp[bits, np.arange(n)] = from_start
+
+    for size in range(2, n + 1):
+        layer = masks[popcount == size]
+        # prev[m, j] is layer[m] without stop j
+        prev = layer[:, None] ^ bits[None, :]
+        # candidates[m, j, i] = dp[prev[m, j], i] + legs[i, j]
+        candidates = dp[prev] + legs.T[None, :, :]
+        best = candidates.argmin(axis=2)
+        values = np.take_along_axis(candidates, best[:, :, None], axis=2)[:, :, 0]
+        # Stops that are not in the mask cannot be the last one visited
+        values[(layer[:, None] & bits[None, :]) == 0] = np.inf
+        dp[layer] = values
+        parent[layer] = best
+
+    totals = dp[full] + to_end
+    last = int(totals.argmin())
+    best_distance = float(totals[last])
+    if best_distance == float('inf'):
+        return best_distance, None
+
+    # Walk the parent pointers back from the full mask
+    order = []
+    mask = full
+    j = last
+    while j >= 0:
+        order.append(stops[j])
+        previous = int(parent[mask, j])
+        mask ^= 1 << j
+        j = previous
+    order.reverse()
+
+    return best_distance, order
+
+
+def nearest_neighbour_route(dist, start, stops, end):
+    """Greedy construction: always drive to the closest stop not yet visited."""
+    remaining = list(stops)
+    order = []
+    current = start
+    while remaining:
+        nearest = min(remaining, key=lambda stop: dist[current, stop])
+        remaining.remove(nearest)
+        order.append(nearest)
+        current = nearest
+    return order
+
+
+def improve_route(dist, start, order, end, deadline):
+    """
+    Local search on an open path with fixed endpoints.
+    Alternates 2-opt (segment reversal) and Or-opt (moving runs of 1-3 stops)
+    until neither finds an improvement or the deadline passes.
+    """
+    order = list(order)
+    best_distance = route_length(dist, start, order, end)
+    n = len(order)
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # 2-opt: reverse order[i:j + 1]
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidate_distance = route_length(dist, start, candidate, end)
+                if candidate_distance < best_distance:
+                    order, best_distance = candidate, candidate_distance
+                    improved = True
+            if time.perf_counter() >= deadline:
+                return best_distance, order
+
+        # Or-opt: move a run of 1-3 consecutive stops to another position
+        for length in (1, 2, 3):
+            for i in range(n - length + 1):
+                segment = order[i:i + length]
+                rest = order[:i] + order[i + length:]
+                for position in range(len(rest) + 1):
+                    if position == i:
+                        continue
+                    candidate = rest[:position] + segment + rest[position:]
+                    candidate_distance = route_length(dist, start, candidate, end)
+                    if candidate_distance < best_distance:
+                        order, best_distance = candidate, candidate_distance
+                        improved = True
+                        break
+            if time.perf_counter() >= deadline:
+                return best_distance, order
+
+    return best_distance, order
+
+
+def local_search_route(dist, start, stops, end, time_budget=TIME_BUDGET):
+    """Heuristic solver: nearest neighbour construction followed by 2-opt/Or-opt."""
+    deadline = time.perf_counter() + time_budget
+    order = nearest_neighbour_route(dist, start, stops, end)
+    best_distance, order = improve_route(dist, start, order, end, deadline)
+    if best_distance == float('inf'):
+        return best_distance, None
+    return best_distance, order
+
+
+class RouteSolver:
+    """
+    Picks the cheapest route through a set of stops, from a fixed start to a fixed end.
+
+    Small problems are solved exactly (brute force, then Held-Karp), larger ones with
+    the local search heuristic inside a time budget. The individual solvers can be
+    swapped out by passing different callables.
+    """
+
+    def __init__(self, brute_force=brute_force_route, exact=held_karp_route, heuristic=local_search_route,
+                 brute_force_max_stops=BRUTE_FORCE_MAX_STOPS, exact_max_stops=EXACT_MAX_STOPS,
+                 time_budget=TIME_BUDGET, brute_force_many=brute_force_routes):
+        self.brute_force = brute_force
+        self.brute_force_many = brute_force_many
+        self.exact = exact
+        self.heuristic = heuristic
+        self.brute_force_max_stops = brute_force_max_stops
+        self.exact_max_stops = exact_max_stops
+        self.time_budget = time_budget
+
+    def init_app(self, app):
+        self.brute_force_max_stops = app.config.get('ROUTE_SOLVER_BRUTE_FORCE_MAX_STOPS', self.brute_force_max_stops)
+        self.exact_max_stops = app.config.get('ROUTE_SOLVER_EXACT_MAX_STOPS', self.exact_max_stops)
+        self.time_budget = app.config.get('ROUTE_SOLVER_TIME_BUDGET', self.time_budget)
+
+    def deadline(self):
+        """perf_counter() time by which the heuristic must stop, time_budget from now."""
+        return time.perf_counter() + self.time_budget
+
+    def solve(self, dist, start, stops, end, deadline=None):
+        """
+        Returns (distance, order) where order lists the given stops in visiting order,
+        or (inf, None) if no route reaches every stop and the end.
+        dist is a distance table and start, stops and end are indices into it;
+        only the columns of the stops and the end are read, so it may have
+        extra rows (e.g. one per start for solve_many) and no others.
+        The heuristic gets time_budget, or only until deadline when one is given.
+        """
+        stops = list(stops)
+        if len(stops) <= self.brute_force_max_stops:
+            best_distance, order = self.brute_force(dist, start, stops, end)
+        elif len(stops) <= self.exact_max_stops:
+            best_distance, order = self.exact(dist, start, stops, end)
+        else:
+            time_budget = self.time_budget if deadline is None else max(0.0, deadline - time.perf_counter())
+            best_distance, order = self.heuristic(dist, start, stops, end, time_budget=time_budget)
+
+        if order is None or best_distance == float('inf'):
+            return float('inf'), None
+        return best_distance, order
+
+    def solve_many(self, dist, starts, stops, end, deadline=None):
+        """
+        solve() for several starts sharing the same stops and end, as a list of
+        (distance, order) per start. Small problems are brute forced for all
+        starts in one vectorised pass. Large ones share a single time budget
+        (or the given deadline): once it has passed the remaining starts only
+        get the nearest neighbour construction.
+        """
+        stops = list(stops)
+        if len(stops) <= self.brute_force_max_stops:
+            return self.brute_force_many(dist, starts, stops, end)
+        if deadline is None:
+            deadline = self.deadline()
+        return [self.solve(dist, start, stops, end, deadline) for start in starts]
+
+
+route_solver = RouteSolver()
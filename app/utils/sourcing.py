@@ -0,0 +1,165 @@
+import numpy as np
+from app.models.stores import stores
+from app.utils.distance_matrix import distance_matrix
+from app.utils.route_solver import route_solver
+
+# Defaults, overridden from the app config by sourcing_optimizer.init_app()
+SOURCING_COST_PER_KM = 2.0  # price units one km of delivery route is worth; 0 disables sourcing
+SOURCING_MAX_NODES = 5000  # search nodes explored before settling for the best plan found
+
+
+def unit_price(item):
+    return item["price"] * (1 - item["discount"] / 100)
+
+
+def store_node(store_id):
+    return f"Store {chr(64 + int(store_id))}"  # Convert 1,2,3 to A,B,C
+
+
+class SourcingOptimizer:
+    """
+    Chooses which store fills each cart line at checkout.
+
+    add_to_cart picks the cheapest store for every item on its own, which can
+    split a basket over many stores. plan() instead minimises
+
+        item prices + cost_per_km * length of the pickup route
+
+    where the pickup route visits the chosen stores (starting at whichever is
+    best, since the driver isn't known yet) and ends at the customer. It is a
+    depth-first branch and bound over the candidate stores: a branch is pruned
+    when the route through the stores already chosen plus the cheapest prices
+    still available can't beat the best plan found. The search starts from the
+    cheapest-price plan and stops after max_nodes nodes, so it is never worse
+    than picking each item's cheapest store.
+    """
+
+    def __init__(self, cost_per_km=SOURCING_COST_PER_KM, max_nodes=SOURCING_MAX_NODES):
+        self.cost_per_km = cost_per_km
+        self.max_nodes = max_nodes
+
+    def init_app(self, app):
+        self.cost_per_km = app.config.get('SOURCING_COST_PER_KM', self.cost_per_km)
+        self.max_nodes = app.config.get('SOURCING_MAX_NODES', self.max_nodes)
+
+    def route_cost(self, shortest_paths, store_ids, customer_node):
+        """Shortest route from any of the stores, through all of them, to the customer."""
+        if not store_ids:
+            return 0.0
+        route_nodes = [store_node(store_id) for store_id in store_ids] + [customer_node]
+        size = len(route_nodes) + 1
+        # Row/column 0 is a virtual start that reaches every store for free
+        dist = np.full((size, size), np.inf)
+        dist[1:, 1:] = shortest_paths.submatrix(route_nodes)
+        dist[0, 0] = 0.0
+        dist[0, 1:size - 1] = 0.0
+        distance, _ = route_solver.solve(dist, 0, range(1, size - 1), size - 1)
+        return distance
+
+    def plan(self, lines, customer_node, shortest_paths=None):
+        """
+        lines maps item name -> (quantity, current store_id).
+        Returns (assignment, cost) where assignment maps item name -> store_id.
+        Items no store has enough stock for keep their current store.
+        """
+        shortest_paths = shortest_paths or distance_matrix.snapshot()
+
+        # Candidate (store_id, unit price) pairs per item, cheapest first
+        candidates = {}
+        pinned = {}
+        for item_name, (quantity, current_store) in lines.items():
+            options = sorted(
+                ((unit_price(store["items"][item_name]), store_id) for store_id, store in stores.items()
+                 if item_name in store["items"] and store["items"][item_name]["stock"] >= quantity),
+                key=lambda option: option[0])
+            if options:
+                candidates[item_name] = [(store_id, price * quantity) for price, store_id in options]
+            else:
+                pinned[item_name] = current_store
+
+        forced = frozenset(pinned.values())
+        # Stores that carry many of the items are tried first, as they tend to give short routes
+        coverage = {}
+        for options in candidates.values():
+            for store_id, _ in options:
+                coverage[store_id] = coverage.get(store_id, 0) + 1
+        optional = sorted(set(coverage) - forced, key=lambda store_id: (-coverage[store_id], store_id))
+
+        route_costs = {}
+
+        def route(chosen):
+            if chosen not in route_costs:
+                route_costs[chosen] = self.cost_per_km * self.route_cost(
+                    shortest_paths, sorted(chosen), customer_node)
+            return route_costs[chosen]
+
+        def prices(available):
+            """Cheapest price of every item within available stores, None if an item isn't covered."""
+            total, assignment = 0.0, {}
+            for item_name, options in candidates.items():
+                for store_id, price in options:
+                    if store_id in available:
+                        total += price
+                        assignment[item_name] = store_id
+                        break
+                else:
+                    return None, None
+            return total, assignment
+
+        # Start from the cheapest-price plan, i.e. what add_to_cart would pick
+        greedy_price, greedy = prices(set(coverage) | forced)
+        used = frozenset(greedy.values()) | forced
+        best_cost, best = greedy_price + route(used), greedy
+
+        nodes = 0
+        stack = [(0, forced)]
+        while stack and nodes < self.max_nodes:
+            depth, chosen = stack.pop()
+            nodes += 1
+
+            # Lower bound: the route can only get longer and prices only higher
+            bound_price, _ = prices(chosen.union(optional[depth:]))
+            if bound_price is None or bound_price + route(chosen) >= best_cost:
+                continue
+
+            price, assignment = prices(chosen)
+            if price is not None and price + route(chosen) < best_cost:
+                best_cost, best = price + route(chosen), assignment
+
+            if depth < len(optional):
+                # Explore "without" after "with", so pushed first
+                stack.append((depth + 1, chosen))
+                stack.append((depth + 1, chosen | {optional[depth]}))
+
+        return dict(best, **pinned), best_cost
+
+    def source_cart(self, cart, customer_node):
+        """
+        Returns a copy of a session cart with each line moved to the store chosen by plan()
+        and its price fields updated from that store.
+        """
+        if not cart or not self.cost_per_km:
+            return cart
+
+        lines = {item_name: (item['quantity'], item['store_id']) for item_name, item in cart.items()}
+        assignment, _ = self.plan(lines, customer_node)
+
+        sourced = {}
+        for item_name, item in cart.items():
+            store_id = assignment[item_name]
+            line = dict(item)
+            if store_id != item['store_id']:
+                details = stores[store_id]["items"][item_name]
+                line.update({
+                    "price": details["price"],
+                    "discount": details["discount"],
+                    "final_price": unit_price(details),
+                    "stock": details["stock"],
+                    "store_id": store_id,
+                    "store_location": stores[store_id]["location"],
+                })
+            sourced[item_name] = line
+        return sourced
+
+
+sourcing_optimizer = SourcingOptimizer()
@@ -0,0 +1,133 @@
+import threading
+import numpy as np
+from app.models.users import graph_positions
+from app.utils.csr_graph import load_positions
+from app.utils.distance_matrix import distance_matrix
+
+
+class KDTree:
+    """
+    Static 2-d tree over a fixed set of points, stored in flat NumPy arrays.
+
+    Slot i of the tree holds point index[i], split on axis[i], with children in
+    slots left[i] / right[i] (-1 when missing). Nearest neighbour queries take
+    O(log n) on average.
+    """
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        size = len(self.points)
+        self.index = np.empty(size, dtype=np.int64)
+        self.axis = np.empty(size, dtype=np.int8)
+        self.left = np.full(size, -1, dtype=np.int64)
+        self.right = np.full(size, -1, dtype=np.int64)
+        self.root = self._build() if size else -1
+
+        # Plain Python copies make the per-node work in queries much cheaper
+        self._coords = self.points.tolist()
+        self._index = self.index.tolist()
+        self._axis = self.axis.tolist()
+        self._left = self.left.tolist()
+        self._right = self.right.tolist()
+
+    def _build(self):
+        next_slot = 0
+        # (point ids, parent slot, is_left_child)
+        stack = [(np.arange(len(self.points)), -1, False)]
+        root = 0
+        while stack:
+            ids, parent, is_left = stack.pop()
+            coords = self.points[ids]
+            # Split on the axis with the larger spread
+            axis = int(np.ptp(coords[:, 1]) > np.ptp(coords[:, 0]))
+            ids = ids[np.argsort(coords[:, axis], kind='stable')]
+            median = len(ids) // 2
+
+            slot = next_slot
+            next_slot += 1
+            self.index[slot] = ids[median]
+            self.axis[slot] = axis
+            if parent < 0:
+                root = slot
+            elif is_left:
+                self.left[parent] = slot
+            else:
+                self.right[parent] = slot
+
+            if median > 0:
+                stack.append((ids[:median], slot, True))
+            if median + 1 < len(ids):
+                stack.append((ids[median + 1:], slot, False))
+        return root
+
+    def nearest(self, point):
+        """Index of the point closest to point, -1 if the tree is empty."""
+        x, y = float(point[0]), float(point[1])
+        target = (x, y)
+        best, best_distance = -1, float('inf')
+
+        # (slot, lower bound on the squared distance of anything under it)
+        stack = [(self.root, 0.0)]
+        while stack:
+            slot, bound = stack.pop()
+            if slot < 0 or bound >= best_distance:
+                continue
+            px, py = self._coords[self._index[slot]]
+            distance = (px - x) ** 2 + (py - y) ** 2
+            if distance < best_distance:
+                best, best_distance = self._index[slot], distance
+
+            axis = self._axis[slot]
+            diff = target[axis] - (px, py)[axis]
+            near, far = (self._left[slot], self._right[slot]) if diff < 0 else (self._right[slot], self._left[slot])
+            # Push the far side first so the near side is searched first
+            stack.append((far, diff * diff))
+            stack.append((near, bound))
+        return best
+
+
+class SpatialIndex:
+    """
+    Snaps (x, y) coordinates to the nearest node of the delivery graph.
+
+    The k-d tree is built from graph_positions on first use and thrown away
+    whenever the distance matrix is invalidated, i.e. whenever the graph changes.
+    """
+
+    def __init__(self, positions):
+        self.positions = positions
+        self._tree = None
+        self._nodes = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Node coordinates for a graph loaded from DELIVERY_GRAPH_FILE
+        path = app.config.get('DELIVERY_GRAPH_POSITIONS_FILE')
+        if path:
+            self.positions.clear()
+            self.positions.update(load_positions(path))
+            self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._tree = None
+
+    def _current(self):
+        with self._lock:
+            if self._tree is None:
+                self._nodes = list(self.positions)
+                self._tree = KDTree([self.positions[node] for node in self._nodes])
+            return self._tree, self._nodes
+
+    def nearest_node(self, location):
+        """Name of the graph node closest to location, None if location or the index is empty."""
+        if location is None:
+            return None
+        tree, nodes = self._current()
+        found = tree.nearest(location)
+        return nodes[found] if found >= 0 else None
+
+
+# Shared index over the module level graph positions
+spatial_index = SpatialIndex(graph_positions)
+distance_matrix.add_listener(spatial_index.invalidate)
@@ -0,0 +1,218 @@
+import heapq
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from app.utils.alt_routing import LandmarkSnapshot
+from app.utils.csr_graph import CSRGraph, _open_rows
+from app.utils.distance_matrix import DistanceSnapshot, compute_distance_matrix, distance_matrix
+
+# Defaults, overridden from the app config by travel_times.init_app()
+DISPATCH_OBJECTIVE = 'distance'  # 'eta' to dispatch on travel time
+TRAFFIC_BUCKET_MINUTES = 15  # 96 buckets per day
+TRAFFIC_SPEED_KMH = 30.0  # for edges without a profile
+TRAFFIC_CACHED_BUCKETS = 4  # travel time snapshots kept in memory
+
+
+class TravelTimes:
+    """
+    Time-dependent travel times on the delivery graph.
+
+    An edge's travel time in minutes can be given a profile, an array with one
+    value per time-of-day bucket (96 x 15 minutes by default); edges without a
+    profile take their length in km at speed_kmh. Two views are built from
+    the profiles:
+
+    - snapshot(when) freezes every edge at the bucket `when` falls in and
+      returns a DistanceSnapshot of minutes instead of km. Dispatch ranks
+      drivers on it exactly as on the distance matrix. Snapshots are cached per
+      bucket, so they are only rebuilt when the clock moves to a new bucket
+      (or the graph or profiles change).
+    - travel_minutes() / route_minutes() run a time-dependent Dijkstra where each
+      edge costs its profile value for the bucket the driver enters it in,
+      for ETAs that follow the traffic through the day.
+    """
+
+    def __init__(self, distances, objective=DISPATCH_OBJECTIVE, bucket_minutes=TRAFFIC_BUCKET_MINUTES,
+                 speed_kmh=TRAFFIC_SPEED_KMH, cached_buckets=TRAFFIC_CACHED_BUCKETS, clock=datetime.now):
+        self.distances = distances
+        self.clock = clock  # what "now" means, e.g. a simulated clock
+        self.objective = objective
+        self.bucket_minutes = bucket_minutes
+        self.speed_kmh = speed_kmh
+        self.cached_buckets = cached_buckets
+        self.profiles = {}  # (u, v) -> minutes per bucket
+        self.version = 0
+        self._snapshots = OrderedDict()  # bucket -> snapshot
+        self._network = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.objective = app.config.get('DISPATCH_OBJECTIVE', self.objective)
+        self.bucket_minutes = app.config.get('TRAFFIC_BUCKET_MINUTES', self.bucket_minutes)
+        self.speed_kmh = app.config.get('TRAFFIC_SPEED_KMH', self.speed_kmh)
+        self.cached_buckets = app.config.get('TRAFFIC_CACHED_BUCKETS', self.cached_buckets)
+        self.profiles.clear()
+        path = app.config.get('TRAFFIC_PROFILE_FILE')
+        if path:
+            self.load_profiles(path)
+        self.invalidate()
+
+    @property
+    def enabled(self):
+        return self.objective == 'eta'
+
+    @property
+    def buckets(self):
+        return 24 * 60 // self.bucket_minutes
+
+    def invalidate(self):
+        """Drop every cached snapshot; called when the graph or the profiles change."""
+        with self._lock:
+            self.version += 1
+            self._snapshots.clear()
+            self._network = None
+
+    def set_profile(self, u, v, minutes):
+        """Travel time of edge u-v in minutes for each bucket of the day."""
+        minutes = np.asarray(minutes, dtype=np.float64)
+        if minutes.shape != (self.buckets,):
+            raise ValueError(f"Edge {u}-{v} needs {self.buckets} travel times, got {minutes.shape}")
+        self.profiles[u, v] = minutes
+        self.invalidate()
+
+    def load_profiles(self, path, delimiter=None):
+        """
+        Read profiles from a file with rows "u v minutes_0 ... minutes_N", in the
+        same format as load_edge_list (comma separated for .csv, header row allowed).
+        """
+        for line_number, row in enumerate(_open_rows(path, delimiter)):
+            try:
+                minutes = [float(value) for value in row[2:]]
+            except ValueError:
+                if line_number == 0:
+                    continue  # Header row
+                raise ValueError(f"{path}: row {line_number + 1} has an invalid travel time")
+            self.set_profile(row[0], row[1], minutes)
+
+    def minute_of_day(self, when=None):
+        """Minutes since midnight of a datetime (default: now); numbers are returned as they are."""
+        if when is None:
+            when = self.clock()
+        if isinstance(when, datetime):
+            return when.hour * 60 + when.minute + when.second / 60
+        return when
+
+    def bucket_of(self, when=None):
+        """
+        Bucket index for a datetime (default: now) or a number of minutes since
+        midnight; times past midnight wrap around to the next day.
+        """
+        return int(self.minute_of_day(when) // self.bucket_minutes) % self.buckets
+
+    def _current_network(self):
+        """
+        (graph_version, graph, base, profiled) for the current graph: the graph in
+        CSR form, the free-flow minutes of every CSR edge, and the profile of
+        every CSR edge that has one, by edge position.
+        """
+        network = self._network
+        if network is not None and network[0] == self.distances.version:
+            return network
+
+        graph = self.distances.graph
+        if not isinstance(graph, CSRGraph):
+            graph = CSRGraph.from_networkx(graph)
+        base = graph.weights.astype(np.float64) / self.speed_kmh * 60
+
+        profiled = {}
+        for (u, v), minutes in self.profiles.items():
+            pairs = [(u, v)] if graph.directed else [(u, v), (v, u)]
+            for source, target in pairs:
+                i, j = graph.name_to_id.get(source), graph.name_to_id.get(target)
+                if i is None or j is None:
+                    continue
+                start, end = graph.indptr[i], graph.indptr[i + 1]
+                for position in np.flatnonzero(graph.indices[start:end] == j):
+                    profiled[int(start + position)] = minutes
+
+        network = (self.distances.version, graph, base, profiled)
+        self._network = network
+        return network
+
+    def bucket_graph(self, bucket):
+        """The delivery graph with every edge weighted by its travel time in the given bucket."""
+        _, graph, base, profiled = self._current_network()
+        weights = base.copy()
+        for position, minutes in profiled.items():
+            weights[position] = minutes[bucket]
+        return CSRGraph(graph.names, graph.indptr, graph.indices, weights, directed=graph.directed)
+
+    def snapshot(self, when=None):
+        """Travel times in minutes between all nodes, frozen at the bucket of `when` (default: now)."""
+        bucket = self.bucket_of(when)
+        with self._lock:
+            key = (self.distances.version, bucket)
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                self._snapshots.move_to_end(key)
+                return snapshot
+
+            graph = self.bucket_graph(bucket)
+            # Distinct from the distance matrix versions, since the route cache is keyed on it
+            version = f"eta-{self.distances.version}-{self.version}-{bucket}"
+            if self.distances.alt_min_nodes and graph.number_of_nodes() >= self.distances.alt_min_nodes:
+                snapshot = LandmarkSnapshot(version, graph, self.distances.alt_landmarks,
+                                            self.distances.alt_pair_cache_size)
+            else:
+                snapshot = DistanceSnapshot(version, *compute_distance_matrix(graph))
+
+            self._snapshots[key] = snapshot
+            while len(self._snapshots) > self.cached_buckets:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def travel_minutes(self, source, target, depart):
+        """
+        Time-dependent shortest travel time in minutes from source to target when
+        leaving at `depart` minutes after midnight; inf if there is no path.
+        """
+        _, graph, base, profiled = self._current_network()
+        i, j = graph.name_to_id.get(source), graph.name_to_id.get(target)
+        if i is None or j is None:
+            return 0.0 if source == target else float('inf')
+
+        arrival = {i: depart}
+        settled = set()
+        heap = [(depart, i)]
+        while heap:
+            time, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == j:
+                return time - depart
+            settled.add(u)
+            bucket = self.bucket_of(time)
+            for position in range(graph.indptr[u], graph.indptr[u + 1]):
+                minutes = profiled.get(position)
+                candidate = time + (minutes[bucket] if minutes is not None else base[position])
+                v = int(graph.indices[position])
+                if candidate < arrival.get(v, float('inf')):
+                    arrival[v] = candidate
+                    heapq.heappush(heap, (candidate, v))
+        return float('inf')
+
+    def route_minutes(self, nodes, when=None):
+        """
+        Minutes to drive through nodes in order, leaving the first one at `when`
+        (a datetime or minutes since midnight, default now).
+        """
+        depart = self.minute_of_day(when)
+        clock = depart
+        for source, target in zip(nodes, nodes[1:]):
+            clock += self.travel_minutes(source, target, clock)
+        return clock - depart
+
+
+travel_times = TravelTimes(distance_matrix)
+distance_matrix.add_listener(travel_times.invalidate)
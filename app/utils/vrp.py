@@ -0,0 +1,398 @@
+import itertools
+import time
+from datetime import datetime, timedelta
+from app.models.stores import active_orders
+from app.utils.algo import candidate_drivers, order_stops, routing_snapshot
+from app.utils.nearest_drivers import nearest_drivers
+from app.utils.spatial_index import spatial_index
+from app.utils.travel_times import travel_times
+from app.utils.zones import zone_index
+
+# Defaults, overridden from the app config by vrp_solver.init_app()
+VRP_DRIVER_CAPACITY = 20  # items a driver can carry at once, unless the driver has a 'capacity'
+VRP_SERVICE_MINUTES = 2.0  # spent at every stop
+VRP_LATENESS_WEIGHT = 10.0  # minutes of driving worth one minute of late delivery
+VRP_WAITING_WEIGHT = 1.0  # minutes of driving worth one minute a customer waits
+VRP_CANDIDATE_DRIVERS = 10  # nearest drivers each new order is tried on
+VRP_TIME_BUDGET = 0.05  # seconds spent improving the routes
+DELIVERY_PROMISE_MINUTES = 60  # delivery window promised at checkout
+
+INF = float('inf')
+PICKUP_ORDERS_TRIED = 3  # orders with up to this many stores try every pickup sequence
+
+
+def order_size(order):
+    """Number of items in an order, the unit driver capacities are given in."""
+    return sum(sum(items.values()) for items in order['items_by_store'].values())
+
+
+def store_items(order, store_id):
+    """Items picked up at one store; trace files give the store IDs as strings."""
+    items = order['items_by_store'].get(store_id)
+    if items is None:
+        items = order['items_by_store'].get(str(store_id), {})
+    return sum(items.values())
+
+
+def route_cost(minutes, vehicle, route, windows, service_minutes=VRP_SERVICE_MINUTES,
+               lateness_weight=VRP_LATENESS_WEIGHT, waiting_weight=VRP_WAITING_WEIGHT):
+    """
+    Drives route from vehicle['start'] and returns (cost, lateness), or None if
+    the route is infeasible: a stop can't be reached, the load goes over the
+    vehicle's capacity, or the last stop is served after its shift ends.
+
+    Stops are (node, job, items, drop, store_id) tuples; a pickup adds items to
+    the load and a drop-off unloads them. A drop-off waits for the start of its
+    job's window and is late past its end (windows[job] = (earliest, latest) in
+    minutes from now). cost is the driving time, plus waiting_weight times the
+    sum of the drop-off times, plus lateness_weight times the total lateness.
+    """
+    clock = vehicle['ready']
+    load = vehicle['load']
+    at = vehicle['start']
+    driving = lateness = waiting = 0.0
+    for node, job, items, drop, _ in route:
+        leg = minutes[at][node]
+        if leg == INF:
+            return None
+        driving += leg
+        clock += leg
+        if drop:
+            window = windows.get(job)
+            if window is not None:
+                clock = max(clock, window[0])
+                lateness += max(0.0, clock - window[1])
+            waiting += clock
+            load -= items
+        else:
+            load += items
+            if load > vehicle['capacity']:
+                return None
+        clock += service_minutes
+        at = node
+    if route and clock - service_minutes > vehicle['shift_end']:
+        return None
+    return driving + waiting_weight * waiting + lateness_weight * lateness, lateness
+
+
+def precedence_ok(route):
+    """True if no pickup comes after the drop-off of its job."""
+    dropped = set()
+    for _, job, _, drop, _ in route:
+        if drop:
+            dropped.add(job)
+        elif job in dropped:
+            return False
+    return True
+
+
+class VRPSolver:
+    """
+    Vehicle routing with pickups and deliveries, capacities and time windows.
+
+    Every driver has a capacity in items and an optional shift end; every
+    order has a promised delivery window. Orders already planned for a driver
+    stay with that driver, new orders are placed with
+
+    - regret insertion: the order that would lose most by not getting its best
+      driver goes first, its store pickups as one block and the drop-off at
+      the cheapest feasible position after them (if time_budget runs out
+      first, the remaining orders are appended to the cheapest route instead);
+    - local search until time_budget runs out or nothing improves: moving a
+      single stop within a route (splitting or interleaving pickups) and moving
+      a new order to another driver.
+
+    Capacity and shift ends are hard constraints. Late deliveries are allowed
+    but every minute late costs lateness_weight minutes of driving, so as load
+    grows orders are spread to keep as many as possible on time instead of
+    stacking them on the nearest driver; waiting_weight keeps routes from using
+    up all the slack in a window when a driver could come sooner. Orders no
+    driver can take are returned unassigned.
+    """
+
+    def __init__(self, capacity=VRP_DRIVER_CAPACITY, service_minutes=VRP_SERVICE_MINUTES,
+                 lateness_weight=VRP_LATENESS_WEIGHT, waiting_weight=VRP_WAITING_WEIGHT,
+                 candidates=VRP_CANDIDATE_DRIVERS,
+                 time_budget=VRP_TIME_BUDGET, promise_minutes=DELIVERY_PROMISE_MINUTES):
+        self.capacity = capacity
+        self.service_minutes = service_minutes
+        self.lateness_weight = lateness_weight
+        self.waiting_weight = waiting_weight
+        self.candidates = candidates
+        self.time_budget = time_budget
+        self.promise_minutes = promise_minutes
+
+    def init_app(self, app):
+        self.capacity = app.config.get('VRP_DRIVER_CAPACITY', self.capacity)
+        self.service_minutes = app.config.get('VRP_SERVICE_MINUTES', self.service_minutes)
+        self.lateness_weight = app.config.get('VRP_LATENESS_WEIGHT', self.lateness_weight)
+        self.waiting_weight = app.config.get('VRP_WAITING_WEIGHT', self.waiting_weight)
+        self.candidates = app.config.get('VRP_CANDIDATE_DRIVERS', self.candidates)
+        self.time_budget = app.config.get('VRP_TIME_BUDGET', self.time_budget)
+        self.promise_minutes = app.config.get('DELIVERY_PROMISE_MINUTES', self.promise_minutes)
+
+    def promised_by(self, placed_at):
+        """End of the delivery window promised for an order placed at placed_at."""
+        return (placed_at + timedelta(minutes=self.promise_minutes)).isoformat()
+
+    def _cost(self, minutes, vehicle, route, windows):
+        return route_cost(minutes, vehicle, route, windows, self.service_minutes, self.lateness_weight,
+                          self.waiting_weight)
+
+    def _best_insertion(self, minutes, vehicle, route, stops, windows):
+        """
+        Cheapest way to add a job's stops (pickups then drop-off) to route: the
+        pickups as one block at position i, the drop-off at position j >= i.
+        Returns (cost, new_route), (inf, None) if no position is feasible.
+        """
+        pickups, drop = stops[:-1], stops[-1]
+        # Small blocks are tried in every order, larger ones as given
+        orders = itertools.permutations(pickups) if len(pickups) <= PICKUP_ORDERS_TRIED else [pickups]
+        best = (INF, None)
+        for block in orders:
+            block = list(block)
+            for i in range(len(route) + 1):
+                head = route[:i] + block
+                for j in range(i, len(route) + 1):
+                    candidate = head + route[i:j] + [drop] + route[j:]
+                    result = self._cost(minutes, vehicle, candidate, windows)
+                    if result is not None and result[0] < best[0]:
+                        best = (result[0], candidate)
+        return best
+
+    def _append(self, minutes, vehicle, route, stops, windows):
+        """A job's stops added after the end of route, as (cost, new_route) or (inf, None) if infeasible."""
+        candidate = route + list(stops)
+        result = self._cost(minutes, vehicle, candidate, windows)
+        return (result[0], candidate) if result is not None else (INF, None)
+
+    def _relocate_stops(self, minutes, vehicle, route, cost, windows, deadline):
+        """Move single stops within route while that makes it cheaper. Returns (cost, route)."""
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for source in range(len(route)):
+                stop = route[source]
+                rest = route[:source] + route[source + 1:]
+                for target in range(len(rest) + 1):
+                    if target == source:
+                        continue
+                    candidate = rest[:target] + [stop] + rest[target:]
+                    if not precedence_ok(candidate):
+                        continue
+                    result = self._cost(minutes, vehicle, candidate, windows)
+                    if result is not None and result[0] < cost - 1e-9:
+                        route, cost, improved = candidate, result[0], True
+                        break
+                if improved:
+                    break
+        return cost, route
+
+    def solve(self, minutes, vehicles, routes, jobs, windows):
+        """
+        Places jobs on vehicles.
+
+        minutes[a][b] is the travel time between node indices a and b. vehicles
+        are dicts with 'start' (node index), 'ready' (minutes from now until the
+        vehicle can leave), 'capacity', 'load' (items on board) and 'shift_end'
+        (minutes from now, inf for none). routes[v] are the stops vehicle v
+        already has planned, jobs maps each new job to its stops (pickups then
+        its drop-off) and windows maps jobs to (earliest, latest) delivery.
+
+        Returns (routes, assignment) with the new route of every vehicle and the
+        vehicle index each job went to (None if no vehicle could take it).
+        """
+        deadline = time.perf_counter() + self.time_budget
+        routes = [list(route) for route in routes]
+        costs = []
+        for vehicle, route in zip(vehicles, routes):
+            result = self._cost(minutes, vehicle, route, windows)
+            # A vehicle whose current plan already breaks a hard limit takes nothing new
+            costs.append(result[0] if result is not None else None)
+
+        def candidates(stops):
+            first = stops[0][0]
+            usable = [v for v, cost in enumerate(costs) if cost is not None]
+            usable.sort(key=lambda v: minutes[vehicles[v]['start']][first])
+            return usable[:self.candidates] if self.candidates else usable
+
+        def insertions(job, insert):
+            """(increase, vehicle, new_route) for every candidate vehicle that can take job, cheapest first."""
+            options = []
+            for v in candidates(jobs[job]):
+                cost, route = insert(minutes, vehicles[v], routes[v], jobs[job], windows)
+                if route is not None:
+                    options.append((cost - costs[v], v, route))
+            options.sort(key=lambda option: option[:2])
+            return options
+
+        def place(job, increase, v, route):
+            routes[v] = route
+            costs[v] += increase
+            assignment[job] = v
+            unplaced.remove(job)
+
+        assignment = dict.fromkeys(jobs)
+        unplaced = list(jobs)
+        out_of_time = False
+        while unplaced:
+            choice = None
+            for job in unplaced:
+                if time.perf_counter() >= deadline:
+                    out_of_time = True
+                    break
+                options = insertions(job, self._best_insertion)
+                if not options:
+                    continue
+                regret = options[1][0] - options[0][0] if len(options) > 1 else INF
+                key = (-regret, options[0][0])
+                if choice is None or key < choice[0]:
+                    choice = (key, job, options[0])
+            if out_of_time:
+                break
+            if choice is None:
+                break  # Nothing left fits anywhere
+            _, job, option = choice
+            place(job, *option)
+
+        # Regret insertion tries every position for every unplaced job per
+        # placement; once the budget is spent the rest are appended, in arrival
+        # order, to whichever route that makes least expensive
+        if out_of_time:
+            for job in list(unplaced):
+                options = insertions(job, self._append)
+                if options:
+                    place(job, *options[0])
+
+        # Local search: reorder stops within each route, then move new jobs between vehicles
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for v, route in enumerate(routes):
+                if costs[v] is not None and len(route) > 1:
+                    cost, routes[v] = self._relocate_stops(minutes, vehicles[v], route, costs[v], windows, deadline)
+                    improved |= cost < costs[v] - 1e-9
+                    costs[v] = cost
+
+            for job, v in assignment.items():
+                if v is None or time.perf_counter() >= deadline:
+                    continue
+                without = [stop for stop in routes[v] if stop[1] != job]
+                remaining = self._cost(minutes, vehicles[v], without, windows)
+                if remaining is None:
+                    continue
+                saving = costs[v] - remaining[0]
+                for other in candidates(jobs[job]):
+                    if other == v:
+                        continue
+                    cost, route = self._best_insertion(minutes, vehicles[other], routes[other], jobs[job], windows)
+                    if route is not None and cost - costs[other] < saving - 1e-9:
+                        routes[v], costs[v] = without, costs[v] - saving
+                        routes[other], costs[other] = route, cost
+                        assignment[job] = other
+                        improved = True
+                        break
+
+        return routes, assignment
+
+    def plan(self, batch, drivers, driver_stops, when=None):
+        """
+        Adds a batch of orders to the plans of drivers, where driver_stops(username)
+        gives a driver's current stops (as InsertionDispatcher.driver_stops).
+
+        Returns (results, plans): results maps each order ID to
+        (driver_username, optimized_store_order) like assign_driver, plans maps
+        every driver whose stops changed to the new stop list.
+        """
+        now = travel_times.clock() if when is None else when
+        drivers = [driver for driver in drivers if driver['user_type'] == 'Delivery Agent']
+        if batch and (nearest_drivers.should_use() or zone_index.should_use()):
+            # Large fleets: only drivers near one of the batch's orders get a vehicle
+            # and rows in the travel time matrix, everyone else keeps their plan
+            nearby = {driver['username'] for order in batch for driver in candidate_drivers(order_stops(order)[1])}
+            drivers = [driver for driver in drivers if driver['username'] in nearby]
+        results = {order['order_id']: (None, []) for order in batch}
+        if not batch or not drivers:
+            return results, {}
+
+        nodes, index = [], {}
+
+        def node_index(node):
+            if node not in index:
+                index[node] = len(nodes)
+                nodes.append(node)
+            return index[node]
+
+        def minutes_until(value):
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            return (value - now).total_seconds() / 60
+
+        windows = {}
+
+        def add_window(order):
+            if order.get('promised_by'):
+                earliest = minutes_until(order['deliver_after']) if order.get('deliver_after') else -INF
+                windows[order['order_id']] = (earliest, minutes_until(order['promised_by']))
+
+        vehicles, routes = [], []
+        for driver in drivers:
+            committed = active_orders(driver['username'])
+            stops = driver_stops(driver['username'])
+            route, load = [], 0
+            for order_id, order in committed.items():
+                add_window(order)
+                remaining = {stop['store_id'] for stop in stops
+                             if stop['order_id'] == order_id and stop['store_id'] is not None}
+                if order.get('status') == 'collected':
+                    remaining = set()
+                load += order_size(order) - sum(store_items(order, store_id) for store_id in remaining)
+
+            for stop in stops:
+                order = committed.get(stop['order_id'])
+                if order is None:
+                    continue  # Planned for an order that is no longer active
+                if stop['store_id'] is None:
+                    route.append((node_index(stop['node']), stop['order_id'], order_size(order), True, None))
+                elif order.get('status') != 'collected':
+                    route.append((node_index(stop['node']), stop['order_id'],
+                                  store_items(order, stop['store_id']), False, stop['store_id']))
+
+            shift_end = driver.get('shift_end')
+            vehicles.append({
+                "start": node_index(spatial_index.nearest_node(driver['location']) or "Admin Office"),
+                "ready": 0.0,
+                "capacity": driver.get('capacity', self.capacity),
+                "load": load,
+                "shift_end": minutes_until(shift_end) if shift_end else INF,
+            })
+            routes.append(route)
+
+        jobs = {}
+        for order in batch:
+            add_window(order)
+            customer_node, stores_to_visit, store_id_mapping = order_stops(order)
+            stops = [(node_index(node), order['order_id'], store_items(order, store_id_mapping[node]), False,
+                      store_id_mapping[node]) for node in stores_to_visit]
+            stops.append((node_index(customer_node), order['order_id'], order_size(order), True, None))
+            jobs[order['order_id']] = stops
+
+        matrix = routing_snapshot().submatrix(nodes)
+        if not travel_times.enabled:
+            matrix = matrix / travel_times.speed_kmh * 60  # km to minutes
+        planned, assignment = self.solve(matrix.tolist(), vehicles, routes, jobs, windows)
+
+        plans = {}
+        for v, driver in enumerate(drivers):
+            if planned[v] != routes[v]:
+                plans[driver['username']] = [{"order_id": job, "node": nodes[node], "store_id": store_id}
+                                             for node, job, _, _, store_id in planned[v]]
+        routes = planned
+        for order_id, v in assignment.items():
+            if v is not None:
+                results[order_id] = (drivers[v]['username'],
+                                     [stop[4] for stop in routes[v] if stop[1] == order_id and not stop[3]])
+        return results, plans
+
+
+vrp_solver = VRPSolver()
@@ -0,0 +1,150 @@
+import math
+import threading
+from app.models.stores import current_order, driver_listeners
+from app.models.users import graph_positions, users
+from app.utils.distance_matrix import distance_matrix
+
+# Defaults, overridden from the app config by zone_index.init_app()
+ZONE_MIN_DRIVERS = 200  # smaller fleets are scored in full
+ZONE_CELL_SIZE = None  # None picks a size giving about ZONE_NODES_PER_CELL graph nodes per zone
+ZONE_NODES_PER_CELL = 25
+ZONE_EXTRA_RINGS = 1  # rings searched after the first one with an available driver
+
+
+class ZoneIndex:
+    """
+    Square grid over the graph_positions plane with the delivery agents in each cell.
+
+    A driver is filed under the zone they would start a new order from: their
+    current order's drop-off if they are busy, otherwise their own location.
+    candidate_rings() walks outwards from the zones of an order's stores, so
+    assign_driver only scores drivers nearby and dispatch cost follows the
+    local fleet density instead of the fleet size.
+
+    Drivers are re-filed lazily: driver_changed() (called whenever a driver's
+    active orders change) marks them dirty, and they are moved on the next
+    lookup. The grid is rebuilt when the graph changes or invalidate() is called,
+    e.g. after replacing the users list.
+    """
+
+    def __init__(self, positions, min_drivers=ZONE_MIN_DRIVERS, cell_size=ZONE_CELL_SIZE,
+                 extra_rings=ZONE_EXTRA_RINGS):
+        self.positions = positions
+        self.min_drivers = min_drivers
+        self.cell_size = cell_size
+        self.extra_rings = extra_rings
+        self._lock = threading.Lock()
+        self._built = False
+        self._dirty = set()
+
+    def init_app(self, app):
+        self.min_drivers = app.config.get('ZONE_MIN_DRIVERS', self.min_drivers)
+        self.cell_size = app.config.get('ZONE_CELL_SIZE', self.cell_size)
+        self.extra_rings = app.config.get('ZONE_EXTRA_RINGS', self.extra_rings)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+
+    def driver_changed(self, username):
+        with self._lock:
+            self._dirty.add(username)
+
+    def _build(self):
+        points = list(self.positions.values())
+        if points:
+            xs, ys = zip(*points)
+            self._origin = (min(xs), min(ys))
+            extent = max(max(xs) - min(xs), max(ys) - min(ys))
+        else:
+            self._origin, extent = (0.0, 0.0), 0.0
+
+        cell_size = self.cell_size
+        if not cell_size:
+            cells_per_side = max(1, round(math.sqrt(len(points) / ZONE_NODES_PER_CELL)))
+            cell_size = extent / cells_per_side or 1.0
+        self._cell = cell_size
+        self._max_cell = max(0, int(extent // cell_size))
+
+        self._drivers = {user['username']: user for user in users if user['user_type'] == 'Delivery Agent'}
+        self._zone_of_driver = {}
+        self._drivers_in_zone = {}
+        for username in self._drivers:
+            self._file(username)
+        self._dirty.clear()
+        self._built = True
+
+    def _file(self, username):
+        """Move a driver to the zone of their current starting point."""
+        old = self._zone_of_driver.pop(username, None)
+        if old is not None:
+            self._drivers_in_zone[old].discard(username)
+
+        driver = self._drivers.get(username)
+        if driver is None:
+            return
+        assigned_order = current_order(username)
+        location = assigned_order['customer_location'] if assigned_order else driver.get('location')
+        zone = self.zone_of(location)
+        self._zone_of_driver[username] = zone
+        self._drivers_in_zone.setdefault(zone, set()).add(username)
+
+    def _current(self):
+        with self._lock:
+            if not self._built:
+                self._build()
+            for username in self._dirty:
+                self._file(username)
+            self._dirty.clear()
+
+    def zone_of(self, location):
+        """(column, row) of the cell holding location; None for drivers without a location."""
+        if location is None:
+            return None
+        column = int((location[0] - self._origin[0]) // self._cell)
+        row = int((location[1] - self._origin[1]) // self._cell)
+        return min(max(column, 0), self._max_cell), min(max(row, 0), self._max_cell)
+
+    def fleet_size(self):
+        self._current()
+        return len(self._drivers)
+
+    def should_use(self):
+        return bool(self.min_drivers) and self.fleet_size() >= self.min_drivers
+
+    def candidate_rings(self, nodes):
+        """
+        Yields (ring, drivers) for ring = 0, 1, ...: the delivery agents in zones at
+        Chebyshev distance ring from the nearest zone of nodes, until the grid is covered.
+        Drivers without a known location are included in ring 0.
+        """
+        self._current()
+        with self._lock:
+            centres = {self.zone_of(self.positions[node]) for node in nodes if node in self.positions}
+            max_cell = self._max_cell
+            if not centres:
+                # Nothing to measure from, so every zone is equally close
+                everyone = list(self._drivers.values())
+        if not centres:
+            yield 0, everyone
+            return
+
+        for ring in range(max_cell + 1):
+            zones = {None} if ring == 0 else set()
+            for column, row in centres:
+                for step in range(-ring, ring + 1):
+                    zones.update([(column + step, row - ring), (column + step, row + ring),
+                                  (column - ring, row + step), (column + ring, row + step)])
+            # Zones closer to another centre were already yielded in an earlier ring
+            zones = {zone for zone in zones if zone is None or min(
+                max(abs(zone[0] - column), abs(zone[1] - row)) for column, row in centres) == ring}
+            with self._lock:
+                found = [self._drivers[username] for zone in zones
+                         for username in self._drivers_in_zone.get(zone, ())]
+            yield ring, found
+
+
+zone_index = ZoneIndex(graph_positions)
+distance_matrix.add_listener(zone_index.invalidate)
+driver_listeners.append(zone_index.driver_changed)
@@ -0,0 +1,252 @@
+"""
+Dispatch benchmark suite.
+
+Runs assign_driver, the batch dispatcher and the individual route solvers
+against synthetic worlds (see benchmarks/synthetic.py) and reports latency
+percentiles and peak memory. Results are written as JSON so that two runs,
+e.g. before and after a change, can be compared:
+
+    python -m benchmarks.bench_dispatch --quick
+    python -m benchmarks.bench_dispatch --output new.json --compare benchmarks/results/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.algo import assign_driver
+from app.utils.batch_dispatch import dispatch_batch
+from app.utils.distance_matrix import distance_matrix
+from app.utils.parallel_dispatch import parallel_evaluator
+from app.utils.route_cache import route_cache
+from app.utils.route_solver import held_karp_route, local_search_route, route_solver
+from app.utils.zones import zone_index
+from benchmarks.synthetic import install_world, make_basket, make_world, store_node
+
+# Fleets this large are also timed with assign_driver scoring drivers on the process pool
+PARALLEL_MIN_DRIVERS = 1000
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# (graph kind, nodes, drivers, order history, basket sizes)
+FULL_SUITE = [
+    ('grid', 400, 10, 1000, (1, 3, 8, 15)),
+    ('grid', 400, 100, 100000, (1, 3, 8, 15)),
+    ('grid', 400, 1000, 1000000, (3,)),
+    ('geometric', 400, 100, 10000, (1, 3, 8, 15)),
+    ('geometric', 400, 10000, 10000, (3,)),
+]
+QUICK_SUITE = [
+    ('grid', 100, 10, 1000, (1, 3, 8)),
+    ('geometric', 100, 20, 1000, (3, 13)),
+]
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000  # milliseconds
+    return {
+        'calls': int(samples.size),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+    }
+
+
+def measure(function, inputs, memory_calls=3, cold=True):
+    """
+    Latency of function over inputs, then peak traced memory over a few extra calls.
+    Both passes start from an empty route cache unless cold is False, so one
+    variant never times routes another variant already solved.
+    """
+    if cold:
+        route_cache.clear()
+    samples = []
+    for argument in inputs:
+        started = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - started)
+
+    # tracemalloc slows everything down, so memory is measured separately
+    if cold:
+        route_cache.clear()
+    tracemalloc.start()
+    for argument in inputs[:memory_calls]:
+        function(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = percentiles(samples)
+    result['peak_memory_kb'] = peak / 1024
+    return result
+
+
+def route_inputs(baskets):
+    """Distance submatrices for solving each basket from the depot-like first node."""
+    snapshot = distance_matrix.snapshot()
+    inputs = []
+    for basket in baskets:
+        stops = [store_node(store_id) for store_id in basket['items_by_store']]
+        nodes = [snapshot.nodes[0]] + stops + [snapshot.nodes[-1]]
+        inputs.append(snapshot.submatrix(nodes))
+    return inputs
+
+
+def assign_driver_parallel(order):
+    saved = parallel_evaluator.min_drivers
+    parallel_evaluator.min_drivers = 1
+    try:
+        return assign_driver(order)
+    finally:
+        parallel_evaluator.min_drivers = saved
+
+
+def assign_driver_all_zones(order):
+    saved = zone_index.min_drivers
+    zone_index.min_drivers = 0
+    try:
+        return assign_driver(order)
+    finally:
+        zone_index.min_drivers = saved
+
+
+def solve_held_karp(dist):
+    return held_karp_route(dist, 0, range(1, len(dist) - 1), len(dist) - 1)
+
+
+def solve_local_search(dist):
+    return local_search_route(dist, 0, range(1, len(dist) - 1), len(dist) - 1, time_budget=route_solver.time_budget)
+
+
+def run_scenario(kind, size, drivers, history, basket_sizes, calls, seed=0):
+    rng = np.random.default_rng(seed)
+    world = make_world(kind, size=size, drivers=drivers, history=history, seed=seed)
+    scenario = {
+        'graph': kind,
+        'nodes': world['graph'].number_of_nodes(),
+        'edges': world['graph'].number_of_edges(),
+        'drivers': drivers,
+        'history': history,
+        'results': [],
+    }
+
+    with install_world(world):
+        route_cache.hits = route_cache.misses = 0
+        started = time.perf_counter()
+        distance_matrix.snapshot()
+        scenario['matrix_build_s'] = time.perf_counter() - started
+
+        for basket_size in basket_sizes:
+            baskets = [make_basket(world, basket_size, rng) for _ in range(calls)]
+
+            variants = {'assign_driver': (assign_driver, baskets)}
+            if zone_index.should_use():
+                variants['assign_unzoned'] = (assign_driver_all_zones, baskets)
+            if drivers >= PARALLEL_MIN_DRIVERS:
+                variants['assign_parallel'] = (assign_driver_parallel, baskets)
+            if basket_size <= 15:
+                variants['held_karp'] = (solve_held_karp, route_inputs(baskets))
+            variants['local_search'] = (solve_local_search, route_inputs(baskets))
+            batch_size = max(1, min(10, drivers))
+            batches = [baskets[i:i + batch_size] for i in range(0, len(baskets), batch_size)]
+            variants['dispatch_batch'] = (dispatch_batch, batches)
+
+            for name, (function, inputs) in variants.items():
+                result = measure(function, inputs)
+                record(scenario, name, basket_size, result)
+                if name == 'assign_driver':
+                    # The same baskets again once their routes are cached, reported on a line of their own
+                    for basket in baskets:
+                        assign_driver(basket)
+                    record(scenario, 'assign_driver_warm', basket_size, measure(assign_driver, baskets, cold=False))
+        scenario['route_cache'] = route_cache.stats()
+    return scenario
+
+
+def record(scenario, name, basket_size, result):
+    result.update({'variant': name, 'basket': basket_size})
+    scenario['results'].append(result)
+    print(f"  {scenario['graph']:9} nodes={scenario['nodes']:<6} drivers={scenario['drivers']:<6} "
+          f"history={scenario['history']:<8} basket={basket_size:<3} {name:18} p50={result['p50_ms']:9.3f}ms "
+          f"p95={result['p95_ms']:9.3f}ms p99={result['p99_ms']:9.3f}ms peak={result['peak_memory_kb']:9.1f}KB")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(RESULTS_DIR)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, threshold):
+    """Print p95 changes against a previous results file; returns the regressions found."""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+
+    def key(scenario, result):
+        return (scenario['graph'], scenario['drivers'], scenario['history'], result['basket'], result['variant'])
+
+    previous = {key(s, r): r for s in baseline['scenarios'] for r in s['results']}
+    regressions = []
+    print(f"\nComparison with {baseline_path} (revision {baseline.get('revision')}):")
+    for scenario in current['scenarios']:
+        for result in scenario['results']:
+            old = previous.get(key(scenario, result))
+            if not old or not old['p95_ms']:
+                continue
+            ratio = result['p95_ms'] / old['p95_ms']
+            flag = '  REGRESSION' if ratio > 1 + threshold else ''
+            print(f"  {' / '.join(map(str, key(scenario, result)))}: p95 {old['p95_ms']:.3f}ms -> "
+                  f"{result['p95_ms']:.3f}ms ({ratio:.2f}x){flag}")
+            if flag:
+                regressions.append(key(scenario, result))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='small suite for a quick check')
+    parser.add_argument('--calls', type=int, default=None, help='calls per variant (default 20 quick, 100 full)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default benchmarks/results/dispatch-<time>.json)')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative p95 slowdown reported as a regression (default 0.2)')
+    args = parser.parse_args(argv)
+
+    suite = QUICK_SUITE if args.quick else FULL_SUITE
+    calls = args.calls or (20 if args.quick else 100)
+
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'calls': calls,
+        'scenarios': [],
+    }
+    for kind, size, drivers, history, basket_sizes in suite:
+        results['scenarios'].append(run_scenario(kind, size, drivers, history, basket_sizes, calls, seed=args.seed))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"dispatch-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
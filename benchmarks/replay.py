@@ -0,0 +1,240 @@
+"""
+Deterministic dispatch replay.
+
+Re-runs the assign_driver calls recorded in a decision log (DECISION_LOG_FILE,
+see app/utils/decision_log.py) under another configuration and compares the
+replayed choices, route costs and latencies with the recorded ones. Every
+decision carries the complete driver state it was made on, so decisions are
+independent of each other and are replayed in parallel over --workers
+processes with identical results.
+
+    python -m benchmarks.replay decisions.jsonl.gz
+    python -m benchmarks.replay decisions.jsonl --set NEAREST_DRIVERS_K=4 --set ROUTE_CACHE_SIZE=0
+    python -m benchmarks.replay decisions.jsonl --graph roads.csv --positions nodes.csv --output report.json
+
+--set KEY=VALUE overrides an app config key for the replay (VALUE is parsed as
+JSON when it can be, e.g. numbers, null or true, and kept as a string otherwise).
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models.stores import orders, active_orders_by_driver, index_active_order
+from app.models.users import users, graph_positions
+from app.utils.algo import assign_driver, driver_start, order_stops, routing_snapshot
+from app.utils.decision_log import read_decisions
+from app.utils.distance_matrix import distance_matrix, graph_fingerprint
+from app.utils.nearest_drivers import nearest_drivers
+from app.utils.sourcing import store_node
+from app.utils.travel_times import travel_times
+from app.utils.zones import zone_index
+from benchmarks.simulate import summary
+from config import config
+
+
+def parse_overrides(pairs):
+    """{KEY: value} from KEY=VALUE strings."""
+    overrides = {}
+    for pair in pairs or ():
+        key, separator, value = pair.partition('=')
+        if not separator:
+            raise ValueError(f"Override {pair!r} should be KEY=VALUE")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def configure(overrides):
+    """Configure the dispatch services from the default config plus overrides, without logging the replay."""
+    settings = dict(overrides or {}, DECISION_LOG_FILE=None, DISPATCH_TRACE_FILE=None, DISPATCH_MODE='immediate',
+                    REBALANCE_INTERVAL_SECONDS=0)
+    config['replay'] = type('ReplayConfig', (config['default'],), settings)
+    return create_app('replay')
+
+
+@contextmanager
+def replay_app(overrides=None):
+    """configure() for the duration of a replay in this process, restoring the default config afterwards."""
+    saved_graph = distance_matrix.graph
+    saved_positions = dict(graph_positions)
+    try:
+        yield configure(overrides)
+    finally:
+        del config['replay']
+        create_app()
+        graph_positions.clear()
+        graph_positions.update(saved_positions)
+        distance_matrix.set_graph(saved_graph)
+
+
+def decision_order(decision):
+    """The order of a decision as assign_driver takes it, with integer store IDs."""
+    order = dict(decision['order'])
+    order['customer_location'] = tuple(order['customer_location']) if order['customer_location'] else None
+    order['items_by_store'] = {int(store_id): items for store_id, items in decision['items_by_store'].items()}
+    return order
+
+
+@contextmanager
+def fleet_state(decision):
+    """Install the drivers of a decision, busy ones with a stand-in order at their drop-off, and its clock."""
+    saved_users = list(users)
+    saved_orders = dict(orders)
+    saved_active = dict(active_orders_by_driver)
+    saved_clock = travel_times.clock
+
+    drivers = []
+    orders.clear()
+    active_orders_by_driver.clear()
+    for username, location, busy_location in decision['drivers']:
+        drivers.append({'username': username, 'user_type': 'Delivery Agent',
+                        'location': tuple(location) if location else None})
+        if busy_location is not None:
+            order_id = f"REPLAY-{username}"
+            orders[order_id] = {'order_id': order_id, 'delivery_agent': username, 'delivered': False,
+                                'status': 'processing', 'customer_location': tuple(busy_location)}
+            index_active_order(order_id, orders[order_id])
+    users[:] = drivers
+    zone_index.invalidate()
+    nearest_drivers.invalidate()
+    when = datetime.fromisoformat(decision['when'])
+    travel_times.clock = lambda: when
+    try:
+        yield drivers
+    finally:
+        users[:] = saved_users
+        orders.clear()
+        orders.update(saved_orders)
+        active_orders_by_driver.clear()
+        active_orders_by_driver.update(saved_active)
+        zone_index.invalidate()
+        nearest_drivers.invalidate()
+        travel_times.clock = saved_clock
+
+
+def route_cost(order, driver, route):
+    """Length (or minutes) of driver's route through the order's stores in the given order, None without a driver."""
+    if driver is None:
+        return None
+    shortest_paths = routing_snapshot()
+    customer_node, _, _ = order_stops(order)
+    _, driver_node = driver_start(driver)
+    nodes = [driver_node] + [store_node(store_id) for store_id in route] + [customer_node]
+    return sum(shortest_paths.distance(a, b) for a, b in zip(nodes, nodes[1:]))
+
+
+def replay_decision(decision, fingerprint):
+    order = decision_order(decision)
+    with fleet_state(decision) as drivers:
+        started = time.perf_counter()
+        driver, route = assign_driver(order, drivers if decision['restricted'] else None)
+        seconds = time.perf_counter() - started
+        chosen = next((candidate for candidate in drivers if candidate['username'] == driver), None)
+        cost = route_cost(order, chosen, route)
+    return {
+        'order_id': order.get('order_id'),
+        'driver': driver,
+        'route': route,
+        'cost': cost,
+        'seconds': seconds,
+        'same': driver == decision['driver'] and [str(s) for s in route] == [str(s) for s in decision['route']],
+        'graph_match': decision['graph'] == fingerprint,
+    }
+
+
+def replay_decisions(decisions):
+    """Replay decisions on the services as currently configured."""
+    fingerprint = graph_fingerprint(distance_matrix.graph)
+    return [replay_decision(decision, fingerprint) for decision in decisions]
+
+
+def replay(decisions, overrides=None, workers=1):
+    """
+    Per-decision replay results, in log order. With more than one worker the
+    decisions are split into chunks replayed on a process pool.
+    """
+    overrides = dict(overrides or {})
+    if workers <= 1 or len(decisions) < 2:
+        with replay_app(overrides):
+            return replay_decisions(decisions)
+
+    chunk_size = max(1, math.ceil(len(decisions) / (workers * 4)))
+    chunks = [decisions[i:i + chunk_size] for i in range(0, len(decisions), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(overrides,)) as pool:
+        return [result for chunk in pool.map(replay_decisions, chunks) for result in chunk]
+
+
+def compare(decisions, results):
+    """Recorded against replayed totals: choices, route costs and dispatch latency."""
+    both = [(decision['cost'], result['cost']) for decision, result in zip(decisions, results)
+            if decision['cost'] is not None and result['cost'] is not None]
+    recorded_cost = sum(recorded for recorded, _ in both)
+    replayed_cost = sum(replayed for _, replayed in both)
+    return {
+        'decisions': len(decisions),
+        'same_choice_rate': sum(result['same'] for result in results) / len(results) if results else 0.0,
+        'graph_mismatches': sum(not result['graph_match'] for result in results),
+        'assigned': {
+            'recorded': sum(decision['driver'] is not None for decision in decisions),
+            'replayed': sum(result['driver'] is not None for result in results),
+        },
+        'total_cost': {
+            'recorded': recorded_cost,
+            'replayed': replayed_cost,
+            'change': (replayed_cost - recorded_cost) / recorded_cost if recorded_cost else 0.0,
+        },
+        'latency_ms': {
+            'recorded': summary([decision['seconds'] for decision in decisions], scale=1000),
+            'replayed': summary([result['seconds'] for result in results], scale=1000),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='decision log written with DECISION_LOG_FILE')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='app config override')
+    parser.add_argument('--graph', help='edge list the decisions were made on (default: the built-in graph)')
+    parser.add_argument('--positions', help='node coordinates for --graph')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', help='write the comparison and per-decision results as JSON')
+    args = parser.parse_args(argv)
+
+    overrides = parse_overrides(args.set)
+    if args.graph:
+        overrides['DELIVERY_GRAPH_FILE'] = args.graph
+    if args.positions:
+        overrides['DELIVERY_GRAPH_POSITIONS_FILE'] = args.positions
+
+    decisions = read_decisions(args.log)
+    results = replay(decisions, overrides, args.workers)
+    report = compare(decisions, results)
+    cost, latency = report['total_cost'], report['latency_ms']
+    print(f"{report['decisions']} decisions, {report['same_choice_rate']:.1%} same choice, "
+          f"{report['graph_mismatches']} on a different graph")
+    print(f"  assigned     recorded={report['assigned']['recorded']} replayed={report['assigned']['replayed']}")
+    print(f"  total cost   recorded={cost['recorded']:.2f} replayed={cost['replayed']:.2f} ({cost['change']:+.1%})")
+    for label in ('recorded', 'replayed'):
+        if latency[label]['count']:
+            print(f"  {label:<12} p50={latency[label]['p50']:.3f} p99={latency[label]['p99']:.3f} "
+                  f"mean={latency[label]['mean']:.3f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(dict(report, results=results), handle, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
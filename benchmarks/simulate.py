@@ -0,0 +1,423 @@
+"""
+Discrete-event dispatch simulator.
+
+Replays a stream of orders against a synthetic world (see benchmarks/synthetic.py)
+in virtual time. The simulator uses the real app code for every decision:
+orders are dispatched with assign_driver (or the insertion dispatcher), orders
+without a driver wait in the pending queue, and deliveries go through
+complete_delivery just like the delivery blueprint. Drivers move edge by edge
+along shortest paths, and each edge takes its travel time for the current time
+of day (app/utils/travel_times.py). Only dispatch itself costs real time, so a
+full day runs in seconds.
+
+    python -m benchmarks.simulate --drivers 50 --rate 1.5 --hours 24
+    python -m benchmarks.simulate --trace orders.jsonl --strategy insertion --output report.json
+    python -m benchmarks.simulate --drivers 50 --rate 1.5 --rebalance
+
+With --rebalance idle drivers drive to the waiting spots suggested by the
+demand rebalancer (app/utils/rebalancing.py), both when they finish a delivery
+and every REBALANCE_EVERY_MINUTES; idle_first_leg in the report shows how far
+idle drivers had to drive to their first store.
+
+Orders arrive as a Poisson process (--rate orders per minute) or come from a
+JSON lines trace with one {"time": minutes, "items_by_store": {...},
+"customer_location": [x, y]} object per order (--save-trace writes one).
+"""
+import argparse
+import copy
+import heapq
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.stores import (orders, pending_orders, planned_stops_by_driver, active_orders, driver_listeners,
+                               index_active_order, queue_pending_order)
+from app.models.users import users, graph_positions
+from app.utils.algo import assign_driver
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import distance_matrix
+from app.utils.insertion import insertion_dispatcher
+from app.utils.pending_dispatch import complete_delivery
+from app.utils.rebalancing import demand_rebalancer
+from app.utils.spatial_index import spatial_index
+from app.utils.travel_times import travel_times
+from app.utils.vrp import vrp_solver
+from benchmarks.synthetic import install_world, make_basket, make_world, store_node
+
+# Virtual midnight the simulated day starts from
+SIMULATION_START = datetime(2025, 1, 1)
+
+# Simulated minutes between fleet-wide repositioning rounds with --rebalance
+REBALANCE_EVERY_MINUTES = 15
+
+
+def poisson_arrivals(world, rate, minutes, basket_sizes=(1, 2, 3), seed=0):
+    """Orders arriving at rate orders per minute for the given number of minutes."""
+    rng = np.random.default_rng(seed)
+    arrivals = []
+    clock = rng.exponential(1 / rate)
+    while clock < minutes:
+        basket = make_basket(world, int(rng.choice(basket_sizes)), rng)
+        arrivals.append({"time": float(clock), "items_by_store": basket["items_by_store"],
+                         "customer_location": basket["customer_location"]})
+        clock += rng.exponential(1 / rate)
+    return arrivals
+
+
+def load_trace(path):
+    arrivals = []
+    with open(path) as handle:
+        for line in handle:
+            if line.strip():
+                record = json.loads(line)
+                record["items_by_store"] = {int(store_id): items for store_id, items in record["items_by_store"].items()}
+                record["customer_location"] = tuple(record["customer_location"])
+                arrivals.append(record)
+    return sorted(arrivals, key=lambda record: record["time"])
+
+
+def save_trace(arrivals, path):
+    with open(path, 'w') as handle:
+        for record in arrivals:
+            handle.write(json.dumps(record) + "\n")
+
+
+def summary(samples, scale=1.0):
+    samples = np.asarray(samples, dtype=float) * scale
+    if not samples.size:
+        return {'count': 0}
+    return {
+        'count': int(samples.size),
+        'mean': float(samples.mean()),
+        'p50': float(np.percentile(samples, 50)),
+        'p90': float(np.percentile(samples, 90)),
+        'p99': float(np.percentile(samples, 99)),
+        'max': float(samples.max()),
+    }
+
+
+@contextmanager
+def simulated_clock(simulation):
+    """Point travel_times at the virtual clock for the duration of a run."""
+    saved = travel_times.clock
+    travel_times.clock = lambda: SIMULATION_START + timedelta(minutes=simulation.now)
+    try:
+        yield
+    finally:
+        travel_times.clock = saved
+
+
+class Simulation:
+    """
+    One simulated run over the world currently installed with install_world().
+
+    Events are (minute, sequence, kind, payload) tuples on a heap: 'arrival'
+    for a new order and 'hop' for a driver reaching the next node on its way
+    to its next stop. Drivers always head for the first of their planned stops
+    (insertion_dispatcher.driver_stops), so newly assigned orders change their
+    course at the next node. With rebalance, drivers without stops head for
+    their waiting spot instead, and 'rebalance' events reposition the idle fleet.
+    """
+
+    def __init__(self, arrivals, rebalance=False):
+        self.arrivals = arrivals
+        self.rebalance = rebalance
+        self.now = 0.0
+        self._events = []
+        self._sequence = 0
+
+        graph = distance_matrix.graph
+        self.graph = graph if isinstance(graph, CSRGraph) else CSRGraph.from_networkx(graph)
+        self.snapshot = distance_matrix.snapshot()
+        self._bucket_weights = {}
+
+        self.drivers = {user['username']: user for user in users if user['user_type'] == 'Delivery Agent'}
+        self.node_of = {username: spatial_index.nearest_node(driver['location']) or "Admin Office"
+                        for username, driver in self.drivers.items()}
+        self.moving = set()
+        self.moving_minutes = dict.fromkeys(self.drivers, 0.0)
+        self.repositioning_minutes = 0.0
+        self.idle_first_legs = []
+
+        self.placed = {}
+        self.latencies = []
+        self.dispatch_seconds = []
+        self.unreachable_stops = 0
+
+    def schedule(self, minute, kind, payload):
+        heapq.heappush(self._events, (minute, self._sequence, kind, payload))
+        self._sequence += 1
+
+    def _timed(self, function, *args):
+        started = time.process_time()
+        result = function(*args)
+        self.dispatch_seconds.append(time.process_time() - started)
+        return result
+
+    def _edge_minutes(self, position):
+        """Travel time of one CSR edge in the current time bucket."""
+        bucket = travel_times.bucket_of()
+        weights = self._bucket_weights.get(bucket)
+        if weights is None:
+            weights = self._bucket_weights[bucket] = travel_times.bucket_graph(bucket).weights
+        return float(weights[position])
+
+    def _next_hop(self, node, target):
+        """(next node, edge position) on a shortest path from node to target, or None."""
+        source = self.graph.name_to_id.get(node)
+        if source is None or self.snapshot.distance(node, target) == float('inf'):
+            return None
+        best = None
+        for position in range(self.graph.indptr[source], self.graph.indptr[source + 1]):
+            neighbour = self.graph.names[self.graph.indices[position]]
+            remaining = self.graph.weights[position] + self.snapshot.distance(neighbour, target)
+            if best is None or remaining < best[0]:
+                best = (remaining, neighbour, position)
+        return best[1:] if best else None
+
+    def place_order(self, number, arrival):
+        order_id = f"ORD-S{number:07d}"
+        placed_at = SIMULATION_START + timedelta(minutes=self.now)
+        order = {
+            "order_id": order_id,
+            "customer_id": f"customer{number % 1000}",
+            "customer_location": tuple(arrival["customer_location"]),
+            "items_by_store": arrival["items_by_store"],
+            "promised_by": vrp_solver.promised_by(placed_at),
+        }
+        demand_rebalancer.record_order(order, placed_at)
+        if insertion_dispatcher.enabled:
+            driver, route = self._timed(insertion_dispatcher.assign, order)
+        else:
+            driver, route = self._timed(assign_driver, order)
+        if driver and route and not active_orders(driver):
+            # Driven from wherever the idle driver waited to the first store
+            self.idle_first_legs.append(self.snapshot.distance(self.node_of[driver], store_node(route[0])))
+
+        # Same order record as process_purchase
+        orders[order_id] = dict(order, optimized_store_order=route, delivery_agent=driver, status="processing",
+                                delivered=False, timestamp=placed_at.isoformat(),
+                                payment_method="cod", total_amount=0)
+        self.placed[order_id] = self.now
+        if driver:
+            index_active_order(order_id, orders[order_id])
+            self.start(driver)
+        else:
+            queue_pending_order(order_id, orders[order_id])
+
+    def start(self, username):
+        """Set an idle driver off towards their next stop."""
+        if username not in self.moving:
+            self.advance(username)
+
+    def advance(self, username):
+        """Handle every stop at the driver's current node, then move one edge towards the next."""
+        while True:
+            plan = insertion_dispatcher.driver_stops(username)
+            if not plan:
+                planned_stops_by_driver.pop(username, None)
+                hop = self._reposition_hop(username)
+                if hop is None:
+                    self.moving.discard(username)
+                    return
+                self.repositioning_minutes += self._edge_minutes(hop[1])
+                break
+            planned_stops_by_driver[username] = plan
+
+            stop = plan[0]
+            hop = None if stop['node'] == self.node_of[username] else self._next_hop(self.node_of[username], stop['node'])
+            if hop is not None:
+                break
+            if stop['node'] != self.node_of[username]:
+                self.unreachable_stops += 1  # Treated as reached rather than stranding the driver
+            self.reach(username, stop)
+
+        node, position = hop
+        minutes = self._edge_minutes(position)
+        self.moving.add(username)
+        self.moving_minutes[username] += minutes
+        self.schedule(self.now + minutes, 'hop', (username, node))
+
+    def _reposition_hop(self, username):
+        """Next hop of an idle driver towards their waiting spot, None once there (or without --rebalance)."""
+        target = demand_rebalancer.target_of(username) if self.rebalance else None
+        if target is None:
+            return None
+        hop = None if target == self.node_of[username] else self._next_hop(self.node_of[username], target)
+        if hop is None:
+            demand_rebalancer.targets.pop(username, None)
+        return hop
+
+    def reposition(self):
+        """Send idle drivers that are standing still to the rebalancer's waiting spots."""
+        standing = [username for username in self.drivers
+                    if username not in self.moving and not insertion_dispatcher.driver_stops(username)]
+        for move in self._timed(demand_rebalancer.rebalance, standing):
+            self.start(move['driver'])
+
+    def reach(self, username, stop):
+        plan = planned_stops_by_driver[username]
+        plan.remove(stop)
+        order = orders[stop['order_id']]
+        if stop['store_id'] is not None:
+            if not any(other['order_id'] == stop['order_id'] and other['store_id'] is not None for other in plan):
+                order['status'] = 'collected'
+            return
+
+        # Same transition as update_order_status(..., 'delivered'); the driver may
+        # be handed a pending order, which the caller's loop then heads for
+        order['status'] = 'delivered'
+        self.latencies.append(self.now - self.placed[stop['order_id']])
+        self._timed(complete_delivery, stop['order_id'], order)
+
+    def run(self):
+        started = time.perf_counter()
+        for number, arrival in enumerate(self.arrivals):
+            self.schedule(arrival["time"], 'arrival', (number, arrival))
+        if self.rebalance and self.arrivals:
+            last_arrival = max(arrival["time"] for arrival in self.arrivals)
+            for minute in np.arange(REBALANCE_EVERY_MINUTES, last_arrival, REBALANCE_EVERY_MINUTES):
+                self.schedule(float(minute), 'rebalance', None)
+
+        with simulated_clock(self):
+            while self._events:
+                self.now, _, kind, payload = heapq.heappop(self._events)
+                if kind == 'arrival':
+                    self.place_order(*payload)
+                elif kind == 'rebalance':
+                    self.reposition()
+                else:
+                    username, node = payload
+                    self.node_of[username] = node
+                    self.drivers[username]['location'] = graph_positions.get(node, self.drivers[username]['location'])
+                    # The zone and nearest driver indexes file idle drivers by location
+                    for listener in driver_listeners:
+                        listener(username)
+                    self.moving.discard(username)
+                    self.advance(username)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, wall_seconds):
+        minutes = max(self.now, 1e-9)
+        utilisation = [moving / minutes for moving in self.moving_minutes.values()]
+        delivered = len(self.latencies)
+        return {
+            'orders': len(self.arrivals),
+            'delivered': delivered,
+            'pending': len(pending_orders),
+            'drivers': len(self.drivers),
+            'simulated_minutes': self.now,
+            'throughput_per_hour': delivered / minutes * 60,
+            'latency_minutes': summary(self.latencies),
+            'on_time_rate': (sum(latency <= vrp_solver.promise_minutes for latency in self.latencies) / delivered
+                             if delivered else 0.0),
+            'utilisation': summary(utilisation),
+            'dispatch_cpu_ms': summary(self.dispatch_seconds, scale=1000),
+            'dispatch_cpu_total_s': float(sum(self.dispatch_seconds)),
+            'idle_first_leg': summary(self.idle_first_legs),
+            'repositioning_minutes': self.repositioning_minutes,
+            'unreachable_stops': self.unreachable_stops,
+            'wall_seconds': wall_seconds,
+            'speedup': minutes * 60 / wall_seconds if wall_seconds else float('inf'),
+        }
+
+
+@contextmanager
+def isolated_dispatch_state(strategy=None):
+    """
+    Run with an empty pending queue, stop plans and demand history, optionally
+    under another dispatch strategy. The rebalancer's background thread is
+    paused, since it runs on the wall clock and the simulation repositions
+    drivers itself.
+    """
+    saved_pending = dict(pending_orders)
+    saved_plans = dict(planned_stops_by_driver)
+    saved_strategy = insertion_dispatcher.strategy
+    rebalancer_running = demand_rebalancer.running
+    demand_rebalancer.stop()
+    pending_orders.clear()
+    planned_stops_by_driver.clear()
+    demand_rebalancer.clear()
+    if strategy:
+        insertion_dispatcher.strategy = strategy
+    try:
+        yield
+    finally:
+        pending_orders.clear()
+        pending_orders.update(saved_pending)
+        planned_stops_by_driver.clear()
+        planned_stops_by_driver.update(saved_plans)
+        demand_rebalancer.clear()
+        insertion_dispatcher.strategy = saved_strategy
+        if rebalancer_running:
+            demand_rebalancer.start()
+
+
+def simulate(world, arrivals, strategy=None, rebalance=False):
+    """
+    Run arrivals against world and return the report. The world's drivers and
+    orders are copied first, so the same world can be simulated again.
+    """
+    world = dict(world, users=copy.deepcopy(world["users"]), orders=copy.deepcopy(world["orders"]))
+    with install_world(world), isolated_dispatch_state(strategy):
+        return Simulation(arrivals, rebalance).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kind', choices=['grid', 'geometric'], default='grid')
+    parser.add_argument('--size', type=int, default=400, help='approximate number of graph nodes')
+    parser.add_argument('--drivers', type=int, default=50)
+    parser.add_argument('--stores', type=int, default=15)
+    parser.add_argument('--rate', type=float, default=1.0, help='orders per minute (Poisson arrivals)')
+    parser.add_argument('--hours', type=float, default=24.0, help='hours of arrivals to simulate')
+    parser.add_argument('--basket', type=int, nargs='+', default=[1, 2, 3], help='stores per order, drawn uniformly')
+    parser.add_argument('--trace', help='JSON lines order trace to replay instead of Poisson arrivals')
+    parser.add_argument('--save-trace', help='write the arrivals used to this file')
+    parser.add_argument('--strategy', choices=['priority', 'insertion', 'vrp'], help='dispatch strategy (default: app config)')
+    parser.add_argument('--rebalance', action='store_true', help='send idle drivers to the suggested waiting spots')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    world = make_world(args.kind, size=args.size, drivers=args.drivers, history=0, stores=args.stores,
+                       busy_fraction=0, seed=args.seed)
+    if args.trace:
+        arrivals = load_trace(args.trace)
+    else:
+        arrivals = poisson_arrivals(world, args.rate, args.hours * 60, tuple(args.basket), seed=args.seed)
+    if args.save_trace:
+        save_trace(arrivals, args.save_trace)
+
+    report = simulate(world, arrivals, args.strategy, args.rebalance)
+    latency, cpu = report['latency_minutes'], report['dispatch_cpu_ms']
+    print(f"{report['orders']} orders, {report['delivered']} delivered, {report['pending']} pending "
+          f"over {report['simulated_minutes'] / 60:.1f} simulated hours")
+    print(f"  throughput   {report['throughput_per_hour']:.1f} orders/hour")
+    if latency['count']:
+        print(f"  latency      p50={latency['p50']:.1f} p90={latency['p90']:.1f} "
+              f"p99={latency['p99']:.1f} max={latency['max']:.1f} minutes")
+        print(f"  on time      {report['on_time_rate']:.1%} within {vrp_solver.promise_minutes} minutes")
+    print(f"  utilisation  mean={report['utilisation'].get('mean', 0):.1%}")
+    if report['idle_first_leg']['count']:
+        print(f"  first leg    mean={report['idle_first_leg']['mean']:.2f} p90={report['idle_first_leg']['p90']:.2f} "
+              f"for idle drivers, {report['repositioning_minutes']:.0f} minutes repositioning")
+    if cpu['count']:
+        print(f"  dispatch CPU {report['dispatch_cpu_total_s']:.2f}s total, mean={cpu['mean']:.3f}ms "
+              f"p99={cpu['p99']:.3f}ms")
+    print(f"  wall clock   {report['wall_seconds']:.2f}s ({report['speedup']:.0f}x real time)")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
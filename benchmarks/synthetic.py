@@ -0,0 +1,160 @@
+"""
+Synthetic delivery worlds for the dispatch benchmarks.
+
+A world is a road graph with node coordinates, a set of store nodes, a fleet
+of delivery agents and an order history. install_world() swaps it into the
+module level state that assign_driver reads (users, orders, the active order
+index, graph_positions and the distance matrix) and restores the original
+state afterwards.
+"""
+from contextlib import contextmanager
+import numpy as np
+import networkx as nx
+from app.models import stores as stores_module
+from app.models.users import users, graph_positions
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import distance_matrix
+
+
+def store_node(store_id):
+    # Same naming scheme as app.utils.algo.order_stops
+    return f"Store {chr(64 + int(store_id))}"
+
+
+def grid_graph(side, seed=0):
+    """side x side street grid with block lengths between 1 and 2 km."""
+    rng = np.random.default_rng(seed)
+    grid = nx.grid_2d_graph(side, side)
+    graph = nx.Graph()
+    positions = {}
+    for (i, j) in grid.nodes():
+        positions[f"N{i}_{j}"] = (float(i), float(j))
+    for (a, b) in grid.edges():
+        graph.add_edge(f"N{a[0]}_{a[1]}", f"N{b[0]}_{b[1]}", weight=float(rng.uniform(1, 2)))
+    return graph, positions
+
+
+def random_geometric_graph(size, radius=None, seed=0):
+    """Random geometric graph on the unit square scaled to 10 km, largest component only."""
+    radius = radius or 1.8 * np.sqrt(np.log(size) / (np.pi * size))
+    geometric = nx.random_geometric_graph(size, radius, seed=seed)
+    largest = max(nx.connected_components(geometric), key=len)
+    geometric = geometric.subgraph(largest)
+
+    graph = nx.Graph()
+    positions = {}
+    for node, data in geometric.nodes(data=True):
+        positions[f"N{node}"] = (float(data['pos'][0]) * 10, float(data['pos'][1]) * 10)
+    for a, b in geometric.edges():
+        (ax, ay), (bx, by) = positions[f"N{a}"], positions[f"N{b}"]
+        graph.add_edge(f"N{a}", f"N{b}", weight=float(np.hypot(ax - bx, ay - by)) or 0.01)
+    return graph, positions
+
+
+def place_stores(graph, positions, count, seed=0):
+    """Relabel count random nodes as stores 1..count. Returns the new (graph, positions)."""
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(list(graph.nodes()), size=count, replace=False)
+    mapping = {node: store_node(store_id) for store_id, node in enumerate(chosen, start=1)}
+    graph = nx.relabel_nodes(graph, mapping)
+    positions = {mapping.get(node, node): position for node, position in positions.items()}
+    return graph, positions
+
+
+def make_world(kind='grid', size=400, drivers=100, history=1000, stores=15, busy_fraction=0.3, seed=0):
+    """
+    Build a synthetic world as a dict with 'graph' (CSRGraph), 'positions',
+    'users' (delivery agents) and 'orders' (history, some still active).
+    size is the approximate number of graph nodes.
+    """
+    rng = np.random.default_rng(seed)
+    if kind == 'grid':
+        graph, positions = grid_graph(max(2, int(round(np.sqrt(size)))), seed=seed)
+    elif kind == 'geometric':
+        graph, positions = random_geometric_graph(size, seed=seed)
+    else:
+        raise ValueError(f"Unknown graph kind {kind!r}")
+    graph, positions = place_stores(graph, positions, stores, seed=seed)
+
+    locations = list(positions.values())
+    fleet = []
+    for i in range(drivers):
+        fleet.append({
+            "username": f"driver{i}",
+            "phone": f"{9000000000 + i}",
+            "user_type": "Delivery Agent",
+            "rating": 4.0,
+            "location": locations[rng.integers(len(locations))],
+        })
+
+    def order_record(number, driver, active):
+        return {
+            "order_id": f"ORD-{number:08d}",
+            "customer_id": f"customer{number % 1000}",
+            "customer_location": locations[rng.integers(len(locations))],
+            "items_by_store": {int(rng.integers(1, stores + 1)): {"Apple": 1}},
+            "optimized_store_order": [],
+            "delivery_agent": driver,
+            "status": "processing" if active else "delivered",
+            "delivered": not active,
+        }
+
+    # Delivered history, then one order still in progress for each busy driver
+    order_history = {}
+    for number in range(history):
+        driver = f"driver{rng.integers(drivers)}" if drivers else None
+        order_history[f"ORD-{number:08d}"] = order_record(number, driver, active=False)
+    for number, driver in enumerate(rng.permutation(drivers)[:int(drivers * busy_fraction)], start=history):
+        order_history[f"ORD-{number:08d}"] = order_record(number, f"driver{driver}", active=True)
+
+    return {
+        "graph": CSRGraph.from_networkx(graph),
+        "positions": positions,
+        "users": fleet,
+        "orders": order_history,
+        "stores": stores,
+    }
+
+
+def make_basket(world, size, rng):
+    """Random order drawing from size distinct stores, delivered to a random node."""
+    store_ids = rng.choice(np.arange(1, world["stores"] + 1), size=size, replace=False)
+    locations = list(world["positions"].values())
+    return {
+        "order_id": f"ORD-BENCH-{int(rng.integers(1 << 30)):09d}",
+        "customer_id": "customer0",
+        "customer_location": locations[rng.integers(len(locations))],
+        "items_by_store": {int(store_id): {"Apple": 1} for store_id in store_ids},
+    }
+
+
+@contextmanager
+def install_world(world):
+    """Temporarily make world the state seen by assign_driver and the dispatchers."""
+    saved_users = list(users)
+    saved_orders = dict(stores_module.orders)
+    saved_active = dict(stores_module.active_orders_by_driver)
+    saved_positions = dict(graph_positions)
+    saved_graph = distance_matrix.graph
+
+    users[:] = world["users"]
+    stores_module.orders.clear()
+    stores_module.orders.update(world["orders"])
+    stores_module.active_orders_by_driver.clear()
+    for order_id, order in world["orders"].items():
+        if not order["delivered"]:
+            stores_module.index_active_order(order_id, order)
+    graph_positions.clear()
+    graph_positions.update(world["positions"])
+    distance_matrix.set_graph(world["graph"])
+    try:
+        yield world
+    finally:
+        users[:] = saved_users
+        stores_module.orders.clear()
+        stores_module.orders.update(saved_orders)
+        stores_module.active_orders_by_driver.clear()
+        stores_module.active_orders_by_driver.update(saved_active)
+        graph_positions.clear()
+        graph_positions.update(saved_positions)
+        distance_matrix.set_graph(saved_graph)
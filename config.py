@@ -3,6 +3,132 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your_secret_key'
     
+    # Optional road network loaded from an edge list ("source,target,weight" rows)
+    # and node coordinates ("node,x,y" rows), replacing the built-in sample graph
+    DELIVERY_GRAPH_FILE = os.environ.get('DELIVERY_GRAPH_FILE')
+    DELIVERY_GRAPH_POSITIONS_FILE = os.environ.get('DELIVERY_GRAPH_POSITIONS_FILE')
+    
+    # Directory for memory-mapped distance matrices shared by all worker processes
+    DISTANCE_MATRIX_CACHE_DIR = os.environ.get('DISTANCE_MATRIX_CACHE_DIR')
+    
+    # Graphs with at least ALT_MIN_NODES nodes skip the all-pairs matrix and are
+    # routed with A* over ALT_LANDMARKS landmarks, caching ALT_PAIR_CACHE_SIZE pairs
+    ALT_MIN_NODES = 10000
+    ALT_LANDMARKS = 16
+    ALT_PAIR_CACHE_SIZE = 100000
+    
+    # Road closures and new roads or stores update the distance matrix row by row;
+    # once this share of rows is affected the whole matrix is recomputed instead
+    GRAPH_UPDATE_FULL_RECOMPUTE_FRACTION = 0.5
+    
+    # Checkout sourcing: each cart line is filled from the store that minimises
+    # item prices plus SOURCING_COST_PER_KM per km of pickup route (0 disables it)
+    SOURCING_COST_PER_KM = 2.0
+    SOURCING_MAX_NODES = 5000
+    
+    # Route solver: vectorised brute force up to BRUTE_FORCE_MAX_STOPS stores,
+    # exact Held-Karp up to EXACT_MAX_STOPS, heuristic above it
+    ROUTE_SOLVER_BRUTE_FORCE_MAX_STOPS = 7
+    ROUTE_SOLVER_EXACT_MAX_STOPS = 12
+    ROUTE_SOLVER_TIME_BUDGET = 0.05  # seconds spent improving large routes, per dispatch
+    
+    # Solved routes kept per (driver node, stores, customer node); 0 disables the cache
+    ROUTE_CACHE_SIZE = 4096
+    
+    # Dispatch tracing: per-call phase timings and counters of assign_driver, the
+    # last DISPATCH_TRACE_BUFFER kept in memory and each appended as a JSON line
+    # to DISPATCH_TRACE_FILE (if set); DISPATCH_TRACE_DECISIONS also records the
+    # DISPATCH_TRACE_MAX_CANDIDATES best scored drivers
+    DISPATCH_TRACE_ENABLED = False
+    DISPATCH_TRACE_BUFFER = 1000
+    DISPATCH_TRACE_FILE = os.environ.get('DISPATCH_TRACE_FILE')
+    DISPATCH_TRACE_DECISIONS = False
+    DISPATCH_TRACE_MAX_CANDIDATES = 20
+    
+    # Every assign_driver input (order, driver states, graph) and result is
+    # appended to this JSON lines file (gzipped for .gz) for benchmarks/replay.py
+    DECISION_LOG_FILE = os.environ.get('DECISION_LOG_FILE')
+    
+    # 'immediate' assigns each order at checkout, 'async' assigns it on a
+    # background pool of DISPATCH_WORKERS threads after the redirect, and 'batch'
+    # buffers orders and assigns them jointly every BATCH_WINDOW_SECONDS or
+    # BATCH_MAX_ORDERS orders
+    DISPATCH_MODE = 'immediate'
+    DISPATCH_WORKERS = 2
+    BATCH_WINDOW_SECONDS = 2.0
+    BATCH_MAX_ORDERS = 20
+    
+    # How a single order picks its driver: 'priority' prefers idle drivers and
+    # routes busy ones from their current drop-off, 'insertion' inserts the order
+    # into each driver's planned stops and picks the smallest detour, letting a
+    # driver carry up to INSERTION_MAX_ORDERS orders at once, 'vrp' replans the
+    # drivers' stops with capacities and delivery windows (see below)
+    DISPATCH_STRATEGY = 'priority'
+    INSERTION_MAX_ORDERS = 3
+    
+    # Routing engine for the 'vrp' strategy: drivers carry up to VRP_DRIVER_CAPACITY
+    # items, orders are promised within DELIVERY_PROMISE_MINUTES of checkout, each
+    # minute late costs VRP_LATENESS_WEIGHT minutes of driving and each minute a
+    # customer waits VRP_WAITING_WEIGHT, and each dispatch tries the
+    # VRP_CANDIDATE_DRIVERS nearest drivers for VRP_TIME_BUDGET seconds
+    DELIVERY_PROMISE_MINUTES = 60
+    VRP_DRIVER_CAPACITY = 20
+    VRP_SERVICE_MINUTES = 2.0
+    VRP_LATENESS_WEIGHT = 10.0
+    VRP_WAITING_WEIGHT = 1.0
+    VRP_CANDIDATE_DRIVERS = 10
+    VRP_TIME_BUDGET = 0.05
+    
+    # What dispatch minimises: 'distance' (km) or 'eta' (minutes, from edge travel
+    # time profiles in TRAFFIC_PROFILE_FILE with one value per TRAFFIC_BUCKET_MINUTES
+    # slot of the day; edges without a profile are driven at TRAFFIC_SPEED_KMH)
+    DISPATCH_OBJECTIVE = 'distance'
+    TRAFFIC_PROFILE_FILE = os.environ.get('TRAFFIC_PROFILE_FILE')
+    TRAFFIC_BUCKET_MINUTES = 15
+    TRAFFIC_SPEED_KMH = 30.0
+    TRAFFIC_CACHED_BUCKETS = 4
+    
+    # Orders nobody could take wait in a queue; a driver who finishes a delivery
+    # is offered the PENDING_SCAN_LIMIT oldest of them
+    PENDING_SCAN_LIMIT = 20
+    
+    # Orders are counted at their stores with a half-life of
+    # REBALANCE_HALF_LIFE_MINUTES; a driver left idle is pointed to one of the
+    # REBALANCE_CANDIDATES busiest nodes if that shortens the expected first leg
+    # (over the REBALANCE_DEMAND_NODES busiest nodes) by REBALANCE_MIN_GAIN km
+    # or more, driving at most REBALANCE_MAX_MOVE (None = no limit). Every
+    # REBALANCE_INTERVAL_SECONDS all idle drivers are reconsidered on a
+    # background thread, which also advises drivers a delivery leaves idle
+    # (0 = only when a delivery leaves a driver idle, in the request itself)
+    REBALANCE_ENABLED = True
+    REBALANCE_HALF_LIFE_MINUTES = 30.0
+    REBALANCE_DEMAND_NODES = 50
+    REBALANCE_CANDIDATES = 20
+    REBALANCE_MIN_GAIN = 0.1
+    REBALANCE_MAX_MOVE = None
+    REBALANCE_INTERVAL_SECONDS = 300
+    
+    # Fleets of at least ZONE_MIN_DRIVERS drivers are filed in a grid of zones
+    # (ZONE_CELL_SIZE wide, None = automatic) and each order only scores drivers
+    # in rings of zones around its stores
+    ZONE_MIN_DRIVERS = 200
+    ZONE_CELL_SIZE = None
+    ZONE_EXTRA_RINGS = 1
+    
+    # For fleets of at least NEAREST_DRIVERS_MIN_DRIVERS drivers (0 disables it),
+    # a search backwards over the roads from an order's stores finds the
+    # NEAREST_DRIVERS_K closest idle drivers within NEAREST_DRIVERS_RADIUS
+    # (km, or minutes with ETAs; None = no limit) and only those are routed.
+    # With no idle driver in reach the zone search above is used instead
+    NEAREST_DRIVERS_MIN_DRIVERS = 200
+    NEAREST_DRIVERS_K = 8
+    NEAREST_DRIVERS_RADIUS = None
+    
+    # Fleets of at least this many drivers are scored on a process pool of
+    # PARALLEL_DISPATCH_WORKERS processes (None = one per CPU); 0 disables it
+    PARALLEL_DISPATCH_MIN_DRIVERS = 0
+    PARALLEL_DISPATCH_WORKERS = None
+    
 class DevelopmentConfig(Config):
     DEBUG = True
     
@@ -0,0 +1,49 @@
+import json
+import pytest
+from app.models.stores import orders, active_orders_by_driver
+from app.models.users import users, graph_positions
+from app.utils.algo import assign_driver
+from app.utils.distance_matrix import distance_matrix
+from benchmarks import bench_dispatch
+from benchmarks.synthetic import install_world, make_basket, make_world
+
+@pytest.mark.parametrize("kind", ["grid", "geometric"])
+def test_make_world(kind):
+    """Synthetic worlds have the requested fleet, stores and busy drivers"""
+    world = make_world(kind, size=64, drivers=10, history=50, stores=5, busy_fraction=0.5)
+    assert len(world["users"]) == 10
+    assert len(world["orders"]) == 55  # 50 delivered + one active order per busy driver
+    assert sum(not order["delivered"] for order in world["orders"].values()) == 5
+    assert all(f"Store {chr(64 + store_id)}" in world["positions"] for store_id in range(1, 6))
+
+def test_install_world_restores_state():
+    """assign_driver runs against the synthetic world, and the app state comes back afterwards"""
+    import numpy as np
+    saved_users, saved_graph = list(users), distance_matrix.graph
+    saved_positions, saved_orders = dict(graph_positions), dict(orders)
+
+    world = make_world("grid", size=49, drivers=5, history=10, stores=4)
+    with install_world(world):
+        assert len(active_orders_by_driver) > 0
+        driver, route = assign_driver(make_basket(world, 3, np.random.default_rng(1)))
+        assert driver is not None
+        assert len(route) == 3
+
+    assert users == saved_users
+    assert distance_matrix.graph is saved_graph
+    assert graph_positions == saved_positions
+    assert orders == saved_orders
+
+def test_benchmark_writes_results(tmp_path, monkeypatch):
+    """A tiny suite runs end to end and can be compared with itself"""
+    monkeypatch.setattr(bench_dispatch, "QUICK_SUITE", [("grid", 25, 3, 20, (1, 2))])
+    output = tmp_path / "results.json"
+
+    assert bench_dispatch.main(["--quick", "--calls", "3", "--output", str(output)]) == 0
+    results = json.loads(output.read_text())
+    variants = {result["variant"] for result in results["scenarios"][0]["results"]}
+    assert variants == {"assign_driver", "assign_driver_warm", "held_karp", "local_search", "dispatch_batch"}
+    assert all(result["p99_ms"] >= result["p50_ms"] for result in results["scenarios"][0]["results"])
+
+    assert bench_dispatch.main(["--quick", "--calls", "3", "--output", str(tmp_path / "again.json"),
+                                "--compare", str(output), "--threshold", "100"]) == 0
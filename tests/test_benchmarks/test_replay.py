@@ -0,0 +1,77 @@
+import json
+import numpy as np
+import pytest
+from app.models.users import users
+from app.utils.algo import assign_driver
+from app.utils.decision_log import DecisionLog, read_decisions
+from app.utils.route_solver import route_solver
+from benchmarks import replay
+from benchmarks.replay import compare, fleet_state, parse_overrides, replay as replay_log
+from benchmarks.synthetic import install_world, make_basket, make_world
+
+@pytest.fixture(scope="module")
+def world():
+    return make_world("grid", size=100, drivers=12, history=40, stores=6, busy_fraction=0.4, seed=5)
+
+@pytest.fixture
+def decisions(world, tmp_path, monkeypatch):
+    """Decisions recorded for a few orders on the synthetic world, which stays installed"""
+    log = DecisionLog(str(tmp_path / "decisions.jsonl"))
+    monkeypatch.setattr('app.utils.algo.decision_log', log)
+    rng = np.random.default_rng(0)
+    with install_world(world):
+        for size in (1, 2, 3, 1, 2, 3):
+            assign_driver(make_basket(world, size, rng))
+        assign_driver(make_basket(world, 2, rng), world["users"][:3])
+        log.close()
+        monkeypatch.setattr('app.utils.algo.decision_log', DecisionLog())
+        yield read_decisions(log.path)
+
+def test_parse_overrides():
+    assert parse_overrides(["ROUTE_CACHE_SIZE=0", "NEAREST_DRIVERS_RADIUS=null", "DISPATCH_OBJECTIVE=eta"]) == {
+        "ROUTE_CACHE_SIZE": 0, "NEAREST_DRIVERS_RADIUS": None, "DISPATCH_OBJECTIVE": "eta"}
+    with pytest.raises(ValueError):
+        parse_overrides(["ROUTE_CACHE_SIZE"])
+
+def test_fleet_state_is_restored(decisions):
+    saved = list(users)
+    with fleet_state(decisions[0]) as drivers:
+        assert [driver["username"] for driver in users] == [state[0] for state in decisions[0]["drivers"]]
+        assert users == drivers
+    assert users == saved
+
+def test_replay_reproduces_the_log(decisions):
+    results = replay_log(decisions)
+    assert all(result["same"] and result["graph_match"] for result in results)
+    assert [result["cost"] for result in results] == pytest.approx([decision["cost"] for decision in decisions])
+
+    report = compare(decisions, results)
+    assert report["same_choice_rate"] == 1.0
+    assert report["total_cost"]["change"] == pytest.approx(0.0)
+    assert report["latency_ms"]["replayed"]["count"] == len(decisions)
+
+def test_replay_under_overrides_restores_config(decisions):
+    """A solver variant changes the replay only; the app's own settings come back afterwards"""
+    results = replay_log(decisions, {"ROUTE_SOLVER_BRUTE_FORCE_MAX_STOPS": 0, "ROUTE_CACHE_SIZE": 0})
+    # Held-Karp is exact as well, though it may break ties between equally long routes differently
+    assert compare(decisions, results)["total_cost"]["change"] == pytest.approx(0.0)
+    assert route_solver.brute_force_max_stops == 7
+
+def test_parallel_replay_matches_serial(decisions):
+    serial = replay_log(decisions)
+    parallel = replay_log(decisions, workers=2)
+    strip = lambda results: [{k: v for k, v in result.items() if k != "seconds"} for result in results]
+    assert strip(parallel) == strip(serial)
+
+def test_main_writes_report(decisions, tmp_path, capsys):
+    path = tmp_path / "decisions.jsonl"
+    with open(path, "w") as handle:
+        for decision in decisions:
+            handle.write(json.dumps(decision) + "\n")
+    output = tmp_path / "report.json"
+
+    assert replay.main([str(path), "--workers", "1", "--output", str(output)]) == 0
+    assert "100.0% same choice" in capsys.readouterr().out
+    report = json.loads(output.read_text())
+    assert report["decisions"] == len(decisions)
+    assert len(report["results"]) == len(decisions)
@@ -0,0 +1,104 @@
+import json
+import pytest
+from app.models.stores import orders, active_orders_by_driver, pending_orders, planned_stops_by_driver
+from app.models.users import users
+from benchmarks import simulate
+from benchmarks.simulate import Simulation, isolated_dispatch_state, load_trace, poisson_arrivals, save_trace
+from benchmarks.synthetic import install_world, make_world
+
+@pytest.fixture(scope="module")
+def world():
+    return make_world("grid", size=49, drivers=4, history=0, stores=4, busy_fraction=0, seed=3)
+
+def test_poisson_arrivals(world):
+    arrivals = poisson_arrivals(world, rate=0.5, minutes=600, basket_sizes=(1, 2), seed=1)
+    assert 200 < len(arrivals) < 400
+    assert all(0 <= a["time"] < 600 for a in arrivals)
+    assert [a["time"] for a in arrivals] == sorted(a["time"] for a in arrivals)
+    assert {len(a["items_by_store"]) for a in arrivals} == {1, 2}
+
+def test_trace_round_trip(world, tmp_path):
+    arrivals = poisson_arrivals(world, rate=0.2, minutes=60, seed=2)
+    path = tmp_path / "trace.jsonl"
+    save_trace(arrivals, str(path))
+    loaded = load_trace(str(path))
+    assert [a["time"] for a in loaded] == [a["time"] for a in arrivals]
+    assert [a["items_by_store"] for a in loaded] == [a["items_by_store"] for a in arrivals]
+
+def test_every_order_is_delivered(world):
+    """Orders go through the real dispatch and delivery transitions until none are left"""
+    arrivals = poisson_arrivals(world, rate=0.1, minutes=240, seed=4)
+    with install_world(world), isolated_dispatch_state():
+        simulation = Simulation(arrivals)
+        report = simulation.run()
+        assert all(order["delivered"] and order["status"] == "delivered" for order in orders.values())
+        assert len(orders) == len(arrivals)
+        assert not active_orders_by_driver
+        assert not pending_orders
+        assert not planned_stops_by_driver
+
+    assert report["orders"] == report["delivered"] == len(arrivals)
+    assert report["simulated_minutes"] >= arrivals[-1]["time"]
+    assert 0 < report["latency_minutes"]["p50"] <= report["latency_minutes"]["max"]
+    assert 0 < report["utilisation"]["mean"] <= 1
+    assert report["dispatch_cpu_ms"]["count"] >= len(arrivals)
+    assert report["unreachable_stops"] == 0
+
+def test_moving_drivers_are_refiled(world, monkeypatch):
+    """Every hop notifies the driver listeners, so the dispatch indexes see where drivers are"""
+    moved = []
+    monkeypatch.setattr(simulate, 'driver_listeners', simulate.driver_listeners + [moved.append])
+    arrivals = poisson_arrivals(world, rate=0.1, minutes=60, seed=4)
+    report = simulate.simulate(world, arrivals)
+    assert report["delivered"] == len(arrivals)
+    # Assigning and delivering an order notify twice, every hop on the way once more
+    assert len(moved) > 2 * len(arrivals)
+
+def test_runs_are_reproducible(world):
+    arrivals = poisson_arrivals(world, rate=0.2, minutes=120, seed=5)
+    first = simulate.simulate(world, arrivals)
+    second = simulate.simulate(world, arrivals, strategy="insertion")
+    third = simulate.simulate(world, arrivals)
+    assert first["latency_minutes"] == third["latency_minutes"]
+    assert first["utilisation"] == third["utilisation"]
+    assert second["delivered"] == len(arrivals)
+
+def test_vrp_strategy(world):
+    arrivals = poisson_arrivals(world, rate=0.2, minutes=120, seed=5)
+    report = simulate.simulate(world, arrivals, strategy="vrp")
+    assert report["delivered"] == len(arrivals)
+    assert 0 <= report["on_time_rate"] <= 1
+    assert not planned_stops_by_driver  # Restored afterwards
+
+def test_rebalancing_shortens_first_legs():
+    """With all orders at one store, idle drivers wait near it instead of at their last customer"""
+    world = make_world("grid", size=100, drivers=6, history=0, stores=4, busy_fraction=0, seed=2)
+    arrivals = poisson_arrivals(world, rate=0.1, minutes=480, basket_sizes=(1,), seed=7)
+    for arrival in arrivals:
+        arrival["items_by_store"] = {1: {"Apple": 1}}
+
+    baseline = simulate.simulate(world, arrivals)
+    rebalanced = simulate.simulate(world, arrivals, rebalance=True)
+    assert baseline["repositioning_minutes"] == 0
+    assert rebalanced["repositioning_minutes"] > 0
+    assert rebalanced["delivered"] == len(arrivals)
+    assert rebalanced["idle_first_leg"]["mean"] < baseline["idle_first_leg"]["mean"]
+
+def test_without_drivers_orders_stay_pending(world):
+    fleetless = dict(world, users=[])
+    arrivals = poisson_arrivals(world, rate=0.2, minutes=60, seed=6)
+    report = simulate.simulate(fleetless, arrivals)
+    assert report["delivered"] == 0
+    assert report["pending"] == len(arrivals)
+    assert not pending_orders  # Restored afterwards
+
+def test_command_line(tmp_path, capsys):
+    output = tmp_path / "report.json"
+    trace = tmp_path / "trace.jsonl"
+    saved_users = list(users)
+    assert simulate.main(["--size", "25", "--drivers", "3", "--stores", "3", "--rate", "0.1", "--hours", "2",
+                          "--save-trace", str(trace), "--output", str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert report["orders"] == len(load_trace(str(trace)))
+    assert "throughput" in capsys.readouterr().out
+    assert users == saved_users
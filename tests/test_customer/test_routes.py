@@ -539,6 +539,144 @@ def test_process_purchase_card_payment(client, customer_user, monkeypatch):
             assert sess.get('cart', {}) == {}
 
 
+def test_process_purchase_batch_mode(client, customer_user, monkeypatch):
+    """In batch mode checkout only queues the order for the batch dispatcher."""
+    from app.models.stores import orders
+    client.application.config['DISPATCH_MODE'] = 'batch'
+    with client.application.test_request_context():
+        login_user(customer_user)
+        with client.session_transaction() as sess:
+            sess['cart'] = {
+                'Apple': {
+                    'name': 'Apple',
+                    'price': 10,
+                    'discount': 0,
+                    'final_price': 10,
+                    'quantity': 1,
+                    'store_id': 1
+                }
+            }
+        
+        submitted = []
+        monkeypatch.setattr('app.customer.routes.batch_dispatcher.submit', submitted.append)
+        
+        def fail_assign_driver(order):
+            raise AssertionError("assign_driver should not run in batch mode")
+        
+        monkeypatch.setattr('app.customer.routes.assign_driver', fail_assign_driver)
+        
+        response = client.post(
+            url_for('customer.process_purchase'),
+            data={'payment_method': 'cod'},
+            follow_redirects=True
+        )
+        
+        assert response.status_code == 200
+        assert len(submitted) == 1
+        stored = orders[submitted[0]['order_id']]
+        assert stored['delivery_agent'] is None
+        del orders[submitted[0]['order_id']]
+
+def test_process_purchase_sources_from_fewer_stores(client, customer_user, monkeypatch):
+    """Checkout moves cart lines to the stores that are cheapest once delivery is counted."""
+    from app.models.stores import orders, stores
+    client.application.config['DISPATCH_MODE'] = 'immediate'
+    for store_id, item_name in [(1, 'Apple'), (3, 'Apple'), (3, 'Cheese')]:
+        monkeypatch.setitem(stores[store_id]['items'][item_name], 'stock', 10)
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    
+    with client.application.test_request_context():
+        login_user(customer_user)
+        with client.session_transaction() as sess:
+            sess['cart'] = {
+                'Apple': {'name': 'Apple', 'price': 10, 'discount': 0, 'final_price': 10,
+                          'quantity': 1, 'store_id': 1},
+                'Cheese': {'name': 'Cheese', 'price': 80, 'discount': 0, 'final_price': 80,
+                           'quantity': 1, 'store_id': 3},
+            }
+        
+        dispatched = []
+        def mock_assign_driver(order):
+            dispatched.append(order)
+            return "driver1", list(order['items_by_store'])
+        
+        monkeypatch.setattr('app.customer.routes.assign_driver', mock_assign_driver)
+        
+        client.post(url_for('customer.process_purchase'), data={'payment_method': 'cod'})
+        
+        # Store C also sells Apples, one stop instead of two
+        assert dispatched[0]['items_by_store'] == {3: {'Apple': 1, 'Cheese': 1}}
+        stored = orders.pop(dispatched[0]['order_id'])
+        assert stored['total_amount'] == 91
+        assert stores[3]['items']['Apple']['stock'] == 9
+        assert stores[1]['items']['Apple']['stock'] == 10
+
+def test_process_purchase_insertion_strategy(client, customer_user, monkeypatch):
+    """With DISPATCH_STRATEGY = 'insertion' checkout uses the insertion dispatcher."""
+    from app.models.stores import orders
+    from app.utils.insertion import insertion_dispatcher
+    client.application.config['DISPATCH_MODE'] = 'immediate'
+    monkeypatch.setattr(insertion_dispatcher, 'strategy', 'insertion')
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    
+    with client.application.test_request_context():
+        login_user(customer_user)
+        with client.session_transaction() as sess:
+            sess['cart'] = {
+                'Apple': {'name': 'Apple', 'price': 10, 'discount': 0, 'final_price': 10,
+                          'quantity': 1, 'store_id': 1},
+            }
+        
+        inserted = []
+        def mock_insert(order):
+            inserted.append(order)
+            return "driver2", [1]
+        
+        def fail_assign_driver(order):
+            raise AssertionError("assign_driver should not run with the insertion strategy")
+        
+        monkeypatch.setattr(insertion_dispatcher, 'assign', mock_insert)
+        monkeypatch.setattr('app.customer.routes.assign_driver', fail_assign_driver)
+        
+        client.post(url_for('customer.process_purchase'), data={'payment_method': 'cod'})
+        
+        assert len(inserted) == 1
+        stored = orders.pop(inserted[0]['order_id'])
+        assert stored['delivery_agent'] == "driver2"
+        assert stored['optimized_store_order'] == [1]
+
+def test_process_purchase_without_drivers_is_queued(client, customer_user, monkeypatch):
+    """An order no driver can take right now waits in the pending queue."""
+    from app.models.stores import orders, pending_orders
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    with client.application.test_request_context():
+        login_user(customer_user)
+        with client.session_transaction() as sess:
+            sess['cart'] = {
+                'Apple': {
+                    'name': 'Apple',
+                    'price': 10,
+                    'discount': 0,
+                    'final_price': 10,
+                    'quantity': 1,
+                    'store_id': 1
+                }
+            }
+        
+        def mock_assign_driver(order):
+            return None, []
+        
+        monkeypatch.setattr('app.customer.routes.assign_driver', mock_assign_driver)
+        
+        client.post(url_for('customer.process_purchase'), data={'payment_method': 'cod'})
+        
+        order_id = next(reversed(pending_orders))
+        stored = pending_orders.pop(order_id)
+        assert stored is orders.pop(order_id)
+        assert stored['status'] == 'awaiting assignment'
+        assert stored['delivery_agent'] is None
+        assert stored['promised_by'] > stored['timestamp']  # Delivery window promised at checkout
+
 def test_track_order(client, customer_user, monkeypatch):
     """Test tracking an order."""
     # Create a delivery agent for the test
@@ -578,6 +716,80 @@ def test_track_order(client, customer_user, monkeypatch):
         assert 'login' not in response.request.path.lower()
         assert 'error' not in response.request.path.lower()
 
+def test_process_purchase_async_mode(client, customer_user, monkeypatch):
+    """In async mode the order is stored as awaiting assignment and handed to the worker pool."""
+    from app.models.stores import orders
+    client.application.config['DISPATCH_MODE'] = 'async'
+    with client.application.test_request_context():
+        login_user(customer_user)
+        with client.session_transaction() as sess:
+            sess['cart'] = {
+                'Apple': {
+                    'name': 'Apple',
+                    'price': 10,
+                    'discount': 0,
+                    'final_price': 10,
+                    'quantity': 1,
+                    'store_id': 1
+                }
+            }
+        
+        submitted = []
+        monkeypatch.setattr('app.customer.routes.dispatch_worker.submit', submitted.append)
+        
+        response = client.post(
+            url_for('customer.process_purchase'),
+            data={'payment_method': 'cod'},
+            follow_redirects=True
+        )
+        
+        assert response.status_code == 200
+        assert len(submitted) == 1
+        stored = orders[submitted[0]['order_id']]
+        assert stored['status'] == 'awaiting assignment'
+        assert stored['delivery_agent'] is None
+        del orders[submitted[0]['order_id']]
+
+def test_track_order_awaiting_assignment(client, customer_user):
+    """Tracking shows the pending state while the driver is being assigned."""
+    from app.models.stores import orders
+    orders['ORD-PENDING1'] = {
+        'order_id': 'ORD-PENDING1',
+        'customer_id': 'customer1',
+        'status': 'awaiting assignment',
+        'delivery_agent': None,
+        'items_by_store': {1: {'Apple': 2}},
+        'timestamp': '2025-04-01T22:08:00'
+    }
+    with client.application.test_request_context():
+        login_user(customer_user)
+        response = client.get(url_for('customer.track_order', order_id='ORD-PENDING1'), follow_redirects=True)
+        assert response.status_code == 200
+        assert b'Finding a delivery agent' in response.data
+    del orders['ORD-PENDING1']
+
+def test_track_order_shows_eta(client, customer_user, monkeypatch):
+    """Tracking an assigned order shows the estimated arrival time."""
+    from app.models.stores import orders, index_active_order
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    orders['ORD-ETA1'] = {
+        'order_id': 'ORD-ETA1',
+        'customer_id': 'customer1',
+        'customer_location': (1, 0),
+        'status': 'processing',
+        'delivery_agent': 'driver1',
+        'delivered': False,
+        'items_by_store': {1: {'Apple': 2}},
+        'optimized_store_order': [1],
+        'timestamp': '2025-04-01T22:08:00'
+    }
+    index_active_order('ORD-ETA1', orders['ORD-ETA1'])
+    with client.application.test_request_context():
+        login_user(customer_user)
+        response = client.get(url_for('customer.track_order', order_id='ORD-ETA1'), follow_redirects=True)
+        assert b'Estimated arrival in' in response.data
+    del orders['ORD-ETA1']
+
 def test_track_nonexistent_order(client, customer_user):
     """Test tracking a nonexistent order."""
     with client.application.test_request_context():
@@ -2,7 +2,7 @@ import pytest
 from flask import url_for
 from flask_login import login_user
 from app.models.users import User
-from app.models.stores import orders
+from app.models.stores import orders, pending_orders, index_active_order, current_order, queue_pending_order
 
 @pytest.fixture
 def delivery_agent():
@@ -89,6 +89,64 @@ def test_update_order_status_to_delivered(client, delivery_agent):
         assert response.status_code == 200
         assert orders[test_order_id]['status'] == 'delivered'
         assert orders[test_order_id]['delivered'] is True
+def test_delivery_releases_active_order(client, delivery_agent, monkeypatch):
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    with client.application.test_request_context():
+        login_user(delivery_agent)
+        for test_order_id, status in [("ORD-ACTIVE1", "preparing"), ("ORD-ACTIVE2", "collected")]:
+            orders[test_order_id] = {
+                "id": test_order_id,
+                "delivery_agent": "driver1",
+                "status": status,
+                "delivered": False,
+                "items_by_store": {1: {"Apple": 2}},
+                "customer_location": (1, 0)
+            }
+            index_active_order(test_order_id, orders[test_order_id])
+        assert current_order("driver1") is orders["ORD-ACTIVE1"]
+
+        client.post(url_for('delivery.mark_delivered', order_id="ORD-ACTIVE1"), follow_redirects=True)
+        assert current_order("driver1") is orders["ORD-ACTIVE2"]
+
+        client.post(
+            url_for('delivery.update_order_status', order_id="ORD-ACTIVE2"),
+            data={'status': 'delivered'},
+            follow_redirects=True
+        )
+        assert current_order("driver1") is None
+
+def test_delivery_hands_out_pending_order(client, delivery_agent, monkeypatch):
+    """The driver who finishes a delivery picks up the oldest queued order"""
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    pending_orders.clear()
+    with client.application.test_request_context():
+        login_user(delivery_agent)
+        orders["ORD-DONE1"] = {
+            "id": "ORD-DONE1",
+            "delivery_agent": "driver1",
+            "status": "collected",
+            "delivered": False,
+            "items_by_store": {1: {"Apple": 2}},
+            "customer_location": (1, 0)
+        }
+        index_active_order("ORD-DONE1", orders["ORD-DONE1"])
+        orders["ORD-QUEUED1"] = {
+            "order_id": "ORD-QUEUED1",
+            "customer_id": "customer1",
+            "delivery_agent": None,
+            "optimized_store_order": [],
+            "delivered": False,
+            "items_by_store": {1: {"Apple": 1}},
+            "customer_location": (1, 0)
+        }
+        queue_pending_order("ORD-QUEUED1", orders["ORD-QUEUED1"])
+
+        client.post(url_for('delivery.mark_delivered', order_id="ORD-DONE1"), follow_redirects=True)
+        assert orders["ORD-QUEUED1"]["delivery_agent"] == "driver1"
+        assert orders["ORD-QUEUED1"]["status"] == "processing"
+        assert current_order("driver1") is orders["ORD-QUEUED1"]
+        del orders["ORD-DONE1"], orders["ORD-QUEUED1"]
+
 def test_completed_deliveries(client, delivery_agent):
     with client.application.test_request_context():
         login_user(delivery_agent)
@@ -128,6 +186,24 @@ This test file covers:
     Testing unauthorized access to the delivery agent dashboard
     Testing marking an order as delivered (success and failure cases)
     Testing updating order status to collected and delivered
+    Testing that delivered orders leave the driver's active order index
+    Testing that a driver who finishes a delivery is handed the oldest pending order
     Testing access to the completed deliveries page
     Testing that non-delivery agents cannot access any of the delivery routes
 """
+
+def test_dashboard_shows_waiting_spot(client, delivery_agent):
+    """An idle driver sees where the rebalancer expects the next orders"""
+    from app.utils.rebalancing import demand_rebalancer
+    saved_orders = dict(orders)
+    orders.clear()
+    demand_rebalancer.targets["driver1"] = "Store C"
+    try:
+        with client.application.test_request_context():
+            login_user(delivery_agent)
+            response = client.get(url_for('delivery.delivery_agent_dashboard'))
+            assert b'Orders are expected near' in response.data
+            assert b'Store C' in response.data
+    finally:
+        demand_rebalancer.targets.clear()
+        orders.update(saved_orders)
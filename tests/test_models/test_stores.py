@@ -3,7 +3,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.models.stores import stores, orders, generate_order_id
+from app.models.stores import (stores, orders, generate_order_id, index_active_order,
+                               release_active_order, current_order)
 
 def test_stores_structure():
     """Test that the stores dictionary has the correct structure."""
@@ -106,6 +107,30 @@ def test_generate_order_id():
     assert len(set(order_ids)) == 10  # All IDs should be unique
 
 
+def test_active_order_index(monkeypatch):
+    """Test that the active order index tracks each driver's undelivered orders."""
+    monkeypatch.setattr('app.models.stores.active_orders_by_driver', {})
+    first = {"delivery_agent": "driver1", "customer_location": (1, 0)}
+    second = {"delivery_agent": "driver1", "customer_location": (-2, 0)}
+    unassigned = {"delivery_agent": None}
+    
+    index_active_order("ORD-1", first)
+    index_active_order("ORD-2", second)
+    index_active_order("ORD-3", unassigned)
+    
+    assert current_order("driver1") is first  # Oldest active order
+    assert current_order("driver2") is None
+    
+    release_active_order("ORD-1", first)
+    assert current_order("driver1") is second
+    
+    release_active_order("ORD-2", second)
+    release_active_order("ORD-3", unassigned)  # Not indexed, nothing to do
+    assert current_order("driver1") is None
+    from app.models import stores as stores_module
+    assert stores_module.active_orders_by_driver == {}
+
+
 """
 Basic structure tests for the stores dictionary
     Tests for store properties (name, location, manager, items)
@@ -113,4 +138,5 @@ Basic structure tests for the stores dictionary
     Tests for common and unique items across stores
     Tests for the orders dictionary
     Tests for the generate_order_id function
+    Tests for the per-driver active order index
 """
\ No newline at end of file
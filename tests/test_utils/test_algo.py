@@ -1,15 +1,17 @@
 import pytest
 import networkx as nx
 from unittest.mock import patch
-from app.models.stores import orders
+from app.models.stores import orders, active_orders_by_driver, index_active_order
 from app.models.users import users, delivery_graph, graph_positions
 from app.utils.algo import assign_driver  # Adjust import path as needed
+from app.utils.distance_matrix import distance_matrix
 
 @pytest.fixture
 def setup_test_data():
     """Setup test data for the delivery network"""
     # Clear existing data
     orders.clear()
+    active_orders_by_driver.clear()
     users.clear()
     delivery_graph.clear()
     
@@ -44,6 +46,9 @@ def setup_test_data():
         "Customer 3": (0, -1)
     })
     
+    # The graph was rebuilt in place, so drop any cached distances
+    distance_matrix.invalidate()
+    
     # Add test users
     users.extend([
         {"username": "driver1", "user_type": "Delivery Agent", "location": (0, 0)},
@@ -55,9 +60,11 @@ def setup_test_data():
     
     # Clean up after tests
     orders.clear()
+    active_orders_by_driver.clear()
     users.clear()
     delivery_graph.clear()
     graph_positions.clear()
+    distance_matrix.invalidate()
 
 def test_assign_driver_basic(setup_test_data):
     """Test basic driver assignment with a simple order"""
@@ -84,6 +91,28 @@ def test_assign_driver_multiple_stores_small(setup_test_data):
     assert len(route) == 3  # Should visit all 3 stores
     assert set(route) == {1, 2, 3}  # All stores should be in the route
 
+def test_assign_driver_more_than_four_stores(setup_test_data):
+    """Orders spanning more than four stores should still get a driver and a full route"""
+    for name, position in [("Store D", (2, 1)), ("Store E", (2, -1)), ("Store F", (3, 0))]:
+        graph_positions[name] = position
+    delivery_graph.add_weighted_edges_from([
+        ("Store C", "Store D", 2),
+        ("Store D", "Store E", 3),
+        ("Store E", "Store F", 2),
+        ("Store F", "Customer 1", 5),
+    ])
+    distance_matrix.invalidate()
+    
+    order = {
+        "customer_id": "customer1",
+        "items_by_store": {store_id: {"Apple": 1} for store_id in range(1, 7)},
+        "customer_location": (1, 0)
+    }
+    
+    driver, route = assign_driver(order)
+    assert driver in ["driver1", "driver2"]
+    assert sorted(route) == [1, 2, 3, 4, 5, 6]
+
 """
 def test_assign_driver_multiple_stores_large(setup_test_data, monkeypatch):
     # Test driver assignment with many stores (> 4)
@@ -128,6 +157,7 @@ def test_assign_driver_busy_drivers(setup_test_data):
         "delivered": False,
         "customer_location": (-2, 0)  # Customer 2's location
     }
+    index_active_order("ORD-EXISTING", orders["ORD-EXISTING"])
     
     order = {
         "customer_id": "customer1",
@@ -148,6 +178,7 @@ def test_assign_driver_all_busy(setup_test_data):
         "delivered": False,
         "customer_location": (-2, 0)  # Customer 2's location
     }
+    index_active_order("ORD-EXISTING1", orders["ORD-EXISTING1"])
     
     orders["ORD-EXISTING2"] = {
         "delivery_agent": "driver2",
@@ -155,6 +186,7 @@ def test_assign_driver_all_busy(setup_test_data):
         "delivered": False,
         "customer_location": (0, -1)  # Customer 3's location
     }
+    index_active_order("ORD-EXISTING2", orders["ORD-EXISTING2"])
     
     order = {
         "customer_id": "customer1",
@@ -182,7 +214,20 @@ def test_assign_driver_coordinate_mapping(setup_test_data):
     
     driver, route = assign_driver(order)
     assert driver in ["driver1", "driver2", "driver3"]
-    # driver3 should use the default "Admin Office" node
+    # driver3 is snapped to the nearest graph node
+
+def test_assign_driver_customer_snapped_from_location(setup_test_data):
+    """The customer node comes from the order's coordinates, not the customer id"""
+    order = {
+        "customer_id": "alice",
+        "items_by_store": {2: {"Banana": 1}},
+        "customer_location": (-2.1, 0.2)  # Next to Customer 2
+    }
+    
+    driver, route = assign_driver(order)
+    # driver2 waits at Store A, 3 + 2 to Store B and Customer 2
+    assert driver == "driver2"
+    assert route == [2]
 
 def test_network_error_handling(setup_test_data, monkeypatch):
     """Test handling of network errors"""
@@ -0,0 +1,116 @@
+import numpy as np
+import networkx as nx
+import pytest
+from app.utils.algo import assign_driver, best_routes, distance_rows
+from app.utils.alt_routing import LandmarkSnapshot, select_landmarks
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import DistanceMatrix, DistanceSnapshot, distance_matrix
+from app.utils.route_cache import route_cache
+from benchmarks.synthetic import grid_graph, install_world, make_basket, make_world, random_geometric_graph
+
+@pytest.fixture
+def city():
+    """A 15 x 15 street grid with random block lengths"""
+    graph, _ = grid_graph(15, seed=2)
+    return CSRGraph.from_networkx(graph)
+
+def test_distances_match_dijkstra(city):
+    """A* with landmark bounds finds the same lengths as a full Dijkstra"""
+    snapshot = LandmarkSnapshot(0, city, landmarks=4)
+    rng = np.random.default_rng(0)
+    for source in rng.choice(city.number_of_nodes(), size=5, replace=False):
+        expected = city.dijkstra(int(source))
+        for target in rng.choice(city.number_of_nodes(), size=10, replace=False):
+            assert snapshot.distance(city.names[source], city.names[target]) == pytest.approx(expected[target])
+
+def test_lower_bound_is_admissible(city):
+    snapshot = LandmarkSnapshot(0, city, landmarks=4)
+    exact = city.dijkstra(7)
+    for target in range(city.number_of_nodes()):
+        assert snapshot.lower_bound(7, target) <= exact[target] + 1e-4  # float32 weights
+
+def test_landmarks_spread_out(city):
+    """Each landmark is the node farthest from the ones before it"""
+    landmarks, distances = select_landmarks(city, 4)
+    assert len(set(landmarks)) == 4
+    assert np.array_equal(distances[0], city.dijkstra(landmarks[0]))
+    assert landmarks[1] == int(distances[0].argmax())
+    nearest = np.minimum(distances[0], distances[1])
+    assert landmarks[2] == int(nearest.argmax())
+
+def test_directed_and_disconnected():
+    """One-way streets and separate components are respected"""
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from([("a", "b", 1), ("b", "c", 2), ("c", "a", 10), ("x", "y", 1)])
+    snapshot = LandmarkSnapshot(0, graph, landmarks=3)
+    assert snapshot.distance("a", "c") == 3
+    assert snapshot.distance("c", "b") == 11
+    assert snapshot.distance("a", "x") == float('inf')
+    assert snapshot.distance("y", "x") == float('inf')
+    assert snapshot.distance("Nowhere", "a") == float('inf')
+    assert snapshot.distance("Nowhere", "Nowhere") == 0
+
+def test_pair_cache(city):
+    """Repeated queries are answered from the pair cache, which stays bounded"""
+    snapshot = LandmarkSnapshot(0, city, landmarks=2, pair_cache_size=2)
+    snapshot.distance("N0_0", "N5_5")
+    snapshot.distance("N5_5", "N0_0")  # Undirected: same pair
+    assert snapshot.searches == 1
+
+    snapshot.distance("N1_1", "N2_2")
+    snapshot.distance("N3_3", "N4_4")
+    assert len(snapshot._pairs) == 2
+    snapshot.distance("N0_0", "N5_5")  # Evicted, searched again
+    assert snapshot.searches == 4
+
+def test_submatrix(city):
+    snapshot = LandmarkSnapshot(0, city, landmarks=4)
+    nodes = ["N0_0", "N3_4", "Nowhere", "N0_0"]
+    sub = snapshot.submatrix(nodes)
+    full = DistanceSnapshot(0, city.nodes(), city.all_pairs()).submatrix(nodes)
+    assert np.allclose(sub, full)
+
+def test_distance_rows(city):
+    """Start rows come from the matrix when there is one and from pair queries otherwise"""
+    sources, targets = ["N0_0", "Nowhere", "N3_4"], ["N3_4", "N0_0", "Nowhere"]
+    dense = DistanceSnapshot(0, city.nodes(), city.all_pairs())
+    expected = [[dense.distance(source, target) for target in targets] for source in sources]
+    assert expected[1] == [float('inf'), float('inf'), 0.0]  # Unknown nodes only reach themselves
+    assert np.allclose(distance_rows(dense, sources, targets), expected)
+    assert np.allclose(distance_rows(LandmarkSnapshot(0, city, landmarks=4), sources, targets), expected)
+
+def test_best_routes_only_searches_needed_pairs(city):
+    """Starts are only routed to the stops, never to each other"""
+    snapshot = LandmarkSnapshot(0, city, landmarks=4)
+    starts = [f"N{i}_{j}" for i in range(0, 15, 3) for j in range(0, 15, 3)]
+    stops = ["N2_7", "N9_3", "N12_12"]
+    route_cache.clear()
+    routes = best_routes(snapshot, starts, stops, "N7_7")
+    assert snapshot.searches <= len(starts) * (len(stops) + 1) + (len(stops) + 1) ** 2
+
+    route_cache.clear()
+    dense = DistanceSnapshot(1, city.nodes(), city.all_pairs())
+    expected = best_routes(dense, starts, stops, "N7_7")
+    route_cache.clear()
+    assert {start: route for start, (_, route) in routes.items()} == {
+        start: route for start, (_, route) in expected.items()}
+
+def test_large_graphs_use_landmarks():
+    """DistanceMatrix switches to landmark routing at alt_min_nodes"""
+    graph, _ = random_geometric_graph(60, seed=1)
+    assert isinstance(DistanceMatrix(graph, alt_min_nodes=61).snapshot(), DistanceSnapshot)
+    assert isinstance(DistanceMatrix(graph, alt_min_nodes=60).snapshot(), LandmarkSnapshot)
+    assert isinstance(DistanceMatrix(graph, alt_min_nodes=0).snapshot(), DistanceSnapshot)
+
+def test_assign_driver_on_landmarks(monkeypatch):
+    """Dispatch picks the same drivers and routes with landmark routing as with the matrix"""
+    world = make_world('grid', size=100, drivers=8, history=20, seed=4)
+    rng = np.random.default_rng(2)
+    with install_world(world):
+        baskets = [make_basket(world, size, rng) for size in (1, 2, 3)]
+        with_matrix = [assign_driver(basket) for basket in baskets]
+
+        monkeypatch.setattr(distance_matrix, 'alt_min_nodes', 1)
+        distance_matrix.invalidate()
+        assert isinstance(distance_matrix.snapshot(), LandmarkSnapshot)
+        assert [assign_driver(basket) for basket in baskets] == with_matrix
@@ -0,0 +1,150 @@
+import itertools
+import time
+import pytest
+import numpy as np
+from app.models.stores import orders, active_orders_by_driver
+from app.models.users import users, delivery_graph, graph_positions, edges
+from app.utils import batch_dispatch
+from app.utils.batch_dispatch import BatchDispatcher, dispatch_batch, min_cost_assignment
+from app.utils.distance_matrix import distance_matrix
+from app.utils.nearest_drivers import nearest_drivers
+
+@pytest.fixture
+def setup_test_data():
+    """Small delivery network with two idle drivers"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    users.clear()
+    delivery_graph.clear()
+    graph_positions.clear()
+
+    delivery_graph.add_weighted_edges_from([
+        ("Admin Office", "Store A", 5),
+        ("Admin Office", "Store B", 6),
+        ("Store A", "Customer 1", 4),
+        ("Store B", "Customer 2", 2),
+        ("Store A", "Store B", 3),
+    ])
+    graph_positions.update({
+        "Admin Office": (0, 0),
+        "Store A": (-1, 1),
+        "Store B": (-1, -1),
+        "Customer 1": (1, 0),
+        "Customer 2": (-2, 0),
+    })
+    distance_matrix.invalidate()
+
+    users.extend([
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (-1, 1)},  # At Store A
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (-1, -1)},  # At Store B
+    ])
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    distance_matrix.invalidate()
+
+def brute_force_assignment(cost):
+    """Reference: best total over every way of matching rows to distinct columns"""
+    rows, cols = cost.shape
+    best = float('inf')
+    for columns in itertools.permutations(range(cols), rows):
+        best = min(best, sum(cost[row, column] for row, column in enumerate(columns)))
+    return best
+
+@pytest.mark.parametrize("shape", [(3, 3), (2, 5), (4, 6)])
+def test_min_cost_assignment_is_optimal(shape):
+    """The Hungarian algorithm should match the brute force optimum"""
+    cost = np.random.default_rng(sum(shape)).random(shape) * 10
+    pairs = min_cost_assignment(cost)
+
+    assert len(pairs) == shape[0]
+    assert len({column for _, column in pairs}) == shape[0]
+    assert sum(cost[row, column] for row, column in pairs) == pytest.approx(brute_force_assignment(cost))
+
+def test_min_cost_assignment_more_rows_than_columns():
+    """Only as many rows as there are columns can be matched"""
+    cost = np.array([[1.0, 9.0], [9.0, 1.0], [5.0, 5.0]])
+    assert min_cost_assignment(cost) == [(0, 0), (1, 1)]
+
+def test_min_cost_assignment_forbidden_pairs():
+    """Pairs with infinite cost are never returned"""
+    cost = np.array([[np.inf, 1.0], [np.inf, 2.0]])
+    pairs = min_cost_assignment(cost)
+    assert len(pairs) == 1
+    assert all(np.isfinite(cost[row, column]) for row, column in pairs)
+
+def test_dispatch_batch_assigns_jointly(setup_test_data):
+    """Each order goes to the driver waiting at its store, not the same greedy pick"""
+    batch = [
+        {"order_id": "ORD-1", "customer_id": "customer2", "items_by_store": {2: {"Milk": 1}}},
+        {"order_id": "ORD-2", "customer_id": "customer1", "items_by_store": {1: {"Apple": 1}}},
+    ]
+
+    results = dispatch_batch(batch)
+    assert results["ORD-1"] == ("driver2", [2])
+    assert results["ORD-2"] == ("driver1", [1])
+
+def test_dispatch_batch_routes_only_nearby_drivers(setup_test_data, monkeypatch):
+    """In large fleets each order is only routed for its nearest idle drivers"""
+    users.append({"username": "driver3", "user_type": "Delivery Agent", "location": (-2, 0)})  # At Customer 2
+    monkeypatch.setattr(nearest_drivers, 'min_drivers', 1)
+    monkeypatch.setattr(nearest_drivers, 'k', 1)
+    nearest_drivers.invalidate()
+    routed = []
+    original = batch_dispatch.best_routes
+    def counting(shortest_paths, driver_nodes, *args):
+        routed.append(list(driver_nodes))
+        return original(shortest_paths, driver_nodes, *args)
+    monkeypatch.setattr(batch_dispatch, 'best_routes', counting)
+
+    batch = [
+        {"order_id": "ORD-1", "customer_id": "customer2", "items_by_store": {2: {"Milk": 1}}},
+        {"order_id": "ORD-2", "customer_id": "customer1", "items_by_store": {1: {"Apple": 1}}},
+    ]
+    results = dispatch_batch(batch)
+    nearest_drivers.invalidate()
+    assert routed == [["Store B"], ["Store A"]]  # One call per order, driver3 is never routed
+    assert results == {"ORD-1": ("driver2", [2]), "ORD-2": ("driver1", [1])}
+
+def test_batch_dispatcher_flush_records_orders(setup_test_data):
+    """Flushing writes the assigned driver into the stored orders"""
+    dispatcher = BatchDispatcher()
+    for order_id, customer_id, store_id in [("ORD-1", "customer1", 1), ("ORD-2", "customer2", 2),
+                                            ("ORD-3", "customer1", 1)]:
+        order = {"order_id": order_id, "customer_id": customer_id, "items_by_store": {store_id: {"Apple": 1}},
+                 "customer_location": graph_positions[f"Customer {customer_id[-1]}"]}
+        orders[order_id] = dict(order, delivery_agent=None, optimized_store_order=[], status="processing",
+                                delivered=False)
+        dispatcher.submit(order)
+
+    assert dispatcher.pending() == 3
+    dispatcher.flush()
+
+    assert dispatcher.pending() == 0
+    assert {orders["ORD-1"]["delivery_agent"], orders["ORD-2"]["delivery_agent"]} == {"driver1", "driver2"}
+    # Third order is left over from the batch and stacked on a busy driver
+    assert orders["ORD-3"]["delivery_agent"] in ["driver1", "driver2"]
+    assert orders["ORD-3"]["optimized_store_order"] == [1]
+
+def test_batch_dispatcher_background_flush(setup_test_data):
+    """The background thread flushes once max_orders orders are buffered"""
+    dispatcher = BatchDispatcher(window=60, max_orders=1)
+    order = {"order_id": "ORD-1", "customer_id": "customer1", "items_by_store": {1: {"Apple": 1}}}
+    orders["ORD-1"] = dict(order, delivery_agent=None, status="processing", delivered=False)
+
+    dispatcher.start()
+    dispatcher.submit(order)
+
+    deadline = time.monotonic() + 5
+    while orders["ORD-1"]["delivery_agent"] is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert orders["ORD-1"]["delivery_agent"] == "driver1"
@@ -0,0 +1,90 @@
+import pytest
+import numpy as np
+import networkx as nx
+from app.models.users import delivery_graph
+from app.utils.csr_graph import CSRGraph, load_edge_list, load_positions
+from app.utils.distance_matrix import DistanceMatrix, compute_distance_matrix, distance_matrix
+
+@pytest.fixture
+def edge_csv(tmp_path):
+    """The sample delivery network written out as a CSV edge list"""
+    path = tmp_path / "network.csv"
+    rows = ["source,target,weight"] + [f"{u},{v},{data['weight']}" for u, v, data in delivery_graph.edges(data=True)]
+    path.write_text("\n".join(rows) + "\n")
+    return str(path)
+
+def test_load_edge_list_csv(edge_csv):
+    """The CSV loader should produce the same graph as the hard-coded one"""
+    graph = load_edge_list(edge_csv)
+    assert graph.number_of_nodes() == delivery_graph.number_of_nodes()
+    assert graph.number_of_edges() == delivery_graph.number_of_edges()
+    assert graph.indices.dtype == np.int32
+    assert graph.weights.dtype == np.float32
+
+    roundtrip = graph.to_networkx()
+    for u, v, data in delivery_graph.edges(data=True):
+        assert roundtrip[u][v]['weight'] == data['weight']
+
+def test_load_edge_list_whitespace(tmp_path):
+    """Whitespace separated files with comments and a default weight"""
+    path = tmp_path / "network.txt"
+    path.write_text("# depot to stores\n0 1 2.5\n1 2\n\n2 0 4\n")
+    graph = load_edge_list(str(path), directed=True)
+
+    assert graph.names == ["0", "1", "2"]
+    assert graph.number_of_edges() == 3
+    assert graph.dijkstra(graph.name_to_id["0"]).tolist() == [0.0, 2.5, 3.5]
+    # Reversed graph: distances *to* node 0
+    assert graph.reverse().dijkstra(graph.name_to_id["0"]).tolist() == [0.0, 5.0, 4.0]
+
+def test_load_edge_list_bad_weight(tmp_path):
+    """An unparsable weight after the first row is an error"""
+    path = tmp_path / "network.txt"
+    path.write_text("a b 1\nb c heavy\n")
+    with pytest.raises(ValueError):
+        load_edge_list(str(path))
+
+def test_parallel_edges_keep_the_lightest():
+    """Duplicate edges in either order collapse to their minimum weight"""
+    graph = CSRGraph.from_edges(['a', 'b', 'c'], [0, 0, 1], [1, 1, 2], [2.0, 5.0, 1.0])
+    assert graph.dijkstra(0).tolist() == [0.0, 2.0, 3.0]
+    assert graph.number_of_edges() == 2
+
+    graph = CSRGraph.from_edges(['a', 'b', 'c'], [0, 1, 0, 1], [1, 0, 2, 2], [5.0, 2.0, 9.0, 1.0])
+    assert graph.dijkstra(0).tolist() == [0.0, 2.0, 3.0]
+    assert graph.all_pairs()[2].tolist() == [3.0, 1.0, 0.0]
+
+def test_dijkstra_matches_networkx():
+    """CSR shortest paths agree with networkx on a random graph"""
+    graph = nx.gnm_random_graph(60, 200, seed=5)
+    rng = np.random.default_rng(5)
+    for u, v in graph.edges():
+        graph[u][v]['weight'] = float(rng.integers(1, 20))
+    graph.add_node(999)  # Isolated
+
+    csr = CSRGraph.from_networkx(graph)
+    nodes, matrix = compute_distance_matrix(csr)
+    index = {node: i for i, node in enumerate(nodes)}
+
+    for source in [0, 17, 42]:
+        expected = nx.single_source_dijkstra_path_length(graph, source, weight='weight')
+        for target in graph.nodes():
+            value = matrix[index[source], index[target]]
+            if target in expected:
+                assert value == pytest.approx(expected[target])
+            else:
+                assert value == float('inf')
+
+def test_load_positions(tmp_path):
+    path = tmp_path / "positions.csv"
+    path.write_text("node,x,y\nStore A,-1,1\nCustomer 1,1.5,0\n")
+    assert load_positions(str(path)) == {"Store A": (-1.0, 1.0), "Customer 1": (1.5, 0.0)}
+
+def test_distance_matrix_from_config(app, edge_csv):
+    """DELIVERY_GRAPH_FILE swaps the distance matrix onto the loaded CSR graph"""
+    app.config['DELIVERY_GRAPH_FILE'] = edge_csv
+    matrix = DistanceMatrix(delivery_graph)
+    matrix.init_app(app)
+
+    assert isinstance(matrix.graph, CSRGraph)
+    assert matrix.distance("Admin Office", "Customer 2") == distance_matrix.distance("Admin Office", "Customer 2")
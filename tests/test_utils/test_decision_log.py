@@ -0,0 +1,88 @@
+import pytest
+from app.models.stores import orders, active_orders_by_driver, index_active_order
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.algo import assign_driver
+from app.utils.distance_matrix import distance_matrix, graph_fingerprint
+from app.utils.decision_log import DecisionLog, decision_log, read_decisions
+
+@pytest.fixture
+def setup_test_data(monkeypatch, tmp_path):
+    """Sample delivery network with driver1 at the Admin Office and driver2 busy, logging to a temporary file"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.invalidate()
+    users[:] = [
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (1, 0)},
+    ]
+    busy = {"order_id": "ORD-0", "delivery_agent": "driver2", "customer_location": (-2, 0), "delivered": False}
+    orders["ORD-0"] = busy
+    index_active_order("ORD-0", busy)
+    log = DecisionLog(str(tmp_path / "decisions.jsonl"))
+    monkeypatch.setattr('app.utils.algo.decision_log', log)
+
+    yield log
+
+    log.close()
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.invalidate()
+
+def make_order(order_id, stores=(1, 3)):
+    return {"order_id": order_id, "customer_id": "customer1", "customer_location": (1, 0),
+            "items_by_store": {store_id: {"Apple": 1} for store_id in stores}}
+
+def test_disabled_by_default():
+    assert not decision_log.enabled
+
+def test_decisions_are_logged(setup_test_data):
+    log = setup_test_data
+    driver, route = assign_driver(make_order("ORD-1"))
+    assign_driver(make_order("ORD-2", stores=(2,)), users[1:])
+    log.close()
+
+    first, second = read_decisions(log.path)
+    assert first["order"] == {"order_id": "ORD-1", "customer_id": "customer1", "customer_location": [1, 0]}
+    assert first["items_by_store"] == {"1": {"Apple": 1}, "3": {"Apple": 1}}
+    assert first["drivers"] == [["driver1", [0, 0], None], ["driver2", [1, 0], [-2, 0]]]
+    assert (first["driver"], first["route"]) == (driver, route)
+    assert first["cost"] > 0 and first["seconds"] > 0
+    assert first["graph"] == graph_fingerprint(distance_matrix.graph)
+    assert not first["restricted"]
+
+    assert second["restricted"]
+    assert second["drivers"] == [["driver2", [1, 0], [-2, 0]]]
+    assert second["driver"] == "driver2"
+
+def test_unassigned_decision(setup_test_data):
+    log = setup_test_data
+    users[:] = []
+    assert assign_driver(make_order("ORD-1")) == (None, [])
+    [decision] = read_decisions(log.path)
+    assert (decision["driver"], decision["route"], decision["cost"], decision["drivers"]) == (None, [], None, [])
+
+def test_gzipped_log(setup_test_data, tmp_path):
+    log = setup_test_data
+    log.path = str(tmp_path / "decisions.jsonl.gz")
+    for i in range(3):
+        assign_driver(make_order(f"ORD-{i}"))
+    log.close()
+    assert [decision["order"]["order_id"] for decision in read_decisions(log.path)] == ["ORD-0", "ORD-1", "ORD-2"]
+
+def test_init_app_reads_config(app, tmp_path):
+    app.config.update(DECISION_LOG_FILE=str(tmp_path / "log.jsonl"))
+    log = DecisionLog()
+    log.init_app(app)
+    assert log.enabled
+    assert log.path == str(tmp_path / "log.jsonl")
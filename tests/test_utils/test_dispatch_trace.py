@@ -0,0 +1,125 @@
+import threading
+import pytest
+from app.models.stores import orders, active_orders_by_driver
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.algo import assign_driver
+from app.utils.distance_matrix import distance_matrix
+from app.utils.dispatch_trace import DispatchTracer, dispatch_tracer, load_traces
+from app.utils.route_cache import route_cache
+
+PHASES = {'distances', 'candidates', 'routes', 'selection'}
+
+@pytest.fixture
+def setup_test_data(monkeypatch):
+    """Sample delivery network with driver1 at the Admin Office and driver2 at Customer 1, tracing on"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.invalidate()
+    users[:] = [
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (1, 0)},
+    ]
+    tracer = DispatchTracer(enabled=True, buffer=3)
+    monkeypatch.setattr('app.utils.algo.dispatch_tracer', tracer)
+
+    yield tracer
+
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.invalidate()
+
+def make_order(order_id, stores=(1, 3)):
+    return {"order_id": order_id, "customer_id": "customer1", "customer_location": (1, 0),
+            "items_by_store": {store_id: {"Apple": 1} for store_id in stores}}
+
+def test_disabled_by_default():
+    assert not dispatch_tracer.enabled
+    assert dispatch_tracer.begin(make_order("ORD-1")) is None
+    assert dispatch_tracer.current() is None
+
+def test_phases_and_counters(setup_test_data):
+    tracer = setup_test_data
+    driver, route = assign_driver(make_order("ORD-1"))
+    assert tracer.current() is None
+
+    [record] = tracer.recent()
+    assert (record["order_id"], record["driver"], record["route"]) == ("ORD-1", driver, route)
+    assert set(record["phases"]) == PHASES
+    assert record["seconds"] >= sum(record["phases"].values()) - 1e-9
+    assert "candidates" not in record
+
+    counters = record["counters"]
+    assert counters["drivers"] == 2
+    assert counters["cache_hits"] + counters["routes_solved"] == 2  # One start node per driver
+    assert counters["permutations"] == counters["routes_solved"] * 2  # 2! store orders each
+
+def test_cache_hits_are_counted(setup_test_data):
+    tracer = setup_test_data
+    route_cache.clear()
+    assign_driver(make_order("ORD-1"))
+    assign_driver(make_order("ORD-2"))
+    first, second = tracer.recent()
+    assert first["counters"]["routes_solved"] == 2
+    assert second["counters"] == {"drivers": 2, "cache_hits": 2}
+
+def test_decisions(setup_test_data):
+    tracer = setup_test_data
+    tracer.decisions = True
+    tracer.max_candidates = 1
+    driver, _ = assign_driver(make_order("ORD-1"))
+
+    [candidate] = tracer.recent()[0]["candidates"]
+    assert candidate["driver"] == driver
+    assert candidate["priority"] == 1
+
+def test_ring_buffer_keeps_the_latest(setup_test_data):
+    tracer = setup_test_data
+    for i in range(5):
+        assign_driver(make_order(f"ORD-{i}"))
+    assert [record["order_id"] for record in tracer.recent()] == ["ORD-2", "ORD-3", "ORD-4"]
+    assert [record["order_id"] for record in tracer.recent(1)] == ["ORD-4"]
+
+    summary = tracer.summary()
+    assert summary["traces"] == 3
+    assert set(summary["phases"]) == PHASES | {"total"}
+
+def test_traces_are_appended_to_file(setup_test_data, tmp_path):
+    tracer = setup_test_data
+    tracer.path = str(tmp_path / "dispatch.jsonl")
+    tracer.decisions = True
+    for i in range(5):
+        assign_driver(make_order(f"ORD-{i}"))
+
+    traces = load_traces(tracer.path)
+    assert [record["order_id"] for record in traces] == [f"ORD-{i}" for i in range(5)]
+    assert traces[-1] == tracer.recent()[-1]
+
+def test_threads_trace_separately(setup_test_data):
+    tracer = setup_test_data
+    tracer._traces = type(tracer._traces)(maxlen=20)
+    threads = [threading.Thread(target=assign_driver, args=(make_order(f"ORD-{i}"),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    traces = tracer.recent()
+    assert sorted(record["order_id"] for record in traces) == sorted(f"ORD-{i}" for i in range(8))
+    assert all(record["counters"]["drivers"] == 2 for record in traces)
+
+def test_init_app_reads_config(app, tmp_path):
+    app.config.update(DISPATCH_TRACE_ENABLED=True, DISPATCH_TRACE_BUFFER=5, DISPATCH_TRACE_DECISIONS=True,
+                      DISPATCH_TRACE_FILE=str(tmp_path / "trace.jsonl"))
+    tracer = DispatchTracer()
+    tracer.init_app(app)
+    assert (tracer.enabled, tracer.decisions, tracer.path) == (True, True, str(tmp_path / "trace.jsonl"))
+    assert tracer._traces.maxlen == 5
@@ -0,0 +1,105 @@
+import pytest
+from app.models.stores import orders, active_orders_by_driver, current_order, pending_orders, record_assignment
+from app.models.users import users, delivery_graph, edges
+from app.utils import dispatch_worker as dispatch_worker_module
+from app.utils.algo import assign_driver
+from app.utils.dispatch_worker import DispatchWorker
+from app.utils.distance_matrix import distance_matrix
+
+@pytest.fixture
+def setup_test_data():
+    """Sample delivery network with two idle drivers at the Admin Office"""
+    saved_users = list(users)
+    orders.clear()
+    active_orders_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    distance_matrix.invalidate()
+    users[:] = [
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (0, 0)},
+    ]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = saved_users
+
+def awaiting_order(order_id):
+    order = {"order_id": order_id, "customer_id": "customer1", "customer_location": (1, 0),
+             "items_by_store": {1: {"Apple": 1}}}
+    orders[order_id] = dict(order, delivery_agent=None, optimized_store_order=[],
+                            status="awaiting assignment", delivered=False)
+    return order
+
+def test_worker_assigns_in_background(setup_test_data):
+    """The worker fills in the driver and route and moves the order to processing"""
+    worker = DispatchWorker(max_workers=2)
+    try:
+        futures = [worker.submit(awaiting_order(f"ORD-{i}")) for i in range(2)]
+        results = [future.result(timeout=5) for future in futures]
+    finally:
+        worker.shutdown()
+
+    # Both drivers were idle, so the two orders must not share one
+    assert {driver for driver, _ in results} == {"driver1", "driver2"}
+    for i in range(2):
+        assert orders[f"ORD-{i}"]["status"] == "processing"
+        assert orders[f"ORD-{i}"]["optimized_store_order"] == [1]
+        assert current_order(orders[f"ORD-{i}"]["delivery_agent"]) is orders[f"ORD-{i}"]
+
+def test_worker_skips_orders_already_assigned(setup_test_data):
+    """An order that was assigned or removed meanwhile is left alone"""
+    worker = DispatchWorker()
+    order = awaiting_order("ORD-1")
+    orders["ORD-1"]["delivery_agent"] = "driver2"
+    assert worker.dispatch(order) == (None, [])
+    assert orders["ORD-1"]["delivery_agent"] == "driver2"
+
+    del orders["ORD-1"]
+    assert worker.dispatch(order) == (None, [])
+
+def test_worker_redispatches_when_driver_was_taken(setup_test_data, monkeypatch):
+    """A driver who got another order while the route was computed is not handed a second one"""
+    worker = DispatchWorker()
+    calls = []
+    def racing(order, drivers=None):
+        calls.append(order["order_id"])
+        result = assign_driver(order, drivers)
+        if len(calls) == 1:
+            # Another dispatcher records ORD-0 for driver1 before this result is recorded
+            record_assignment("ORD-0", "driver1", [1])
+        return result
+    monkeypatch.setattr(dispatch_worker_module, 'assign_driver', racing)
+
+    awaiting_order("ORD-0")
+    driver, _ = worker.dispatch(awaiting_order("ORD-1"))
+    assert calls == ["ORD-1", "ORD-1"]
+    assert driver == "driver2"
+
+def test_worker_queues_failed_orders(setup_test_data, monkeypatch):
+    """An order whose dispatch raises goes to the pending queue instead of waiting forever"""
+    def failing(order, drivers=None):
+        raise RuntimeError("no route")
+    monkeypatch.setattr(dispatch_worker_module, 'assign_driver', failing)
+    worker = DispatchWorker()
+    try:
+        assert worker.submit(awaiting_order("ORD-1")).result(timeout=5) == (None, [])
+    finally:
+        worker.shutdown()
+    assert "ORD-1" in pending_orders
+    pending_orders.clear()
+
+def test_worker_init_app(app):
+    """The pool only starts in async mode"""
+    worker = DispatchWorker()
+    worker.init_app(app)
+    assert worker._executor is None
+
+    app.config['DISPATCH_MODE'] = 'async'
+    app.config['DISPATCH_WORKERS'] = 3
+    worker.init_app(app)
+    assert worker.max_workers == 3
+    assert worker._executor is not None
+    worker.shutdown()
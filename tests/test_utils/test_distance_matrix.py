@@ -0,0 +1,114 @@
+import pytest
+import numpy as np
+import networkx as nx
+from app.utils.distance_matrix import DistanceMatrix, compute_distance_matrix, graph_fingerprint
+
+@pytest.fixture
+def small_graph():
+    """A small weighted graph with one disconnected node"""
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([
+        ("Admin Office", "Store A", 5),
+        ("Store A", "Store B", 3),
+        ("Admin Office", "Store B", 10),
+        ("Store B", "Customer 1", 2),
+    ])
+    graph.add_node("Island")
+    return graph
+
+def test_compute_distance_matrix_matches_networkx(small_graph):
+    """Every entry should equal networkx's shortest path length"""
+    nodes, matrix = compute_distance_matrix(small_graph)
+    index = {node: i for i, node in enumerate(nodes)}
+
+    for source in ["Admin Office", "Store A", "Store B", "Customer 1"]:
+        for target in ["Admin Office", "Store A", "Store B", "Customer 1"]:
+            expected = nx.shortest_path_length(small_graph, source, target, weight='weight')
+            assert matrix[index[source], index[target]] == expected
+
+    assert matrix[index["Island"], index["Island"]] == 0
+    assert np.isinf(matrix[index["Island"], index["Store A"]])
+
+def test_snapshot_is_cached(small_graph):
+    """The matrix should only be computed once per graph version"""
+    matrix = DistanceMatrix(small_graph)
+    first = matrix.snapshot()
+    assert matrix.snapshot() is first
+    assert first.distance("Admin Office", "Store B") == 8
+
+def test_invalidate_rebuilds(small_graph):
+    """Changing the graph and invalidating should pick up new distances"""
+    matrix = DistanceMatrix(small_graph)
+    old = matrix.snapshot()
+
+    small_graph.add_edge("Admin Office", "Customer 1", weight=1)
+    assert matrix.distance("Admin Office", "Customer 1") == 10  # Still cached
+
+    matrix.invalidate()
+    new = matrix.snapshot()
+    assert new is not old
+    assert new.version == old.version + 1
+    assert new.distance("Admin Office", "Customer 1") == 1
+    # Readers holding the old snapshot keep a consistent view
+    assert old.distance("Admin Office", "Customer 1") == 10
+
+def test_unknown_nodes(small_graph):
+    """Nodes missing from the graph are unreachable, except from themselves"""
+    snapshot = DistanceMatrix(small_graph).snapshot()
+    assert snapshot.distance("Customer 9", "Store A") == float('inf')
+    assert snapshot.distance("Customer 9", "Customer 9") == 0
+
+def test_submatrix(small_graph):
+    """submatrix should return distances in the requested node order"""
+    snapshot = DistanceMatrix(small_graph).snapshot()
+    sub = snapshot.submatrix(["Customer 1", "Admin Office", "Customer 9"])
+    assert sub.shape == (3, 3)
+    assert sub[0, 1] == 10
+    assert sub[1, 0] == 10
+    assert np.isinf(sub[0, 2])
+    assert sub[2, 2] == 0
+
+def test_snapshot_is_read_only(small_graph):
+    """Snapshots are shared between callers and must not be modified"""
+    snapshot = DistanceMatrix(small_graph).snapshot()
+    with pytest.raises(ValueError):
+        snapshot.matrix[0, 0] = 1
+
+def test_graph_fingerprint(small_graph):
+    """The fingerprint is stable and changes with any edge weight"""
+    before = graph_fingerprint(small_graph)
+    assert graph_fingerprint(small_graph) == before
+
+    small_graph["Store A"]["Store B"]["weight"] = 4
+    assert graph_fingerprint(small_graph) != before
+
+def test_disk_cache_warm_start(small_graph, tmp_path, monkeypatch):
+    """A second process opens the saved matrix memory-mapped instead of recomputing it"""
+    first = DistanceMatrix(small_graph, cache_dir=str(tmp_path)).snapshot()
+    assert len(list(tmp_path.glob("distances-*.npy"))) == 1
+
+    def fail(graph):
+        raise AssertionError("matrix should come from the disk cache")
+
+    monkeypatch.setattr("app.utils.distance_matrix.compute_distance_matrix", fail)
+    second = DistanceMatrix(small_graph, cache_dir=str(tmp_path)).snapshot()
+
+    assert isinstance(second.matrix, np.memmap)
+    assert second.nodes == first.nodes
+    assert np.array_equal(second.matrix, first.matrix)
+
+def test_disk_cache_keyed_on_graph(small_graph, tmp_path):
+    """Changing the graph writes a new cache file instead of reusing the old one"""
+    matrix = DistanceMatrix(small_graph, cache_dir=str(tmp_path))
+    assert matrix.distance("Admin Office", "Customer 1") == 10
+
+    small_graph.add_edge("Admin Office", "Customer 1", weight=1)
+    matrix.invalidate()
+    assert matrix.distance("Admin Office", "Customer 1") == 1
+    assert len(list(tmp_path.glob("distances-*.npy"))) == 2
+
+def test_init_app_warms_cache(app, small_graph, tmp_path):
+    """create_app fills the cache at boot when DISTANCE_MATRIX_CACHE_DIR is set"""
+    app.config['DISTANCE_MATRIX_CACHE_DIR'] = str(tmp_path)
+    DistanceMatrix(small_graph).init_app(app)
+    assert len(list(tmp_path.glob("distances-*.npy"))) == 1
@@ -0,0 +1,211 @@
+import numpy as np
+import networkx as nx
+import pytest
+from app.models.stores import orders, active_orders_by_driver
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.algo import assign_driver
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import DistanceMatrix, compute_distance_matrix, distance_matrix
+from app.utils.graph_updates import GraphEditor, graph_editor
+from app.utils.route_cache import route_cache
+
+def random_graph(seed, directed=False):
+    rng = np.random.default_rng(seed)
+    graph = nx.gnm_random_graph(60, 150, seed=seed, directed=directed)
+    for u, v in graph.edges():
+        graph[u][v]["weight"] = float(rng.integers(1, 20))
+    return graph
+
+def assert_matches_full_recompute(distances):
+    snapshot = distances.snapshot()
+    nodes, expected = compute_distance_matrix(distances.graph)
+    assert snapshot.nodes == nodes
+    assert np.allclose(snapshot.matrix, expected)
+
+@pytest.fixture
+def setup_test_data():
+    """Sample delivery network, driver_a at Store A and driver_b at Store C"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    saved_graph = distance_matrix.graph
+    orders.clear()
+    active_orders_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.set_graph(delivery_graph)
+    users[:] = [
+        {"username": "driver_a", "user_type": "Delivery Agent", "location": (-1, 1)},
+        {"username": "driver_b", "user_type": "Delivery Agent", "location": (1, 1)},
+    ]
+
+    yield
+
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.set_graph(saved_graph)
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_updates_match_full_recompute(directed):
+    """Random closures, new roads and length changes leave the matrix exact"""
+    graph = random_graph(7, directed)
+    distances = DistanceMatrix(graph)
+    editor = GraphEditor(distances, {}, full_recompute_fraction=1.0)
+    rng = np.random.default_rng(1)
+
+    for step in range(40):
+        edited = distances.graph
+        existing = list(edited.edges())
+        u, v = existing[rng.integers(len(existing))]
+        choice = step % 4
+        if choice == 0:
+            editor.close_road(u, v)
+        elif choice == 1:
+            editor.set_road(u, v, edited[u][v]["weight"] * 2)
+        elif choice == 2:
+            editor.set_road(u, v, max(1.0, edited[u][v]["weight"] / 2))
+        else:
+            a, b = rng.integers(60, size=2)
+            editor.set_road(int(a), int(b), float(rng.integers(1, 20)))
+        assert_matches_full_recompute(distances)
+
+    assert editor.full_recomputes == 0
+    assert editor.rows_recomputed < 40 * 60
+
+def test_unused_road_recomputes_nothing():
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([("A", "B", 1), ("B", "C", 1), ("A", "C", 5)])
+    distances = DistanceMatrix(graph)
+    editor = GraphEditor(distances, {})
+    distances.snapshot()
+
+    editor.set_road("A", "C", 9)  # Nobody drives A-C directly
+    assert editor.rows_recomputed == 0
+    editor.close_road("A", "B")
+    assert distances.distance("A", "C") == 9
+    assert_matches_full_recompute(distances)
+
+def test_many_affected_rows_recompute_everything():
+    graph = nx.path_graph(10)
+    nx.set_edge_attributes(graph, 1, "weight")
+    distances = DistanceMatrix(graph)
+    editor = GraphEditor(distances, {}, full_recompute_fraction=0.5)
+
+    editor.close_road(4, 5)  # Every node's paths cross the middle of the path
+    assert editor.full_recomputes == 1
+    assert np.isinf(distances.distance(0, 9))
+    assert_matches_full_recompute(distances)
+
+def test_add_node_with_roads():
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([("A", "B", 4)])
+    distances = DistanceMatrix(graph)
+    positions = {"A": (0, 0), "B": (4, 0)}
+    GraphEditor(distances, positions).add_node("M", (2, 0), [("A", 1), ("B", 1)])
+
+    assert distances.distance("A", "B") == 2
+    assert distances.snapshot().nodes[-1] == "M"
+    assert positions["M"] == (2, 0)
+    assert_matches_full_recompute(distances)
+
+def test_positions_change_when_the_graph_is_published():
+    """A new node's position only appears once the graph with that node is published"""
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([("A", "B", 4)])
+    distances = DistanceMatrix(graph)
+    positions = {"A": (0, 0), "B": (4, 0)}
+    seen = []
+    publish = distances.publish
+    def checking(*args, **kwargs):
+        seen.append("M" in positions)
+        return publish(*args, **kwargs)
+    distances.publish = checking
+    distances.add_listener(lambda: seen.append("M" in positions and "M" in distances.graph))
+
+    GraphEditor(distances, positions).add_node("M", (2, 0), [("A", 1)])
+    assert seen == [False, True]
+
+def test_csr_graphs_stay_csr():
+    graph = CSRGraph.from_networkx(random_graph(3, directed=True))
+    distances = DistanceMatrix(graph)
+    editor = GraphEditor(distances, {})
+    u, v = next(iter(graph.to_networkx().edges()))
+    editor.apply([("close", u, v), ("node", "New", None), ("road", "New", u, 1.5)])
+
+    assert isinstance(distances.graph, CSRGraph)
+    assert distances.distance("New", u) == 1.5
+    assert_matches_full_recompute(distances)
+
+def test_invalid_changes_publish_nothing():
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([("A", "B", 4)])
+    distances = DistanceMatrix(graph)
+    editor = GraphEditor(distances, {})
+    version = distances.version
+
+    with pytest.raises(ValueError):
+        editor.close_road("A", "C")
+    with pytest.raises(ValueError):
+        editor.apply([("road", "A", "B", 1), ("close", "B", "C")])  # All or nothing
+    with pytest.raises(ValueError):
+        editor.add_node("A")
+    with pytest.raises(ValueError):
+        editor.set_road("A", "B", -1)
+    assert distances.version == version
+    assert distances.graph is graph
+    assert distances.distance("A", "B") == 4
+
+def test_readers_keep_their_snapshot():
+    """A dispatch that took its snapshot before the update finishes on the old network"""
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([("A", "B", 4), ("B", "C", 4)])
+    distances = DistanceMatrix(graph)
+    before = distances.snapshot()
+    GraphEditor(distances, {}).close_road("A", "B")
+
+    assert before.distance("A", "C") == 8
+    assert not before.matrix.flags.writeable
+    after = distances.snapshot()
+    assert after.version > before.version
+    assert np.isinf(after.distance("A", "C"))
+    assert graph.has_edge("A", "B")  # The old graph is not edited in place
+
+def test_graph_swapped_during_update():
+    """If the graph is replaced while an update runs, the update is redone on the new graph"""
+    first, second = nx.Graph(), nx.Graph()
+    first.add_weighted_edges_from([("A", "B", 1)])
+    second.add_weighted_edges_from([("A", "B", 1), ("B", "C", 1)])
+    distances = DistanceMatrix(first)
+    editor = GraphEditor(distances, {})
+
+    update = editor._update
+    def swap_once(base, graph, changes):
+        if distances.graph is first:
+            distances.set_graph(second)
+        return update(base, graph, changes)
+    editor._update = swap_once
+
+    editor.set_road("A", "B", 5)
+    assert distances.graph.has_edge("B", "C")
+    assert distances.distance("A", "C") == 6
+
+def test_new_store_is_dispatched(setup_test_data):
+    """Orders from a store added at runtime route through its new node"""
+    route_cache.clear()
+    order = {"order_id": "ORD-1", "customer_id": "customer1", "customer_location": (-2, 0),
+             "items_by_store": {4: {"Bread": 1}}}
+    assert assign_driver(order) == (None, [])  # Store D is not on the graph yet
+
+    node = graph_editor.add_store_node(4, (-2, 1), [("Customer 2", 1), ("Store A", 1)])
+    assert node == "Store D"
+    assert assign_driver(order) == ("driver_a", [4])
+
+    graph_editor.close_road("Store A", "Store D")
+    graph_editor.close_road("Store A", "Customer 2")
+    graph_editor.close_road("Store B", "Customer 2")
+    assert assign_driver(order) == (None, [])
+    assert delivery_graph.has_edge("Store A", "Customer 2")  # Edits work on a copy
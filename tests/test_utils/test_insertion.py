@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+from app.models.stores import (orders, active_orders_by_driver, planned_stops_by_driver,
+                               index_active_order, release_active_order)
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.distance_matrix import distance_matrix
+from app.utils.insertion import InsertionDispatcher, cheapest_insertion, insert_order, route_length
+
+def line_distances(points):
+    """Distance table for points on a line"""
+    points = np.asarray(points, dtype=float)
+    return np.abs(points[:, None] - points[None, :])
+
+@pytest.fixture
+def setup_test_data():
+    """Sample delivery network, driver1 at the Admin Office and driver2 at Customer 1"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    planned_stops_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.invalidate()
+    users[:] = [
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (1, 0)},
+    ]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    planned_stops_by_driver.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.invalidate()
+
+def make_order(order_id, store_ids, customer_id="customer1", location=(1, 0), driver=None):
+    order = {"order_id": order_id, "customer_id": customer_id, "customer_location": location,
+             "items_by_store": {store_id: {"Apple": 1} for store_id in store_ids},
+             "delivery_agent": driver, "optimized_store_order": list(store_ids), "delivered": False}
+    orders[order_id] = order
+    if driver:
+        index_active_order(order_id, order)
+    return order
+
+def test_cheapest_insertion():
+    """Stops go where they add the least distance, including at the end"""
+    dist = line_distances([0, 10, 5, 20])
+    assert cheapest_insertion(dist, [0, 1], 2) == (0.0, 1)  # 5 lies between 0 and 10
+    assert cheapest_insertion(dist, [0, 1], 3) == (10.0, 2)  # 20 goes after 10
+    assert cheapest_insertion(dist, [0, 1], 2, first=2) == (5.0, 2)
+
+def test_pickup_before_drop_off():
+    """The drop-off is never placed before the order's pickups"""
+    # Start at 0, existing stop at 10, pickup at 8, drop-off at 1
+    dist = line_distances([0, 10, 8, 1])
+    increase, route = insert_order(dist, [0, 1], [2], 3)
+    assert route.index(2) < route.index(3)
+    assert increase == pytest.approx(route_length(dist, route) - route_length(dist, [0, 1]))
+
+def test_multiple_pickups():
+    """Every pickup is inserted and the reported increase matches the new route"""
+    dist = line_distances([0, 4, 9, 2, 7, 12])
+    increase, route = insert_order(dist, [0, 1, 2], [3, 4], 5)
+    assert sorted(route) == [0, 1, 2, 3, 4, 5]
+    assert route[0] == 0
+    assert route.index(5) > max(route.index(3), route.index(4))
+    assert increase == pytest.approx(route_length(dist, route) - route_length(dist, [0, 1, 2]))
+
+def test_unreachable_order():
+    dist = line_distances([0, 3, 6])
+    dist[:, 2] = np.inf
+    dist[2, 2] = 0
+    assert insert_order(dist, [0], [1], 2) == (float('inf'), None)
+
+def test_busy_driver_on_the_way_wins(setup_test_data):
+    """A driver already heading from Store A to Customer 1 takes a second such order for free"""
+    make_order("ORD-1", [1], driver="driver2")
+    users[1]["location"] = (0, 0)  # driver2 left the Admin Office together with driver1
+    dispatcher = InsertionDispatcher(strategy='insertion')
+
+    driver, route = dispatcher.assign(make_order("ORD-2", [1]))
+
+    assert (driver, route) == ("driver2", [1])
+    plan = planned_stops_by_driver["driver2"]
+    assert [stop["order_id"] for stop in plan].count("ORD-2") == 2
+    # The new drop-off follows the new pickup
+    nodes = [(stop["order_id"], stop["store_id"]) for stop in plan]
+    assert nodes.index(("ORD-2", 1)) < nodes.index(("ORD-2", None))
+
+def test_idle_driver_when_cheaper(setup_test_data):
+    """Orders far from a busy driver's plan go to whoever adds the least distance"""
+    make_order("ORD-1", [3], customer_id="customer3", location=(0, -1), driver="driver1")
+    users[1]["location"] = (-2, 0)
+    dispatcher = InsertionDispatcher(strategy='insertion')
+
+    # driver2 is idle at Customer 2: Store B and back is 4 km, a detour of 5 km for driver1
+    driver, _ = dispatcher.assign(make_order("ORD-2", [2], customer_id="customer2", location=(-2, 0)))
+    assert driver == "driver2"
+
+def test_capacity(setup_test_data):
+    """Drivers carrying max_orders orders are not offered more"""
+    make_order("ORD-1", [1], driver="driver2")
+    dispatcher = InsertionDispatcher(strategy='insertion', max_orders=1)
+    options = dispatcher.evaluate(make_order("ORD-2", [1]))
+    assert [username for _, username, _ in options] == ["driver1"]
+
+def test_orders_without_a_plan_become_stops(setup_test_data):
+    """Orders assigned by assign_driver are treated as their stores followed by the drop-off"""
+    make_order("ORD-1", [2, 1], driver="driver1")
+    stops = InsertionDispatcher().driver_stops("driver1")
+    assert [(stop["node"], stop["store_id"]) for stop in stops] == [
+        ("Store B", 2), ("Store A", 1), ("Customer 1", None)]
+
+def test_collected_pickups_leave_the_plan(setup_test_data):
+    """Once an order is collected only its drop-off is left to insert new orders around"""
+    dispatcher = InsertionDispatcher(strategy='insertion')
+    users[1]["location"] = (-2, 0)
+    first = make_order("ORD-1", [3])
+    driver, _ = dispatcher.assign(first, users[:1])
+    first["delivery_agent"] = driver
+    index_active_order("ORD-1", first)
+    assert driver == "driver1"
+    assert [(stop["order_id"], stop["store_id"]) for stop in dispatcher.driver_stops("driver1")] == [
+        ("ORD-1", 3), ("ORD-1", None)]
+
+    first["status"] = "collected"
+    users[0]["location"] = (1, 1)  # driver1 is at Store C with the goods
+    assert [(stop["order_id"], stop["store_id"]) for stop in dispatcher.driver_stops("driver1")] == [("ORD-1", None)]
+
+    # Picking up at Store C on the way to Customer 1 costs driver1 nothing, with no stale Store C stop to price
+    [(increase, username, stops)] = [option for option in dispatcher.evaluate(make_order("ORD-2", [3]))
+                                     if option[1] == "driver1"]
+    assert increase == 0
+    assert ("ORD-1", 3) not in [(stop["order_id"], stop["store_id"]) for stop in stops]
+    assert dispatcher.assign(orders["ORD-2"]) == ("driver1", [3])
+    assert ("ORD-1", 3) not in [(stop["order_id"], stop["store_id"]) for stop in planned_stops_by_driver["driver1"]]
+
+def test_delivery_releases_stops(setup_test_data):
+    """Delivering an order removes its stops from the driver's plan"""
+    first = make_order("ORD-1", [1], driver="driver2")
+    dispatcher = InsertionDispatcher(strategy='insertion')
+    second = make_order("ORD-2", [2])
+    driver, route = dispatcher.assign(second)
+    second["delivery_agent"] = driver
+    index_active_order("ORD-2", second)
+
+    release_active_order("ORD-1", first)
+    assert {stop["order_id"] for stop in planned_stops_by_driver.get(driver, [])} <= {"ORD-2"}
+
+    release_active_order("ORD-2", second)
+    assert driver not in planned_stops_by_driver
+
+def test_init_app_reads_config(app):
+    app.config.update(DISPATCH_STRATEGY='insertion', INSERTION_MAX_ORDERS=5)
+    dispatcher = InsertionDispatcher()
+    assert not dispatcher.enabled
+    dispatcher.init_app(app)
+    assert dispatcher.enabled
+    assert dispatcher.max_orders == 5
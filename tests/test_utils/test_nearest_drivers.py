@@ -0,0 +1,129 @@
+import networkx as nx
+import numpy as np
+import pytest
+from app.models.stores import orders, active_orders_by_driver, index_active_order, release_active_order
+from app.models.users import users, graph_positions
+import app.utils.algo as algo
+from app.utils.algo import assign_driver
+from app.utils.csr_graph import CSRGraph
+from app.utils.distance_matrix import distance_matrix
+from app.utils.nearest_drivers import NearestDrivers, nearest_drivers
+from app.utils.zones import ZoneIndex
+from benchmarks.synthetic import install_world, make_basket, make_world
+
+@pytest.fixture
+def street():
+    """Nodes 0-9 on a one-way street towards 9, with drivers at 2, 5 and 8"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    saved_graph = distance_matrix.graph
+    orders.clear()
+    active_orders_by_driver.clear()
+    graph = nx.DiGraph()
+    graph.add_weighted_edges_from((i, i + 1, 1) for i in range(9))
+    graph_positions.clear()
+    graph_positions.update({i: (i, 0) for i in range(10)})
+    distance_matrix.set_graph(graph)
+    users[:] = [
+        {"username": f"driver{i}", "user_type": "Delivery Agent", "location": (i, 0)} for i in (2, 5, 8)
+    ] + [{"username": "customer1", "user_type": "Customer", "location": (0, 0)}]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.set_graph(saved_graph)
+
+@pytest.fixture
+def city(monkeypatch):
+    """A synthetic city with a few hundred idle and busy drivers, dispatched by the reverse search"""
+    world = make_world('grid', size=400, drivers=300, history=600, seed=1)
+    monkeypatch.setattr(nearest_drivers, 'min_drivers', 1)
+    with install_world(world):
+        yield world
+
+def names(drivers):
+    return [driver["username"] for driver in drivers]
+
+def test_expand_settles_nearest_first():
+    graph = nx.Graph()
+    graph.add_weighted_edges_from([("A", "B", 1), ("B", "C", 2), ("A", "D", 5), ("C", "D", 1)])
+    csr = CSRGraph.from_networkx(graph)
+    a, c = csr.name_to_id["A"], csr.name_to_id["C"]
+
+    assert [(csr.names[u], d) for u, d in csr.expand([a])] == [("A", 0), ("B", 1), ("C", 3), ("D", 4)]
+    assert [csr.names[u] for u, _ in csr.expand([a], radius=2)] == ["A", "B"]
+    # Several sources: distance to the nearest of them
+    assert dict((csr.names[u], d) for u, d in csr.expand([a, c])) == {"A": 0, "C": 0, "B": 1, "D": 1}
+
+def test_drivers_upstream_of_the_store(street):
+    """On a one-way street only drivers who can drive to the store are found, nearest first"""
+    search = NearestDrivers(k=2)
+
+    assert names(search.idle_near([9])) == ["driver8", "driver5"]
+    assert names(search.idle_near([6])) == ["driver5", "driver2"]
+    assert names(search.idle_near([4])) == ["driver2"]  # driver5 and driver8 are past it
+    assert names(search.idle_near([9], radius=3)) == ["driver8"]
+    assert search.idle_near(["nowhere"]) == []
+
+def test_busy_drivers_are_skipped(street, monkeypatch):
+    """Assigning and delivering orders re-files the driver through the listener"""
+    search = NearestDrivers(k=1)
+    monkeypatch.setattr('app.models.stores.driver_listeners', [search.driver_changed])
+    assert names(search.idle_near([9])) == ["driver8"]
+
+    order = {"order_id": "ORD-1", "delivery_agent": "driver8", "delivered": False, "status": "processing"}
+    orders["ORD-1"] = order
+    index_active_order("ORD-1", order)
+    assert names(search.idle_near([9])) == ["driver5"]
+
+    order["delivered"] = True
+    release_active_order("ORD-1", order)
+    assert names(search.idle_near([9])) == ["driver8"]
+
+def test_dispatch_scores_only_nearby_drivers(city, monkeypatch):
+    scored = []
+    original = algo.score_drivers
+    def counting(drivers, *args):
+        scored.extend(drivers)
+        return original(drivers, *args)
+    monkeypatch.setattr('app.utils.algo.score_drivers', counting)
+
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        scored.clear()
+        driver, route = assign_driver(make_basket(city, 2, rng))
+        assert driver is not None
+        assert len(scored) <= nearest_drivers.k
+        assert len(route) == 2
+
+def test_search_covering_the_fleet_matches_full_scan(city, monkeypatch):
+    rng = np.random.default_rng(1)
+    baskets = [make_basket(city, size, rng) for size in (1, 2, 4)]
+    monkeypatch.setattr(nearest_drivers, 'min_drivers', 0)
+    monkeypatch.setattr('app.utils.algo.zone_index', ZoneIndex(city["positions"], min_drivers=0))
+    full = [assign_driver(basket) for basket in baskets]
+
+    monkeypatch.setattr(nearest_drivers, 'min_drivers', 1)
+    monkeypatch.setattr(nearest_drivers, 'k', len(city["users"]))
+    assert [assign_driver(basket) for basket in baskets] == full
+
+def test_no_idle_driver_in_reach_falls_back(city, monkeypatch):
+    """Without an idle driver within the radius the order still gets a driver"""
+    monkeypatch.setattr(nearest_drivers, 'radius', 0)
+    driver, _ = assign_driver(make_basket(city, 1, np.random.default_rng(2)))
+    assert driver is not None
+
+def test_graph_change_rebuilds(city):
+    nearest_drivers.fleet_size()
+    distance_matrix.invalidate()
+    assert not nearest_drivers._built
+
+def test_init_app_reads_config(app):
+    app.config.update(NEAREST_DRIVERS_MIN_DRIVERS=50, NEAREST_DRIVERS_K=3, NEAREST_DRIVERS_RADIUS=12.5)
+    search = NearestDrivers()
+    search.init_app(app)
+    assert (search.min_drivers, search.k, search.radius) == (50, 3, 12.5)
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from app.utils.algo import assign_driver
+from app.utils.distance_matrix import distance_matrix
+from app.utils.parallel_dispatch import ParallelEvaluator
+from app.utils.route_solver import route_solver
+from benchmarks.synthetic import install_world, make_basket, make_world
+
+@pytest.fixture
+def world():
+    """A synthetic city with enough drivers to split into several chunks"""
+    world = make_world('grid', size=100, drivers=40, history=200, seed=3)
+    with install_world(world):
+        yield world
+
+@pytest.fixture
+def evaluator():
+    """Two worker processes used for every fleet size"""
+    evaluator = ParallelEvaluator(min_drivers=1, workers=2)
+    yield evaluator
+    evaluator.shutdown()
+
+def test_disabled_by_default():
+    """The process pool is opt-in through PARALLEL_DISPATCH_MIN_DRIVERS"""
+    assert not ParallelEvaluator().should_use(100000)
+    assert ParallelEvaluator(min_drivers=50).should_use(50)
+    assert not ParallelEvaluator(min_drivers=50).should_use(49)
+
+def test_init_app_reads_config(app):
+    """init_app picks the threshold and pool size from the app config"""
+    app.config.update(PARALLEL_DISPATCH_MIN_DRIVERS=500, PARALLEL_DISPATCH_WORKERS=3)
+    evaluator = ParallelEvaluator()
+    evaluator.init_app(app)
+    assert evaluator.min_drivers == 500
+    assert evaluator.workers == 3
+
+def test_parallel_matches_serial(world, evaluator, monkeypatch):
+    """assign_driver picks the same driver and route with and without the pool"""
+    rng = np.random.default_rng(0)
+    baskets = [make_basket(world, size, rng) for size in (1, 3, 5, 8)]
+    serial = [assign_driver(basket) for basket in baskets]
+
+    monkeypatch.setattr('app.utils.algo.parallel_evaluator', evaluator)
+    parallel = [assign_driver(basket) for basket in baskets]
+
+    assert parallel == serial
+    assert all(driver is not None for driver, _ in parallel)
+
+def test_scores_every_reachable_driver(world, evaluator):
+    """evaluate returns one (priority, distance, username, stores) entry per driver"""
+    snapshot = distance_matrix.snapshot()
+    stores_to_visit = ["Store A", "Store B"]
+    customer = snapshot.nodes[-1]
+    starts = [("near", 1, snapshot.nodes[0]), ("busy", 2, snapshot.nodes[1]), ("lost", 1, "Nowhere")]
+
+    scored = evaluator.evaluate(snapshot, starts, stores_to_visit, customer, route_solver)
+
+    by_driver = {username: (priority, distance, route) for priority, distance, username, route in scored}
+    assert set(by_driver) == {"near", "busy"}  # "Nowhere" can't reach any store
+    assert by_driver["busy"][0] == 2
+    assert sorted(by_driver["near"][2]) == stores_to_visit
+
+    route = [snapshot.nodes[0]] + by_driver["near"][2] + [customer]
+    expected = sum(snapshot.distance(a, b) for a, b in zip(route, route[1:]))
+    assert by_driver["near"][1] == pytest.approx(expected)
+
+def test_matrix_published_once_per_version(world, evaluator):
+    """Workers share one file per graph version, replaced when the graph changes"""
+    snapshot = distance_matrix.snapshot()
+    starts = [("driver", 1, snapshot.nodes[0])]
+    evaluator.evaluate(snapshot, starts, ["Store A"], snapshot.nodes[-1], route_solver)
+    first = evaluator._published[1]
+    evaluator.evaluate(snapshot, starts, ["Store A"], snapshot.nodes[-1], route_solver)
+    assert evaluator._published[1] == first
+
+    distance_matrix.invalidate()
+    snapshot = distance_matrix.snapshot()
+    evaluator.evaluate(snapshot, starts, ["Store A"], snapshot.nodes[-1], route_solver)
+    assert evaluator._published[1] != first
+    assert not os.path.exists(first)
@@ -0,0 +1,128 @@
+import pytest
+from app.models.stores import (orders, active_orders_by_driver, pending_orders, current_order,
+                               index_active_order, record_assignment, AWAITING_ASSIGNMENT)
+from app.models.users import users, delivery_graph, edges
+from app.utils.distance_matrix import distance_matrix
+from app.utils.pending_dispatch import PendingDispatcher, complete_delivery
+
+@pytest.fixture
+def setup_test_data():
+    """Sample delivery network with no delivery agents yet"""
+    saved_users = list(users)
+    orders.clear()
+    active_orders_by_driver.clear()
+    pending_orders.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    distance_matrix.invalidate()
+    users[:] = [{"username": "customer1", "user_type": "Customer", "location": (1, 0)}]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    pending_orders.clear()
+    users[:] = saved_users
+
+def add_driver(username, location=(0, 0)):
+    driver = {"username": username, "user_type": "Delivery Agent", "location": location}
+    users.append(driver)
+    return driver
+
+def pending_order(order_id, store_ids=(1,), location=(1, 0)):
+    """An order no driver could take, parked in the pending queue"""
+    orders[order_id] = {"order_id": order_id, "customer_id": "customer1", "customer_location": location,
+                        "items_by_store": {store_id: {"Apple": 1} for store_id in store_ids},
+                        "delivery_agent": None, "optimized_store_order": [],
+                        "status": AWAITING_ASSIGNMENT, "delivered": False}
+    record_assignment(order_id, None, [])
+    return orders[order_id]
+
+def test_unassigned_orders_are_queued(setup_test_data):
+    pending_order("ORD-1")
+    pending_order("ORD-2")
+    assert list(pending_orders) == ["ORD-1", "ORD-2"]
+    assert orders["ORD-1"]["status"] == AWAITING_ASSIGNMENT
+
+    record_assignment("ORD-1", "driver1", [1])
+    assert list(pending_orders) == ["ORD-2"]
+    assert orders["ORD-1"]["status"] == "processing"
+
+def test_freed_driver_takes_oldest_order(setup_test_data):
+    for i in range(3):
+        pending_order(f"ORD-{i}")
+    add_driver("driver1")
+
+    assert PendingDispatcher().driver_freed("driver1") == ("ORD-0", [1])
+    assert orders["ORD-0"]["delivery_agent"] == "driver1"
+    assert current_order("driver1") is orders["ORD-0"]
+    assert list(pending_orders) == ["ORD-1", "ORD-2"]
+
+def test_only_the_freed_driver_is_considered(setup_test_data):
+    """A closer idle driver does not take the order from the one who just finished"""
+    pending_order("ORD-1", location=(1, 0))
+    add_driver("nearby", location=(1, 0))
+    add_driver("far", location=(-2, 0))
+
+    PendingDispatcher().driver_freed("far")
+    assert orders["ORD-1"]["delivery_agent"] == "far"
+
+def test_unreachable_orders_stay_queued(setup_test_data):
+    """Orders the driver can't reach are skipped, keeping their place in the queue"""
+    pending_order("ORD-1", store_ids=(4,))  # Store D is not on the delivery graph
+    pending_order("ORD-2")
+    add_driver("driver1")
+
+    assert PendingDispatcher().driver_freed("driver1") == ("ORD-2", [1])
+    assert list(pending_orders) == ["ORD-1"]
+
+def test_scan_limit(setup_test_data):
+    pending_order("ORD-1", store_ids=(4,))
+    pending_order("ORD-2")
+    add_driver("driver1")
+
+    assert PendingDispatcher(scan_limit=1).driver_freed("driver1") is None
+    assert list(pending_orders) == ["ORD-1", "ORD-2"]
+
+def test_stale_entries_are_dropped(setup_test_data):
+    """Cancelled or already assigned orders leave the queue without being dispatched"""
+    pending_order("ORD-1")
+    pending_order("ORD-2")
+    pending_order("ORD-3")
+    del orders["ORD-1"]
+    orders["ORD-2"]["delivery_agent"] = "driver2"
+    add_driver("driver1")
+
+    assert PendingDispatcher().driver_freed("driver1") == ("ORD-3", [1])
+    assert not pending_orders
+
+def test_no_order_is_stranded(setup_test_data, monkeypatch):
+    """Orders placed while there were no drivers are all delivered, oldest first"""
+    for i in range(5):
+        pending_order(f"ORD-{i}")
+    driver = add_driver("driver1")
+    dispatcher = PendingDispatcher()
+    monkeypatch.setattr('app.utils.pending_dispatch.pending_dispatcher', dispatcher)
+
+    delivered = []
+    dispatcher.driver_freed("driver1")
+    while current_order("driver1"):
+        order = current_order("driver1")
+        delivered.append(order["order_id"])
+        complete_delivery(order["order_id"], order)
+
+    assert delivered == [f"ORD-{i}" for i in range(5)]
+    assert not pending_orders
+    assert all(order["delivered"] for order in orders.values())
+    assert driver["location"] == (1, 0)
+
+def test_complete_delivery_releases_driver(setup_test_data):
+    driver = add_driver("driver1")
+    orders["ORD-1"] = {"order_id": "ORD-1", "delivery_agent": "driver1", "delivered": False,
+                       "customer_location": (-2, 0)}
+    index_active_order("ORD-1", orders["ORD-1"])
+
+    assert complete_delivery("ORD-1", orders["ORD-1"]) is None  # Nothing pending
+    assert orders["ORD-1"]["delivered"] is True
+    assert current_order("driver1") is None
+    assert driver["location"] == (-2, 0)
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+import threading
+import time
+import pytest
+from app.models.stores import orders, active_orders_by_driver, index_active_order
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.distance_matrix import distance_matrix
+from app.utils.pending_dispatch import complete_delivery
+from app.utils.rebalancing import DemandRebalancer, demand_rebalancer
+from app.utils.travel_times import travel_times
+
+NOW = datetime(2025, 4, 1, 18)
+
+@pytest.fixture
+def setup_test_data():
+    """Sample delivery network, driver1 idle at Customer 2 and driver2 idle at Customer 3"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.invalidate()
+    users[:] = [
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (-2, 0)},
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (0, -1)},
+    ]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    demand_rebalancer.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.invalidate()
+
+def make_order(order_id, stores, driver=None):
+    return {"order_id": order_id, "customer_id": "customer1", "customer_location": (1, 0),
+            "items_by_store": {store_id: {"Apple": 1} for store_id in stores}, "delivery_agent": driver,
+            "delivered": False}
+
+def evening_rush(rebalancer):
+    """Three orders from Store C and one from Store A"""
+    for i, store_id in enumerate((3, 3, 3, 1)):
+        rebalancer.record_order(make_order(f"ORD-{i}", [store_id]), NOW)
+
+def test_demand_decays():
+    rebalancer = DemandRebalancer(half_life=30)
+    rebalancer.record_order(make_order("ORD-1", [3]), NOW)
+    rebalancer.record_order(make_order("ORD-2", [1, 3]), NOW)  # Split between both stores
+    assert rebalancer.demand(NOW) == {"Store C": 1.5, "Store A": 0.5}
+    assert rebalancer.demand(NOW + timedelta(minutes=30)) == {"Store C": 0.75, "Store A": 0.25}
+
+    rebalancer.record_order(make_order("ORD-3", [1]), NOW + timedelta(minutes=60))
+    assert rebalancer.demand(NOW + timedelta(minutes=60)) == pytest.approx({"Store C": 0.375, "Store A": 1.125})
+    assert rebalancer.demand(NOW + timedelta(days=1)) == {}
+
+def test_idle_drivers_move_towards_demand(setup_test_data):
+    """driver2 covers the busy Store C best, then driver1 takes Store A"""
+    rebalancer = DemandRebalancer()
+    evening_rush(rebalancer)
+    moves = rebalancer.suggest(when=NOW)
+
+    assert [(move["driver"], move["from"], move["to"]) for move in moves] == [
+        ("driver2", "Customer 3", "Store C"), ("driver1", "Customer 2", "Store A")]
+    # Expected first leg: 3.75 km, then 0.75 km, then 0
+    assert [move["gain"] for move in moves] == pytest.approx([3.0, 0.75])
+
+def test_min_gain_and_max_move(setup_test_data):
+    rebalancer = DemandRebalancer(min_gain=1.0)
+    evening_rush(rebalancer)
+    assert [move["driver"] for move in rebalancer.suggest(when=NOW)] == ["driver2"]
+
+    rebalancer = DemandRebalancer(max_move=3.5)  # Store C is 4 km from both drivers
+    evening_rush(rebalancer)
+    assert [(move["driver"], move["to"]) for move in rebalancer.suggest(when=NOW)] == [("driver1", "Store A")]
+
+def test_only_movable_idle_drivers_move(setup_test_data):
+    rebalancer = DemandRebalancer()
+    evening_rush(rebalancer)
+    assert [(move["driver"], move["to"]) for move in rebalancer.suggest(["driver1"], NOW)] == [("driver1", "Store C")]
+
+    busy = make_order("ORD-9", [2], driver="driver1")
+    index_active_order("ORD-9", busy)
+    assert [move["driver"] for move in rebalancer.suggest(when=NOW)] == ["driver2"]
+    assert rebalancer.suggest(["driver1"], NOW) == []
+
+def test_no_demand_no_moves(setup_test_data):
+    assert DemandRebalancer().suggest(when=NOW) == []
+
+def test_target_is_dropped_on_assignment(setup_test_data):
+    """The shared rebalancer forgets a driver's waiting spot once they get an order"""
+    evening_rush(demand_rebalancer)
+    assert demand_rebalancer.advise("driver1", NOW) == "Store C"
+    assert demand_rebalancer.target_of("driver1") == "Store C"
+
+    order = make_order("ORD-9", [2], driver="driver1")
+    orders["ORD-9"] = order
+    index_active_order("ORD-9", order)
+    assert demand_rebalancer.target_of("driver1") is None
+
+def test_delivery_leaves_driver_with_a_target(setup_test_data):
+    demand_rebalancer.stop()  # Advised in the request itself
+    for i in range(3):
+        demand_rebalancer.record_order(make_order(f"ORD-{i}", [3]))
+    order = make_order("ORD-9", [3], driver="driver1")
+    order["customer_location"] = (-2, 0)
+    orders["ORD-9"] = order
+    index_active_order("ORD-9", order)
+
+    assert complete_delivery("ORD-9", order) is None
+    assert demand_rebalancer.target_of("driver1") == "Store C"
+
+def test_delivery_advice_runs_in_the_background(setup_test_data, monkeypatch):
+    """With the rounds running, completing a delivery leaves the advice to the background thread"""
+    monkeypatch.setattr(travel_times, 'clock', lambda: NOW)
+    monkeypatch.setattr(demand_rebalancer, 'interval', 60)
+    evening_rush(demand_rebalancer)
+    order = make_order("ORD-9", [3], driver="driver1")
+    order["customer_location"] = (-2, 0)
+    orders["ORD-9"] = order
+    index_active_order("ORD-9", order)
+
+    advised = []
+    advise = demand_rebalancer.advise
+    def recording(username, when=None):
+        advised.append(threading.current_thread().name)
+        return advise(username, when)
+    monkeypatch.setattr(demand_rebalancer, 'advise', recording)
+    demand_rebalancer.start()
+    try:
+        assert complete_delivery("ORD-9", order) is None
+        deadline = time.monotonic() + 5
+        while demand_rebalancer.target_of("driver1") is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        demand_rebalancer.stop()
+    assert advised == ["rebalancer"]
+    assert demand_rebalancer.target_of("driver1") == "Store C"
+
+def test_rounds_skip_drivers_assigned_meanwhile(setup_test_data, monkeypatch):
+    """Moves are worked out without the dispatch lock, so a driver who got an order keeps no target"""
+    rebalancer = DemandRebalancer()
+    evening_rush(rebalancer)
+    suggest = rebalancer.suggest
+    def racing(movable=None, when=None):
+        moves = suggest(movable, when)
+        order = make_order("ORD-9", [2], driver="driver2")
+        orders["ORD-9"] = order
+        index_active_order("ORD-9", order)
+        return moves
+    monkeypatch.setattr(rebalancer, 'suggest', racing)
+
+    assert [move["driver"] for move in rebalancer.rebalance(when=NOW)] == ["driver1"]
+    assert rebalancer.targets == {"driver1": "Store A"}
+
+def test_periodic_rebalance_moves_drivers_who_stay_idle(setup_test_data, monkeypatch):
+    """Without any delivery completing, the background round gives idle drivers waiting spots"""
+    monkeypatch.setattr(travel_times, 'clock', lambda: NOW)
+    rebalancer = DemandRebalancer(interval=0.01)
+    evening_rush(rebalancer)
+    rebalancer.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(rebalancer.targets) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        rebalancer.stop()
+    assert rebalancer.targets == {"driver2": "Store C", "driver1": "Store A"}
+
+def test_init_app_starts_and_stops_the_rounds(app):
+    rebalancer = DemandRebalancer()
+    app.config.update(REBALANCE_INTERVAL_SECONDS=60)
+    rebalancer.init_app(app)
+    assert rebalancer._thread.is_alive()
+
+    app.config.update(REBALANCE_INTERVAL_SECONDS=0)
+    rebalancer.init_app(app)
+    assert rebalancer._thread is None
+
+def test_disabled(setup_test_data):
+    rebalancer = DemandRebalancer(enabled=False)
+    evening_rush(rebalancer)
+    assert rebalancer.demand(NOW) == {}
+    assert rebalancer.advise("driver1", NOW) is None
+
+def test_init_app_reads_config(app):
+    app.config.update(REBALANCE_HALF_LIFE_MINUTES=10, REBALANCE_MIN_GAIN=0.5, REBALANCE_MAX_MOVE=3)
+    rebalancer = DemandRebalancer()
+    rebalancer.init_app(app)
+    assert (rebalancer.half_life, rebalancer.min_gain, rebalancer.max_move) == (10, 0.5, 3)
@@ -0,0 +1,96 @@
+import pytest
+from app.models.users import delivery_graph, edges
+from app.utils.algo import best_route, best_routes
+from app.utils.distance_matrix import distance_matrix
+from app.utils.route_cache import RouteCache, route_cache
+from app.utils.route_solver import route_solver
+
+@pytest.fixture
+def sample_graph():
+    """The built-in sample network and an empty shared cache"""
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    distance_matrix.invalidate()
+    route_cache.hits = route_cache.misses = 0
+    yield
+    distance_matrix.invalidate()
+
+def test_lru_eviction():
+    """The least recently used entry goes first once the cache is full"""
+    cache = RouteCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 2, 'maxsize': 2}
+
+def test_disabled_cache():
+    cache = RouteCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()['size'] == 0
+
+def test_best_route_is_memoised(sample_graph, monkeypatch):
+    """A repeated order shape skips the route solver, in any store order"""
+    calls = []
+    original = route_solver.solve
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(route_solver, 'solve', counting)
+
+    snapshot = distance_matrix.snapshot()
+    first = best_route(snapshot, "Admin Office", ["Store A", "Store C"], "Customer 1")
+    second = best_route(snapshot, "Admin Office", ["Store C", "Store A"], "Customer 1")
+
+    assert first == second
+    assert len(calls) == 1
+    assert route_cache.stats()['hits'] == 1
+
+def test_unreachable_routes_are_cached(sample_graph):
+    snapshot = distance_matrix.snapshot()
+    assert best_route(snapshot, "Nowhere", ["Store A"], "Customer 1") == (float('inf'), None)
+    assert best_route(snapshot, "Nowhere", ["Store A"], "Customer 1") == (float('inf'), None)
+    assert route_cache.stats()['hits'] == 1
+
+def test_graph_change_clears_cache(sample_graph):
+    """Invalidating the distance matrix empties the cache and new routes use the new graph"""
+    snapshot = distance_matrix.snapshot()
+    assert best_route(snapshot, "Admin Office", ["Store A"], "Customer 1")[0] == 9
+    assert route_cache.stats()['size'] > 0
+
+    delivery_graph.add_edge("Admin Office", "Store A", weight=1)
+    distance_matrix.invalidate()
+    assert route_cache.stats()['size'] == 0
+    assert best_route(distance_matrix.snapshot(), "Admin Office", ["Store A"], "Customer 1")[0] == 5
+
+def test_init_app_reads_config(app):
+    app.config['ROUTE_CACHE_SIZE'] = 16
+    cache = RouteCache()
+    cache.put("a", 1)
+    cache.init_app(app)
+    assert cache.maxsize == 16
+    assert cache.stats()['size'] == 0
+
+def test_best_routes_batches_misses(sample_graph, monkeypatch):
+    """Uncached starts are solved in one call and agree with best_route"""
+    calls = []
+    original = route_solver.solve_many
+    def counting(dist, starts, *args):
+        calls.append(list(starts))
+        return original(dist, starts, *args)
+    monkeypatch.setattr(route_solver, 'solve_many', counting)
+
+    snapshot = distance_matrix.snapshot()
+    stores = ["Store A", "Store B"]
+    cached = best_route(snapshot, "Customer 2", stores, "Customer 1")
+    routes = best_routes(snapshot, ["Admin Office", "Customer 2", "Customer 3", "Admin Office"], stores, "Customer 1")
+
+    assert [len(starts) for starts in calls] == [2]  # Admin Office and Customer 3, once each
+    assert routes["Customer 2"] == cached
+    for node in ("Admin Office", "Customer 3"):
+        route_cache.clear()
+        assert best_route(snapshot, node, stores, "Customer 1") == routes[node]
@@ -0,0 +1,142 @@
+import itertools
+import time
+import pytest
+import numpy as np
+import app.utils.route_solver as route_solver_module
+from app.utils.route_solver import (RouteSolver, brute_force_route, brute_force_routes, held_karp_route,
+                                    local_search_route, permutation_table, route_length)
+
+def random_distances(size, seed):
+    """Symmetric distance matrix between random points in the plane"""
+    rng = np.random.default_rng(seed)
+    points = rng.random((size, 2)) * 10
+    return np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+
+@pytest.mark.parametrize("stop_count", [1, 2, 5, 7])
+def test_held_karp_matches_brute_force(stop_count):
+    """Held-Karp should find the same optimal distance as trying every permutation"""
+    dist = random_distances(stop_count + 2, seed=stop_count)
+    stops = list(range(1, stop_count + 1))
+    end = stop_count + 1
+
+    expected, _ = brute_force_route(dist, 0, stops, end)
+    distance, order = held_karp_route(dist, 0, stops, end)
+
+    assert distance == pytest.approx(expected)
+    assert sorted(order) == stops
+    assert route_length(dist, 0, order, end) == pytest.approx(distance)
+
+def test_permutation_table():
+    assert permutation_table(3).tolist() == [list(p) for p in itertools.permutations(range(3))]
+    assert permutation_table(3) is permutation_table(3)  # Built once per stop count
+    assert permutation_table(0).shape == (1, 0)
+
+@pytest.mark.parametrize("stop_count", [0, 1, 3, 6])
+def test_brute_force_routes_every_start(stop_count, monkeypatch):
+    """Scoring many starts at once gives each start its own optimal route"""
+    monkeypatch.setattr(route_solver_module, 'BRUTE_FORCE_BLOCK', 100)  # Several blocks
+    dist = random_distances(stop_count + 12, seed=stop_count)
+    starts = list(range(10))
+    stops = list(range(10, 10 + stop_count))
+    end = 10 + stop_count
+
+    for start, (distance, order) in zip(starts, brute_force_routes(dist, starts, stops, end)):
+        best = min(itertools.permutations(stops), key=lambda perm: route_length(dist, start, perm, end))
+        assert distance == pytest.approx(route_length(dist, start, best, end))
+        assert route_length(dist, start, order, end) == pytest.approx(distance)
+
+def test_brute_force_routes_unreachable_start():
+    dist = random_distances(6, seed=2)
+    dist[0, 2:] = np.inf
+    results = brute_force_routes(dist, [0, 1], [2, 3, 4], 5)
+    assert results[0] == (float('inf'), None)
+    assert results[1][0] < float('inf')
+
+def test_solve_many_matches_solve():
+    solver = RouteSolver(brute_force_max_stops=3)
+    dist = random_distances(10, seed=4)
+    for stops in ([4, 5, 6], [4, 5, 6, 7, 8]):  # Vectorised brute force, then Held-Karp
+        assert solver.solve_many(dist, [0, 1, 2], stops, 9) == [solver.solve(dist, start, stops, 9)
+                                                                for start in (0, 1, 2)]
+
+def test_held_karp_unreachable_stop():
+    """A stop that cannot be reached means there is no route"""
+    dist = random_distances(5, seed=1)
+    dist[:, 2] = np.inf
+    dist[2, :] = np.inf
+    dist[2, 2] = 0
+
+    distance, order = held_karp_route(dist, 0, [1, 2, 3], 4)
+    assert distance == float('inf')
+    assert order is None
+
+def test_local_search_visits_every_stop():
+    """The heuristic returns a complete route close to the optimum"""
+    dist = random_distances(10, seed=7)
+    stops = list(range(1, 9))
+
+    optimum, _ = held_karp_route(dist, 0, stops, 9)
+    distance, order = local_search_route(dist, 0, stops, 9, time_budget=1.0)
+
+    assert sorted(order) == stops
+    assert distance == pytest.approx(route_length(dist, 0, order, 9))
+    assert distance <= optimum * 1.25
+
+def test_local_search_respects_time_budget():
+    """Even with no time budget the heuristic returns a usable route"""
+    dist = random_distances(42, seed=3)
+    stops = list(range(1, 41))
+
+    distance, order = local_search_route(dist, 0, stops, 41, time_budget=0)
+    assert sorted(order) == stops
+    assert distance < float('inf')
+
+def test_route_solver_picks_solver_by_size():
+    """Small orders use brute force, medium Held-Karp and large the heuristic"""
+    used = []
+
+    def recorder(name):
+        def solve(dist, start, stops, end, **kwargs):
+            used.append(name)
+            return 1.0, list(stops)
+        return solve
+
+    solver = RouteSolver(brute_force=recorder('brute_force'), exact=recorder('exact'),
+                         heuristic=recorder('heuristic'), brute_force_max_stops=2, exact_max_stops=4)
+    dist = random_distances(8, seed=0)
+
+    solver.solve(dist, 0, [1, 2], 7)
+    solver.solve(dist, 0, [1, 2, 3, 4], 7)
+    solver.solve(dist, 0, [1, 2, 3, 4, 5], 7)
+    assert used == ['brute_force', 'exact', 'heuristic']
+
+def test_solve_many_shares_one_time_budget():
+    """Large routes for many starts share the budget instead of getting one each"""
+    budgets = []
+
+    def heuristic(dist, start, stops, end, time_budget):
+        budgets.append(time_budget)
+        time.sleep(0.01)
+        return 1.0, list(stops)
+
+    solver = RouteSolver(heuristic=heuristic, brute_force_max_stops=1, exact_max_stops=2, time_budget=0.03)
+    dist = random_distances(8, seed=0)
+    solver.solve_many(dist, range(6), [1, 2, 3], 7)
+    assert budgets[0] <= 0.03
+    assert budgets[-3:] == [0.0, 0.0, 0.0]
+
+    # An earlier deadline, e.g. one set at the start of a dispatch, wins
+    budgets.clear()
+    solver.solve_many(dist, range(2), [1, 2, 3], 7, deadline=time.perf_counter() - 1)
+    assert budgets == [0.0, 0.0]
+
+def test_route_solver_init_app(app):
+    """Thresholds are read from the app config"""
+    app.config['ROUTE_SOLVER_BRUTE_FORCE_MAX_STOPS'] = 5
+    app.config['ROUTE_SOLVER_EXACT_MAX_STOPS'] = 9
+    app.config['ROUTE_SOLVER_TIME_BUDGET'] = 0.2
+    solver = RouteSolver()
+    solver.init_app(app)
+    assert solver.brute_force_max_stops == 5
+    assert solver.exact_max_stops == 9
+    assert solver.time_budget == 0.2
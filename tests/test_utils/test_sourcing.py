@@ -0,0 +1,103 @@
+import itertools
+import pytest
+from app.models.stores import stores
+from app.models.users import delivery_graph, edges
+from app.utils.distance_matrix import distance_matrix
+from app.utils.sourcing import SourcingOptimizer, store_node, unit_price
+
+@pytest.fixture(autouse=True)
+def sample_graph():
+    """The built-in sample network, with stock restored after each test"""
+    saved_stock = {store_id: {name: item["stock"] for name, item in store["items"].items()}
+                   for store_id, store in stores.items()}
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    distance_matrix.invalidate()
+
+    yield
+
+    for store_id, stock in saved_stock.items():
+        for name, amount in stock.items():
+            stores[store_id]["items"][name]["stock"] = amount
+
+def exhaustive(optimizer, lines, customer_node):
+    """Cheapest plan by trying every store for every item"""
+    snapshot = distance_matrix.snapshot()
+    options = [[store_id for store_id, store in stores.items()
+                if name in store["items"] and store["items"][name]["stock"] >= quantity]
+               for name, (quantity, _) in lines.items()]
+    best = float('inf')
+    for choice in itertools.product(*options):
+        price = sum(unit_price(stores[store_id]["items"][name]) * quantity
+                    for (name, (quantity, _)), store_id in zip(lines.items(), choice))
+        route = optimizer.route_cost(snapshot, sorted(set(choice)), customer_node)
+        best = min(best, price + optimizer.cost_per_km * route)
+    return best
+
+def test_cheapest_store_when_distance_is_free():
+    """With a negligible distance cost every item comes from its cheapest store"""
+    optimizer = SourcingOptimizer(cost_per_km=1e-9)
+    assignment, _ = optimizer.plan({"Apple": (1, 1), "Cheese": (1, 3), "Orange": (1, 2)}, "Customer 1")
+    assert assignment == {"Apple": 1, "Cheese": 3, "Orange": 3}
+
+def test_consolidates_stores():
+    """Paying a little more for Apples at Store C saves the detour to Store A"""
+    optimizer = SourcingOptimizer(cost_per_km=2.0)
+    assignment, cost = optimizer.plan({"Apple": (1, 1), "Cheese": (1, 3), "Orange": (1, 3)}, "Customer 1")
+
+    assert assignment == {"Apple": 3, "Cheese": 3, "Orange": 3}
+    # 11 + 80 + 13.3 in prices, Store C -> Customer 1 is 6 km
+    assert cost == pytest.approx(104.3 + 2.0 * 6)
+
+def test_free_start_route_cost():
+    """The pickup route may start at any of the chosen stores"""
+    snapshot = distance_matrix.snapshot()
+    optimizer = SourcingOptimizer()
+    # Store C -> Store A -> Customer 1 (4 + 4) beats Store A -> Store C -> Customer 1 (4 + 6)
+    assert optimizer.route_cost(snapshot, [1, 3], "Customer 1") == 8
+    assert optimizer.route_cost(snapshot, [], "Customer 1") == 0
+
+def test_out_of_stock_items_stay_put():
+    """Lines no store can fill keep the store they were added from"""
+    stores[2]["items"]["Coffee"]["stock"] = 1
+    optimizer = SourcingOptimizer()
+    assignment, _ = optimizer.plan({"Coffee": (5, 2), "Apple": (1, 1)}, "Customer 3")
+    assert assignment["Coffee"] == 2
+
+@pytest.mark.parametrize("customer_node", ["Customer 1", "Customer 2", "Customer 3"])
+@pytest.mark.parametrize("cost_per_km", [0.5, 2.0, 10.0])
+def test_matches_exhaustive_search(customer_node, cost_per_km):
+    """Branch and bound finds the same optimum as trying every assignment"""
+    optimizer = SourcingOptimizer(cost_per_km=cost_per_km)
+    lines = {"Apple": (2, 1), "Milk": (1, 3), "Yogurt": (1, 2), "Bread": (1, 1), "Orange": (3, 3)}
+    _, cost = optimizer.plan(lines, customer_node)
+    assert cost == pytest.approx(exhaustive(optimizer, lines, customer_node))
+
+def test_node_budget_falls_back_to_cheapest_prices():
+    """With no search budget the plan is the cheapest store per item"""
+    optimizer = SourcingOptimizer(cost_per_km=2.0, max_nodes=0)
+    assignment, _ = optimizer.plan({"Apple": (1, 1), "Cheese": (1, 3), "Orange": (1, 3)}, "Customer 1")
+    assert assignment == {"Apple": 1, "Cheese": 3, "Orange": 3}
+
+def test_source_cart_updates_prices():
+    """Moved lines take their price, discount and location from the new store"""
+    cart = {
+        "Apple": {"name": "Apple", "price": 10, "discount": 0, "final_price": 10, "quantity": 1, "store_id": 1},
+        "Cheese": {"name": "Cheese", "price": 80, "discount": 0, "final_price": 80, "quantity": 1, "store_id": 3},
+    }
+    sourced = SourcingOptimizer(cost_per_km=2.0).source_cart(cart, "Customer 1")
+
+    assert sourced["Apple"]["store_id"] == 3
+    assert sourced["Apple"]["final_price"] == 11
+    assert sourced["Apple"]["store_location"] == stores[3]["location"]
+    assert sourced["Cheese"] == cart["Cheese"]
+    assert cart["Apple"]["store_id"] == 1  # The original cart is not modified
+
+def test_disabled_leaves_cart_alone():
+    """SOURCING_COST_PER_KM = 0 keeps the stores chosen by add_to_cart"""
+    cart = {"Apple": {"name": "Apple", "final_price": 10, "quantity": 1, "store_id": 2}}
+    assert SourcingOptimizer(cost_per_km=0).source_cart(cart, "Customer 1") is cart
+
+def test_store_node():
+    assert store_node(1) == "Store A"
+    assert store_node("3") == "Store C"
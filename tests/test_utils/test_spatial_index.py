@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+from app.utils.spatial_index import KDTree, SpatialIndex
+
+def test_kdtree_matches_brute_force():
+    """Nearest neighbour from the tree should equal a linear scan"""
+    rng = np.random.default_rng(42)
+    points = rng.random((500, 2)) * 100
+    tree = KDTree(points)
+
+    for query in rng.random((200, 2)) * 120 - 10:
+        expected = np.linalg.norm(points - query, axis=1).min()
+        found = tree.nearest(query)
+        assert np.linalg.norm(points[found] - query) == pytest.approx(expected)
+
+def test_kdtree_exact_match_and_empty():
+    """Exact coordinates map to their own point, an empty tree finds nothing"""
+    tree = KDTree([(0, 0), (-1, 1), (1, 1), (1, 0)])
+    assert tree.nearest((1, 1)) == 2
+    assert KDTree([]).nearest((0, 0)) == -1
+
+def test_spatial_index_snaps_to_nearest_node():
+    """Locations snap to the nearest node, missing locations give None"""
+    positions = {"Admin Office": (0, 0), "Store A": (-1, 1), "Customer 1": (1, 0)}
+    index = SpatialIndex(positions)
+
+    assert index.nearest_node((1, 0)) == "Customer 1"
+    assert index.nearest_node((-0.9, 1.2)) == "Store A"
+    assert index.nearest_node((100, 0)) == "Customer 1"
+    assert index.nearest_node(None) is None
+
+def test_spatial_index_rebuilds_after_invalidate():
+    """New positions are only picked up once the index is invalidated"""
+    positions = {"Admin Office": (0, 0)}
+    index = SpatialIndex(positions)
+    assert index.nearest_node((5, 5)) == "Admin Office"
+
+    positions["Store D"] = (5, 5)
+    assert index.nearest_node((5, 5)) == "Admin Office"  # Still the cached tree
+
+    index.invalidate()
+    assert index.nearest_node((5, 5)) == "Store D"
@@ -0,0 +1,163 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from app.models.stores import orders, active_orders_by_driver, index_active_order
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.algo import assign_driver, order_eta
+from app.utils.distance_matrix import distance_matrix
+from app.utils.travel_times import TravelTimes, travel_times
+
+RUSH_HOUR = 8 * 60  # minutes after midnight
+NOON = 12 * 60
+
+def rush_hour_profile(free_flow, jammed):
+    """Travel minutes per 15 minute bucket, jammed between 7:00 and 9:00"""
+    minutes = np.full(96, float(free_flow))
+    minutes[28:36] = jammed
+    return minutes
+
+@pytest.fixture
+def setup_test_data():
+    """Sample delivery network, driver_a at Store A and driver_b at the Admin Office"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.invalidate()
+    users[:] = [
+        {"username": "driver_a", "user_type": "Delivery Agent", "location": (-1, 1)},
+        {"username": "driver_b", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "customer1", "user_type": "Customer", "location": (1, 0)},
+    ]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    travel_times.profiles.clear()
+    travel_times.objective = 'distance'
+    distance_matrix.invalidate()
+
+def clock(hour):
+    return lambda: datetime(2025, 4, 1, hour)
+
+def test_bucket_of():
+    times = TravelTimes(distance_matrix)
+    assert times.buckets == 96
+    assert times.bucket_of(datetime(2025, 4, 1, 8, 14)) == 32
+    assert times.bucket_of(8 * 60 + 15) == 33
+    assert times.bucket_of(24 * 60 + 5) == 0  # Past midnight
+
+def test_profiles_need_one_value_per_bucket():
+    with pytest.raises(ValueError):
+        TravelTimes(distance_matrix).set_profile("Store A", "Store C", [5.0] * 24)
+
+def test_free_flow_matches_distances(setup_test_data):
+    """Without profiles travel times are the distances driven at speed_kmh"""
+    snapshot = TravelTimes(distance_matrix, speed_kmh=30).snapshot(NOON)
+    nodes = distance_matrix.snapshot().nodes
+    assert np.allclose(snapshot.submatrix(nodes), distance_matrix.snapshot().submatrix(nodes) * 2)
+
+def test_snapshots_are_cached_per_bucket(setup_test_data):
+    times = TravelTimes(distance_matrix, cached_buckets=2)
+    times.set_profile("Store A", "Store C", rush_hour_profile(8, 60))
+    first = times.snapshot(RUSH_HOUR)
+    assert times.snapshot(RUSH_HOUR + 10) is first  # Same bucket
+    assert first.distance("Store A", "Store C") == 10  # Round Store B instead
+
+    noon = times.snapshot(NOON)
+    assert noon is not first
+    assert noon.distance("Store A", "Store C") == 8
+    assert noon.version != first.version != distance_matrix.snapshot().version
+
+    times.snapshot(NOON + 60)
+    assert times.snapshot(RUSH_HOUR) is not first  # Evicted
+    distance_matrix.invalidate()
+    times.invalidate()
+    assert times.snapshot(NOON) is not noon
+
+def test_time_dependent_route(setup_test_data):
+    """Each edge costs its profile value for the time the driver enters it"""
+    times = TravelTimes(distance_matrix)
+    times.set_profile("Store A", "Customer 1", rush_hour_profile(8, 30))
+    route = ["Admin Office", "Store A", "Customer 1"]
+    assert times.route_minutes(route, NOON) == 10 + 8
+    assert times.route_minutes(route, 6 * 60 + 45) == 10 + 8  # At Store A by 6:55, before the jam
+    assert times.route_minutes(route, 6 * 60 + 55) == 10 + 8 + 12  # At Store A at 7:05, round Store C
+    assert times.travel_minutes("Store A", "Nowhere", NOON) == float('inf')
+
+def test_profile_file(tmp_path):
+    path = tmp_path / "profiles.csv"
+    path.write_text("u,v,minutes\nStore A,Store C," + ",".join(["9"] * 96) + "\n")
+    times = TravelTimes(distance_matrix)
+    times.load_profiles(str(path))
+    assert list(times.profiles) == [("Store A", "Store C")]
+    assert times.profiles["Store A", "Store C"][0] == 9
+
+def test_dispatch_on_eta(setup_test_data, monkeypatch):
+    """The closest driver by distance loses when the roads out of their store are jammed"""
+    monkeypatch.setattr(travel_times, 'objective', 'eta')
+    for u, v, km in edges:
+        if "Store A" in (u, v):
+            travel_times.set_profile(u, v, rush_hour_profile(2 * km, 60))
+    order = {"order_id": "ORD-1", "customer_id": "customer1", "customer_location": (1, 0),
+             "items_by_store": {3: {"Cheese": 1}}}
+
+    monkeypatch.setattr(travel_times, 'clock', clock(8))
+    assert assign_driver(order) == ("driver_b", [3])
+    monkeypatch.setattr(travel_times, 'clock', clock(12))
+    assert assign_driver(order) == ("driver_a", [3])
+
+    monkeypatch.setattr(travel_times, 'objective', 'distance')
+    monkeypatch.setattr(travel_times, 'clock', clock(8))
+    assert assign_driver(order) == ("driver_a", [3])
+
+def test_order_eta(setup_test_data):
+    """ETAs include the driver's earlier orders and skip collected stores"""
+    first = {"order_id": "ORD-1", "customer_id": "customer1", "customer_location": (-2, 0),
+             "items_by_store": {1: {"Apple": 1}}, "optimized_store_order": [1], "status": "collected",
+             "delivery_agent": "driver_b", "delivered": False}
+    second = {"order_id": "ORD-2", "customer_id": "customer1", "customer_location": (1, 0),
+              "items_by_store": {3: {"Tea": 1}}, "optimized_store_order": [3], "status": "processing",
+              "delivery_agent": "driver_b", "delivered": False}
+    for order in (first, second):
+        orders[order["order_id"]] = order
+        index_active_order(order["order_id"], order)
+
+    # 2 minutes per km: Admin Office -> Customer 2 (8 km), Store C (4 km), Customer 1 (6 km)
+    assert order_eta(first, NOON) == 16
+    assert order_eta(second, NOON) == 16 + 8 + 12
+    assert order_eta(dict(second, delivery_agent=None), NOON) is None
+    second["delivered"] = True
+    assert order_eta(second, NOON) is None
+
+def test_order_eta_is_cached(setup_test_data, monkeypatch):
+    """Repeated ETAs reuse the last result until the route or the traffic bucket changes"""
+    order = {"order_id": "ORD-1", "customer_id": "customer1", "customer_location": (1, 0),
+             "items_by_store": {3: {"Tea": 1}}, "optimized_store_order": [3], "status": "processing",
+             "delivery_agent": "driver_b", "delivered": False}
+    orders["ORD-1"] = order
+    index_active_order("ORD-1", order)
+    searches = []
+    original = travel_times.route_minutes
+    def counting(nodes, when=None):
+        searches.append(list(nodes))
+        return original(nodes, when)
+    monkeypatch.setattr(travel_times, 'route_minutes', counting)
+
+    eta = order_eta(order, NOON)
+    assert order_eta(order, NOON + 5) == eta
+    assert len(searches) == 1
+    assert order_eta(order, NOON + 15) == eta  # Next bucket, searched again
+    order["status"] = "collected"
+    assert order_eta(order, NOON + 15) < eta  # Store C already visited
+    assert len(searches) == 3
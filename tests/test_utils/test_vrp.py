@@ -0,0 +1,218 @@
+from datetime import datetime, timedelta
+import pytest
+from app.models.stores import (orders, active_orders_by_driver, planned_stops_by_driver, pending_orders,
+                               index_active_order)
+from app.models.users import users, delivery_graph, edges, graph_positions
+from app.utils.batch_dispatch import BatchDispatcher
+from app.utils.distance_matrix import distance_matrix
+from app.utils.insertion import InsertionDispatcher, insertion_dispatcher
+from app.utils.nearest_drivers import nearest_drivers
+from app.utils.travel_times import travel_times
+from app.utils.vrp import VRPSolver, order_size, precedence_ok, route_cost, vrp_solver
+
+INF = float('inf')
+NOW = datetime(2025, 4, 1, 12)
+
+def line_minutes(points):
+    """Travel minutes between points on a line"""
+    return [[abs(a - b) for b in points] for a in points]
+
+def vehicle(start=0, capacity=10, load=0, shift_end=INF):
+    return {"start": start, "ready": 0.0, "capacity": capacity, "load": load, "shift_end": shift_end}
+
+def job(name, pickup, drop, items=1):
+    """Stops of a job with one pickup and one drop-off"""
+    return [(pickup, name, items, False, 1), (drop, name, items, True, None)]
+
+@pytest.fixture
+def setup_test_data(monkeypatch):
+    """Sample delivery network, driver1 at the Admin Office and driver2 at Customer 1, at noon"""
+    saved_users = list(users)
+    saved_positions = dict(graph_positions)
+    orders.clear()
+    active_orders_by_driver.clear()
+    planned_stops_by_driver.clear()
+    delivery_graph.clear()
+    delivery_graph.add_weighted_edges_from(edges)
+    graph_positions.update({
+        "Admin Office": (0, 0), "Store A": (-1, 1), "Store B": (-1, -1), "Store C": (1, 1),
+        "Customer 1": (1, 0), "Customer 2": (-2, 0), "Customer 3": (0, -1),
+    })
+    distance_matrix.invalidate()
+    monkeypatch.setattr(travel_times, 'clock', lambda: NOW)
+    users[:] = [
+        {"username": "driver1", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "driver2", "user_type": "Delivery Agent", "location": (1, 0)},
+    ]
+
+    yield
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    planned_stops_by_driver.clear()
+    pending_orders.clear()
+    users[:] = saved_users
+    graph_positions.clear()
+    graph_positions.update(saved_positions)
+    distance_matrix.invalidate()
+
+def make_order(order_id, items_by_store, location=(1, 0), driver=None, status="processing", promised_in=60):
+    order = {"order_id": order_id, "customer_id": "customer1", "customer_location": location,
+             "items_by_store": items_by_store, "delivery_agent": driver, "optimized_store_order": [],
+             "status": status, "delivered": False,
+             "promised_by": (NOW + timedelta(minutes=promised_in)).isoformat()}
+    if driver:
+        orders[order_id] = order
+        index_active_order(order_id, order)
+    return order
+
+def test_route_cost():
+    minutes = line_minutes([0, 10, 20])
+    route = job("A", 1, 2, items=2)
+    assert route_cost(minutes, vehicle(), route, {}, 0, 10, 0) == (20, 0)
+    assert route_cost(minutes, vehicle(), route, {"A": (-INF, 15)}, 0, 10, 0) == (20 + 10 * 5, 5)
+    assert route_cost(minutes, vehicle(), route, {}, 0, 10, 1) == (20 + 20, 0)  # Customer waits 20 minutes
+    assert route_cost(minutes, vehicle(), route, {"A": (30, 40)}, 0, 10, 0) == (20, 0)  # Waits for the window
+
+    assert route_cost(minutes, vehicle(capacity=1), route, {}) is None
+    assert route_cost(minutes, vehicle(load=9), route, {}) is None  # Already carrying 9 items
+    assert route_cost(minutes, vehicle(shift_end=15), route, {}, 0) is None
+    minutes[0][1] = INF
+    assert route_cost(minutes, vehicle(), route, {}) is None
+
+def test_precedence():
+    assert precedence_ok(job("A", 1, 2) + job("B", 1, 2))
+    assert precedence_ok([(2, "A", 1, True, None)])  # Already collected
+    assert not precedence_ok(job("A", 1, 2)[::-1])
+
+def test_order_size():
+    assert order_size({"items_by_store": {1: {"Apple": 2, "Tea": 1}, "3": {"Milk": 4}}}) == 7
+
+def test_tight_windows_spread_orders():
+    """Two orders that would both be late on one driver go to two drivers"""
+    minutes = line_minutes([0, 10, 20])
+    vehicles = [vehicle(), vehicle()]
+    jobs = {"A": job("A", 1, 2), "B": job("B", 1, 2)}
+    windows = {"A": (-INF, 25), "B": (-INF, 25)}
+
+    solver = VRPSolver(service_minutes=5, waiting_weight=0)
+    routes, assignment = solver.solve(minutes, vehicles, [[], []], jobs, windows)
+    assert sorted(assignment.values()) == [0, 1]
+    assert all(route_cost(minutes, vehicles[v], routes[v], windows, 5)[1] == 0 for v in (0, 1))
+
+    # Without deadlines stacking both on one driver saves driving
+    _, assignment = solver.solve(minutes, vehicles, [[], []], jobs, {})
+    assert assignment["A"] == assignment["B"]
+
+def test_capacity():
+    minutes = line_minutes([0, 10, 20])
+    vehicles = [vehicle(capacity=3)]
+    jobs = {"A": job("A", 1, 2, items=2), "B": job("B", 1, 2, items=2), "C": job("C", 1, 2, items=4)}
+    routes, assignment = VRPSolver().solve(minutes, vehicles, [[]], jobs, {})
+
+    assert assignment == {"A": 0, "B": 0, "C": None}
+    # A and B don't fit together, so one is delivered before the other is picked up
+    assert [stop[1:4:2] for stop in routes[0]] in (
+        [("A", False), ("A", True), ("B", False), ("B", True)],
+        [("B", False), ("B", True), ("A", False), ("A", True)])
+
+def test_shift_end():
+    minutes = line_minutes([0, 10, 20, 30])
+    vehicles = [vehicle(start=0, shift_end=15), vehicle(start=3)]
+    _, assignment = VRPSolver(service_minutes=0).solve(minutes, vehicles, [[], []], {"A": job("A", 1, 2)}, {})
+    assert assignment == {"A": 1}
+
+def test_time_budget_bounds_construction():
+    """Out of time, remaining jobs are appended to the cheapest route rather than searched for"""
+    minutes = line_minutes([0, 10, 20, 30])
+    vehicles = [vehicle(start=0, capacity=3), vehicle(start=3)]
+    jobs = {"A": job("A", 1, 2), "B": job("B", 2, 1, items=4), "C": job("C", 3, 2)}
+    routes, assignment = VRPSolver(service_minutes=0, time_budget=0).solve(minutes, vehicles, [[], []], jobs, {})
+
+    # In arrival order, each at the end of a route: B does not fit on vehicle 0,
+    # and C adds 20 minutes after A against 30 after B
+    assert assignment == {"A": 0, "B": 1, "C": 0}
+    assert routes == [jobs["A"] + jobs["C"], jobs["B"]]
+
+def test_existing_stops_are_reordered():
+    """A driver's committed stops are resequenced when that is shorter"""
+    minutes = line_minutes([0, 10, 20])
+    committed = [(2, "A", 1, True, None), (1, "B", 1, True, None)]  # Collected orders, driving back and forth
+    routes, assignment = VRPSolver(service_minutes=0).solve(minutes, [vehicle(load=2)], [committed], {}, {})
+    assert assignment == {}
+    assert routes[0] == committed[::-1]
+
+def test_pickup_sequence():
+    """Multi-store orders visit their stores in the best order"""
+    minutes = line_minutes([0, 20, 10, 30])
+    stops = [(1, "A", 1, False, 1), (2, "A", 1, False, 2), (3, "A", 2, True, None)]
+    routes, _ = VRPSolver(service_minutes=0).solve(minutes, [vehicle()], [[]], {"A": stops}, {})
+    assert [stop[0] for stop in routes[0]] == [2, 1, 3]
+
+def test_vrp_strategy_plans_stops(setup_test_data):
+    dispatcher = InsertionDispatcher(strategy='vrp')
+    assert dispatcher.enabled
+    order = make_order("ORD-1", {1: {"Apple": 2}}, location=(-2, 0))
+
+    assert dispatcher.assign(order) == ("driver2", [1])
+    assert [stop["node"] for stop in planned_stops_by_driver["driver2"]] == ["Store A", "Customer 2"]
+
+def test_large_fleets_plan_only_nearby_drivers(setup_test_data, monkeypatch):
+    """Drivers far from every order of the batch get no vehicle"""
+    users.append({"username": "driver3", "user_type": "Delivery Agent", "location": (-1, -1)})  # At Store B
+    monkeypatch.setattr(nearest_drivers, 'min_drivers', 1)
+    monkeypatch.setattr(nearest_drivers, 'k', 1)
+    nearest_drivers.invalidate()
+    planned = []
+    solve = vrp_solver.solve
+    def recording(matrix, vehicles, routes, jobs, windows):
+        planned.append(len(vehicles))
+        return solve(matrix, vehicles, routes, jobs, windows)
+    monkeypatch.setattr(vrp_solver, 'solve', recording)
+
+    results, _ = vrp_solver.plan([make_order("ORD-1", {2: {"Tea": 1}}, location=(-2, 0))], users,
+                                 InsertionDispatcher().driver_stops)
+    nearest_drivers.invalidate()
+    assert planned == [1]
+    assert results["ORD-1"] == ("driver3", [2])
+
+def test_collected_orders_count_as_load(setup_test_data):
+    """A driver carrying a full load can't pick up more before delivering it"""
+    users[0]["capacity"] = 3
+    make_order("ORD-1", {1: {"Apple": 3}}, location=(-2, 0), driver="driver1", status="collected")
+    order = make_order("ORD-2", {2: {"Tea": 1}}, location=(-2, 0))
+
+    driver, _ = InsertionDispatcher(strategy='vrp').assign(order, [users[0]])
+    assert driver == "driver1"
+    stops = [(stop["order_id"], stop["node"]) for stop in planned_stops_by_driver["driver1"]]
+    # The store pickup of the collected order is skipped and ORD-1 is dropped off first
+    assert stops == [("ORD-1", "Customer 2"), ("ORD-2", "Store B"), ("ORD-2", "Customer 2")]
+
+def test_unplaceable_order(setup_test_data):
+    for user in users:
+        user["capacity"] = 1
+    order = make_order("ORD-1", {1: {"Apple": 2}})
+    assert InsertionDispatcher(strategy='vrp').assign(order) == (None, [])
+    assert not planned_stops_by_driver
+
+def test_batch_flush_uses_vrp(setup_test_data, monkeypatch):
+    """With the vrp strategy a batch is planned jointly, a driver may take several orders"""
+    monkeypatch.setattr(insertion_dispatcher, 'strategy', 'vrp')
+    users[:] = users[:1]
+    dispatcher = BatchDispatcher()
+    batch = [make_order(f"ORD-{i}", {1: {"Apple": 1}}, location=(-2, 0)) for i in range(3)]
+    for order in batch:
+        orders[order["order_id"]] = dict(order)
+        dispatcher.submit(order)
+
+    results = dispatcher.flush()
+    assert {driver for driver, _ in results.values()} == {"driver1"}
+    assert all(orders[order["order_id"]]["delivery_agent"] == "driver1" for order in batch)
+    assert len(planned_stops_by_driver["driver1"]) == 6
+
+def test_init_app_reads_config(app):
+    app.config.update(VRP_DRIVER_CAPACITY=8, VRP_TIME_BUDGET=0.2, DELIVERY_PROMISE_MINUTES=45)
+    solver = VRPSolver()
+    solver.init_app(app)
+    assert (solver.capacity, solver.time_budget, solver.promise_minutes) == (8, 0.2, 45)
+    assert solver.promised_by(NOW) == "2025-04-01T12:45:00"
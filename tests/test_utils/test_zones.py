@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from app.models.stores import orders, active_orders_by_driver, index_active_order, release_active_order
+from app.models.users import users
+import app.utils.algo as algo
+from app.utils.algo import assign_driver
+from app.utils.distance_matrix import distance_matrix
+from app.utils.nearest_drivers import nearest_drivers
+from app.utils.zones import ZoneIndex
+from benchmarks.synthetic import install_world, make_basket, make_world
+
+@pytest.fixture
+def grid_fleet():
+    """A 10 x 10 grid of positions with one driver in each corner"""
+    saved_users = list(users)
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = [
+        {"username": "south-west", "user_type": "Delivery Agent", "location": (0, 0)},
+        {"username": "south-east", "user_type": "Delivery Agent", "location": (9, 0)},
+        {"username": "north-west", "user_type": "Delivery Agent", "location": (0, 9)},
+        {"username": "north-east", "user_type": "Delivery Agent", "location": (9, 9)},
+        {"username": "customer1", "user_type": "Customer", "location": (5, 5)},
+    ]
+    positions = {f"{x},{y}": (x, y) for x in range(10) for y in range(10)}
+
+    yield positions
+
+    orders.clear()
+    active_orders_by_driver.clear()
+    users[:] = saved_users
+
+def rings(zones, nodes):
+    return [(ring, sorted(driver["username"] for driver in drivers)) for ring, drivers in zones.candidate_rings(nodes)]
+
+def test_zone_of(grid_fleet):
+    zones = ZoneIndex(grid_fleet, cell_size=3)
+    zones.fleet_size()
+    assert zones.zone_of((0, 0)) == (0, 0)
+    assert zones.zone_of((4, 7)) == (1, 2)
+    assert zones.zone_of((9, 9)) == (3, 3)
+    assert zones.zone_of((50, -3)) == (3, 0)  # Clamped to the grid
+    assert zones.zone_of(None) is None
+
+def test_rings_widen_from_the_stores(grid_fleet):
+    """Drivers come out ring by ring, nearest zones first, each driver once"""
+    zones = ZoneIndex(grid_fleet, cell_size=3)
+    assert rings(zones, ["1,1"]) == [
+        (0, ["south-west"]), (1, []), (2, []), (3, ["north-east", "north-west", "south-east"])]
+    # Several stores: rings are measured from the nearest one
+    assert rings(zones, ["1,1", "9,9"]) == [
+        (0, ["north-east", "south-west"]), (1, []), (2, []), (3, ["north-west", "south-east"])]
+
+def test_unknown_nodes_search_everyone(grid_fleet):
+    zones = ZoneIndex(grid_fleet, cell_size=3)
+    assert [len(drivers) for _, drivers in zones.candidate_rings(["Nowhere"])] == [4]
+
+def test_busy_drivers_move_to_their_drop_off(grid_fleet, monkeypatch):
+    """Assigning and delivering orders re-files the driver through the listener"""
+    zones = ZoneIndex(grid_fleet, cell_size=3)
+    monkeypatch.setattr('app.models.stores.driver_listeners', [zones.driver_changed])
+    zones.fleet_size()
+
+    order = {"order_id": "ORD-1", "customer_location": (9, 1), "delivery_agent": "north-west"}
+    index_active_order("ORD-1", order)
+    assert rings(zones, ["9,0"])[0] == (0, ["north-west", "south-east"])
+
+    release_active_order("ORD-1", order)
+    assert rings(zones, ["9,0"])[0] == (0, ["south-east"])
+
+def test_invalidate_picks_up_new_fleet(grid_fleet):
+    zones = ZoneIndex(grid_fleet, cell_size=3)
+    assert zones.fleet_size() == 4
+    users.append({"username": "new", "user_type": "Delivery Agent", "location": (5, 5)})
+    assert zones.fleet_size() == 4
+    zones.invalidate()
+    assert zones.fleet_size() == 5
+
+def test_small_fleets_are_scored_in_full(grid_fleet):
+    assert not ZoneIndex(grid_fleet, min_drivers=5).should_use()
+    assert ZoneIndex(grid_fleet, min_drivers=4).should_use()
+    assert not ZoneIndex(grid_fleet, min_drivers=0).should_use()
+
+@pytest.fixture
+def city(monkeypatch):
+    """A synthetic city with a few hundred idle and busy drivers"""
+    world = make_world('grid', size=400, drivers=300, history=600, seed=1)
+    monkeypatch.setattr(nearest_drivers, 'min_drivers', 0)  # Test the zone search on its own
+    with install_world(world):
+        yield world
+
+def test_zoned_dispatch_scores_fewer_drivers(city, monkeypatch):
+    """assign_driver only scores nearby drivers and still returns an available one"""
+    zones = ZoneIndex(city["positions"], min_drivers=1, cell_size=4)
+    monkeypatch.setattr('app.utils.algo.zone_index', zones)
+
+    scored = []
+    original = algo.score_drivers
+    def counting(drivers, *args):
+        scored.extend(drivers)
+        return original(drivers, *args)
+    monkeypatch.setattr('app.utils.algo.score_drivers', counting)
+
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        scored.clear()
+        driver, route = assign_driver(make_basket(city, 2, rng))
+        assert driver is not None
+        assert len(scored) < len(city["users"])
+        assert len(route) == 2
+
+def test_zoned_dispatch_matches_full_scan(city, monkeypatch):
+    """With enough extra rings to cover the grid the zoned search is exact"""
+    rng = np.random.default_rng(1)
+    baskets = [make_basket(city, size, rng) for size in (1, 2, 4)]
+    monkeypatch.setattr('app.utils.algo.zone_index', ZoneIndex(city["positions"], min_drivers=0))
+    full = [assign_driver(basket) for basket in baskets]
+
+    zones = ZoneIndex(city["positions"], min_drivers=1, cell_size=4, extra_rings=100)
+    monkeypatch.setattr('app.utils.algo.zone_index', zones)
+    assert [assign_driver(basket) for basket in baskets] == full
+
+def test_graph_change_rebuilds(city):
+    """The shared index is rebuilt with the distance matrix"""
+    from app.utils.zones import zone_index
+    zone_index.fleet_size()
+    distance_matrix.invalidate()
+    assert not zone_index._built